@@ -0,0 +1,632 @@
+"""Performance benchmarks, run with `flask bench <name>`.
+
+Benchmarks build their own throwaway SQLite databases so they can be run
+against synthetic data at production scale without touching app.db.
+"""
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+import click
+from flask import Flask
+from flask.cli import AppGroup
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from src import related, search
+from src.counters import CounterBuffer
+from src.dbutil import assert_max_queries
+from src.forum_counters import forum_counter_deltas, rollup
+from src.models.user import User, db
+from src.models.news import NewsArticle, NewsCategory, NewsStatus
+from src.models.community import CommunityEvent, EventType, ForumCategory, ForumTopic, ForumPost, event_attendees
+from src.projection import NEWS_SUMMARY
+from src import registration
+from src.routes import community
+
+bench_cli = AppGroup('bench', help='Run performance benchmarks.')
+
+TERMS = (
+    'aerodynamic downforce drag wing diffuser floor porpoising ground effect '
+    'tyre degradation compound stint undercut overcut pit strategy safety car '
+    'energy recovery hybrid battery turbo fuel flow efficiency telemetry '
+    'chassis suspension stiffness ride height braking traction cornering '
+    'simulation wind tunnel cfd regulation budget cap reliability gearbox '
+    'qualifying race pace overtaking dirty air wake vortex sidepod cooling'
+).split()
+
+# Synthetic vocabulary with a Zipf-like frequency distribution, so that
+# common words match most rows and rare words only a handful
+VOCABULARY = TERMS + [f'{a}{b}' for a in TERMS for b in TERMS if a != b][:20000]
+CUM_WEIGHTS = list(itertools.accumulate(1.0 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=words))
+
+
+def _timings(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@bench_cli.command('search')
+@click.option('--papers', default=100000, show_default=True, help='Number of synthetic papers.')
+@click.option('--queries', default=100, show_default=True, help='Queries per strategy.')
+@click.option('--seed', default=42, show_default=True)
+def bench_search(papers, queries, seed):
+    """Compare ILIKE scans with the FTS5 index for research search"""
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE research_papers (id INTEGER PRIMARY KEY, title TEXT, "
+            "abstract TEXT, keywords TEXT, status TEXT, published_at TEXT)"
+        )
+        for statement in search.index_statements('research_papers'):
+            conn.execute(statement)
+
+        start = time.perf_counter()
+        rows = (
+            (i, _sentence(rng, 8), _sentence(rng, 60), ', '.join(rng.sample(TERMS, 4)),
+             'APPROVED', f'2024-01-01T00:00:{i % 60:02d}')
+            for i in range(1, papers + 1)
+        )
+        conn.executemany("INSERT INTO research_papers VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        click.echo(f"Inserted and indexed {papers} papers in {time.perf_counter() - start:.1f}s")
+
+        terms = [
+            f'{rng.choice(TERMS)} {_sentence(rng, 1)}' for _ in range(queries)
+        ]
+        term_iter = iter(terms * 2)
+
+        def ilike_query():
+            words = next(term_iter).split()
+            clauses = ' AND '.join(
+                '(title LIKE ? OR abstract LIKE ? OR keywords LIKE ?)' for _ in words
+            )
+            params = [f'%{w}%' for w in words for _ in range(3)]
+            conn.execute(
+                f"SELECT id FROM research_papers WHERE status = 'APPROVED' AND {clauses} "
+                f"ORDER BY published_at DESC LIMIT 20", params
+            ).fetchall()
+
+        def fts_query():
+            match = search.build_match_query(next(term_iter))
+            conn.execute(
+                f"SELECT p.id FROM research_papers p JOIN ("
+                f"SELECT rowid AS paper_id, {search.rank_expression()} AS rank "
+                f"FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH ?) m "
+                f"ON m.paper_id = p.id WHERE p.status = 'APPROVED' "
+                f"ORDER BY m.rank LIMIT 20", (match,)
+            ).fetchall()
+
+        for label, fn in (('ILIKE scan', ilike_query), ('FTS5 bm25', fts_query)):
+            median, p95 = _timings(fn, queries)
+            click.echo(f"{label:12s} median {median:8.2f} ms   p95 {p95:8.2f} ms")
+
+        conn.close()
+    finally:
+        os.remove(path)
+
+
+@bench_cli.command('related')
+@click.option('--papers', default=100000, show_default=True, help='Number of synthetic papers.')
+@click.option('--lookups', default=1000, show_default=True)
+@click.option('--top-k', default=20, show_default=True)
+@click.option('--seed', default=42, show_default=True)
+def bench_related(papers, lookups, top_k, seed):
+    """Time building, incrementally updating and reading related papers"""
+    rng = random.Random(seed)
+    documents = [
+        (i, related.paper_tokens(_sentence(rng, 8), _sentence(rng, 60), ', '.join(rng.sample(TERMS, 4))))
+        for i in range(1, papers + 1)
+    ]
+
+    start = time.perf_counter()
+    model = related.TfidfModel.fit(documents)
+    click.echo(f"Fitted {len(model.vocabulary)} terms over {papers} papers in {time.perf_counter() - start:.1f}s")
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE research_papers (id INTEGER PRIMARY KEY, title TEXT, status TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE research_related (paper_id INTEGER, rank INTEGER, related_id INTEGER, "
+            "score REAL, PRIMARY KEY (paper_id, rank))"
+        )
+        conn.executemany(
+            "INSERT INTO research_papers VALUES (?, ?, 'APPROVED')",
+            ((i, f'paper {i}') for i in range(1, papers + 1))
+        )
+
+        start = time.perf_counter()
+        rows = (
+            (int(model.paper_ids[row]), rank, int(model.paper_ids[column]), score)
+            for row, neighbours in related.all_neighbours(model.matrix, top_k)
+            for rank, (column, score) in enumerate(neighbours)
+        )
+        conn.executemany("INSERT INTO research_related VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+        click.echo(f"Precomputed top-{top_k} neighbours in {time.perf_counter() - start:.1f}s")
+
+        new_papers = iter([
+            related.paper_tokens(_sentence(rng, 8), _sentence(rng, 60), ', '.join(rng.sample(TERMS, 4)))
+            for _ in range(lookups)
+        ])
+        paper_ids = iter([rng.randint(1, papers) for _ in range(lookups)])
+
+        def incremental_update():
+            vector = model.transform([next(new_papers)])
+            related.vector_neighbours(model.matrix, vector, top_k * 5)
+
+        def lookup():
+            conn.execute(
+                "SELECT p.id, p.title, r.score FROM research_related r "
+                "JOIN research_papers p ON p.id = r.related_id "
+                "WHERE r.paper_id = ? AND p.status = 'APPROVED' ORDER BY r.rank LIMIT 5",
+                (next(paper_ids),)
+            ).fetchall()
+
+        for label, fn, runs in (
+            ('approve (neighbours of one new paper)', incremental_update, min(lookups, 100)),
+            ('related lookup', lookup, lookups),
+        ):
+            median, p95 = _timings(fn, runs)
+            click.echo(f"{label:38s} median {median:8.2f} ms   p95 {p95:8.2f} ms")
+
+        conn.close()
+    finally:
+        os.remove(path)
+
+
+@bench_cli.command('projection')
+@click.option('--articles', default=5000, show_default=True, help='Number of synthetic news articles.')
+@click.option('--content-words', default=1500, show_default=True, help='Words per article body.')
+@click.option('--page-size', default=20, show_default=True)
+@click.option('--runs', default=200, show_default=True)
+@click.option('--seed', default=42, show_default=True)
+def bench_projection(articles, content_words, page_size, runs, seed):
+    """Compare full rows, deferred bodies and sparse fieldsets for news listings"""
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    engine = db.create_engine(f'sqlite:///{path}')
+
+    try:
+        db.metadata.create_all(engine, tables=[User.__table__, NewsArticle.__table__])
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert(), [
+                {'id': i, 'username': f'author{i}', 'email': f'author{i}@example.com', 'password_hash': 'x'}
+                for i in range(1, 51)
+            ])
+            conn.execute(NewsArticle.__table__.insert(), [
+                {
+                    'id': i, 'title': _sentence(rng, 8), 'slug': f'article-{i}',
+                    'content': _sentence(rng, content_words), 'excerpt': _sentence(rng, 30),
+                    'category': rng.choice(list(NewsCategory)).name, 'status': NewsStatus.PUBLISHED.name,
+                    'author_id': rng.randint(1, 50), 'views': rng.randint(0, 5000),
+                    'published_at': datetime(2024, 1, 1) + timedelta(minutes=i)
+                }
+                for i in range(1, articles + 1)
+            ])
+
+        session = Session(engine)
+        offsets = itertools.cycle(range(0, articles - page_size, page_size))
+        sparse = ['id', 'title', 'slug', 'published_at']
+
+        def page(options):
+            session.expunge_all()
+            return session.query(NewsArticle).filter(
+                NewsArticle.status == NewsStatus.PUBLISHED
+            ).options(*options).order_by(
+                NewsArticle.published_at.desc(), NewsArticle.id.desc()
+            ).limit(page_size).offset(next(offsets)).all()
+
+        def loaded_bytes(rows):
+            return sum(
+                len(str(value)) for row in rows
+                for key, value in vars(row).items() if not key.startswith('_') and value is not None
+            )
+
+        strategies = (
+            ('full rows', [], lambda rows: [row.to_summary_dict() for row in rows]),
+            ('deferred content', NEWS_SUMMARY.default_options(),
+             lambda rows: [row.to_summary_dict() for row in rows]),
+            ('fields=' + ','.join(sparse), NEWS_SUMMARY.options(sparse),
+             lambda rows: [NEWS_SUMMARY.serialize(row, sparse) for row in rows]),
+        )
+        click.echo(f"{articles} articles with ~{content_words}-word bodies, {page_size} per page")
+        for label, options, serialize in strategies:
+            rows = page(options)
+            hydrated = loaded_bytes(rows)
+            payload = len(json.dumps(serialize(rows), default=str))
+            median, p95 = _timings(lambda: serialize(page(options)), runs)
+            click.echo(
+                f"{label:34s} median {median:7.2f} ms   p95 {p95:7.2f} ms   "
+                f"hydrated {hydrated / 1024:8.1f} KiB   payload {payload / 1024:6.1f} KiB"
+            )
+
+        session.close()
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+# Most SQL statements each forum endpoint may run for one request, whatever
+# the page size; `flask bench forum-queries` fails when one is exceeded
+FORUM_QUERY_BUDGETS = {
+    'GET /forum/categories': 1,
+    'GET /forum/topics': 3,
+    'GET /forum/topics (signed in)': 4,
+    'GET /forum/topics/<id>': 5,
+    'POST /forum/topics': 10,
+    'POST /forum/topics/<id>/posts': 10,
+}
+
+
+def _bench_app(path):
+    """A minimal app on its own SQLite file that serves the community routes"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['JWT_SECRET_KEY'] = 'bench'
+    JWTManager(app)
+    db.init_app(app)
+    app.register_blueprint(community.community_bp, url_prefix='/api')
+    return app
+
+
+@bench_cli.command('forum-queries')
+@click.option('--topics', default=2000, show_default=True, help='Number of synthetic forum topics.')
+@click.option('--posts', default=100, show_default=True, help='Posts in the topic that is read.')
+@click.option('--page-size', default=100, show_default=True)
+@click.option('--runs', default=20, show_default=True)
+@click.option('--seed', default=42, show_default=True)
+def bench_forum_queries(topics, posts, page_size, runs, seed):
+    """Count SQL statements per forum endpoint and fail above FORUM_QUERY_BUDGETS"""
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = _bench_app(path)
+
+    # Topic views go to a throwaway buffer instead of the app's counter log
+    with mock.patch.object(community, 'counters', CounterBuffer()), app.app_context():
+        try:
+            db.create_all()
+            db.session.execute(User.__table__.insert(), [
+                {'id': i, 'username': f'member{i}', 'email': f'member{i}@example.com', 'password_hash': 'x'}
+                for i in range(1, 201)
+            ])
+            db.session.execute(ForumCategory.__table__.insert(), [
+                {'id': i, 'name': f'Category {i}', 'description': _sentence(rng, 10), 'icon': '',
+                 'topic_count': 0, 'post_count': 0}
+                for i in range(1, 11)
+            ])
+            now = datetime.utcnow()
+            db.session.execute(ForumTopic.__table__.insert(), [
+                {'id': i, 'title': _sentence(rng, 8), 'content': _sentence(rng, 80),
+                 'category_id': rng.randint(1, 10), 'author_id': rng.randint(1, 200),
+                 'is_pinned': i % 97 == 0, 'is_locked': False, 'views': 0, 'reply_count': 0,
+                 'created_at': now - timedelta(minutes=i), 'last_post_at': now - timedelta(minutes=i)}
+                for i in range(1, topics + 1)
+            ])
+            db.session.execute(ForumPost.__table__.insert(), [
+                {'content': _sentence(rng, 40), 'topic_id': 1, 'author_id': rng.randint(1, 200),
+                 'created_at': now + timedelta(seconds=i)}
+                for i in range(posts)
+            ])
+            db.session.commit()
+
+            client = app.test_client()
+            headers = {'Authorization': f'Bearer {create_access_token(identity="1")}'}
+            requests = (
+                ('GET /forum/categories', lambda: client.get('/api/forum/categories')),
+                ('GET /forum/topics', lambda: client.get(f'/api/forum/topics?per_page={page_size}')),
+                ('GET /forum/topics (signed in)', lambda: client.get(
+                    f'/api/forum/topics?per_page={page_size}', headers=headers
+                )),
+                ('GET /forum/topics/<id>', lambda: client.get(f'/api/forum/topics/1?per_page={page_size}')),
+                ('POST /forum/topics', lambda: client.post('/api/forum/topics', headers=headers, json={
+                    'title': 'Benchmark topic', 'content': 'Benchmark topic body', 'category_id': 1
+                })),
+                ('POST /forum/topics/<id>/posts', lambda: client.post('/api/forum/topics/1/posts', headers=headers, json={
+                    'content': 'Benchmark reply'
+                })),
+            )
+
+            click.echo(f"{topics} topics, {posts} posts in the topic read, {page_size} per page")
+            failures = []
+            for label, send in requests:
+                limit = FORUM_QUERY_BUDGETS[label]
+                try:
+                    with assert_max_queries(limit, db.engine) as statements:
+                        response = send()
+                    over = ''
+                except AssertionError as e:
+                    failures.append(f"{label}: {e}")
+                    over = '  OVER BUDGET'
+                if response.status_code >= 400:
+                    raise click.ClickException(f"{label} returned {response.status_code}: {response.get_data(True)}")
+
+                median, p95 = _timings(send, runs)
+                click.echo(
+                    f"{label:30s} {len(statements):3d} queries (budget {limit:2d})   "
+                    f"median {median:7.2f} ms   p95 {p95:7.2f} ms{over}"
+                )
+
+            if failures:
+                raise click.ClickException('Query budget exceeded\n' + '\n'.join(failures))
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+            os.remove(path)
+
+
+def _inline_counters(conn, topic_id, category_id, user_id, now):
+    """The old write path: bump the three counter rows inside the post transaction"""
+    topics, categories, users = ForumTopic.__table__, ForumCategory.__table__, User.__table__
+    conn.execute(topics.update().where(topics.c.id == topic_id).values(
+        reply_count=topics.c.reply_count + 1, last_post_at=now
+    ))
+    conn.execute(categories.update().where(categories.c.id == category_id).values(
+        post_count=categories.c.post_count + 1
+    ))
+    conn.execute(users.update().where(users.c.id == user_id).values(
+        forum_posts_count=db.func.coalesce(users.c.forum_posts_count, 0) + 1
+    ))
+
+
+def _delta_counters(conn, topic_id, category_id, user_id, now):
+    """The delta log write path, as in create_forum_post"""
+    counters = [
+        ('forum_topics', 'reply_count', topic_id),
+        ('forum_categories', 'post_count', category_id),
+        ('users', 'forum_posts_count', user_id),
+    ]
+    conn.execute(forum_counter_deltas.insert(), [
+        {'table_name': table, 'column_name': column, 'row_id': row_id, 'delta': 1, 'value': None}
+        for table, column, row_id in counters
+    ] + [
+        {'table_name': 'forum_topics', 'column_name': 'last_post_at', 'row_id': topic_id, 'delta': 0, 'value': now}
+    ])
+
+
+@bench_cli.command('forum-writes')
+@click.option('--threads', default=8, show_default=True, help='Concurrent writers.')
+@click.option('--posts', default=500, show_default=True, help='Posts per writer.')
+@click.option('--topics', default=20, show_default=True, help='Topics in the hot category.')
+@click.option('--seed', default=42, show_default=True)
+def bench_forum_writes(threads, posts, topics, seed):
+    """Post throughput in one hot category: inline counter UPDATEs vs the delta log"""
+    tables = [
+        User.__table__, ForumCategory.__table__, ForumTopic.__table__, ForumPost.__table__,
+        forum_counter_deltas
+    ]
+    total = threads * posts
+    click.echo(f"{threads} writers x {posts} posts into {topics} topics of one category")
+
+    for label, write_counters in (('inline UPDATEs', _inline_counters), ('delta log', _delta_counters)):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        engine = db.create_engine(f'sqlite:///{path}', connect_args={'timeout': 60})
+
+        try:
+            db.metadata.create_all(engine, tables=tables)
+            with engine.begin() as conn:
+                conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+                conn.execute(User.__table__.insert(), [
+                    {'id': i, 'username': f'member{i}', 'email': f'member{i}@example.com',
+                     'password_hash': 'x', 'forum_posts_count': 0}
+                    for i in range(1, threads + 1)
+                ])
+                conn.execute(ForumCategory.__table__.insert().values(
+                    id=1, name='Race day', description='', icon='', topic_count=topics, post_count=topics
+                ))
+                conn.execute(ForumTopic.__table__.insert(), [
+                    {'id': i, 'title': f'Topic {i}', 'content': 'Race day thread', 'category_id': 1,
+                     'author_id': 1, 'is_pinned': False, 'is_locked': False, 'views': 0, 'reply_count': 0}
+                    for i in range(1, topics + 1)
+                ])
+
+            latencies = []
+            lock = threading.Lock()
+
+            def writer(user_id):
+                rng = random.Random(seed + user_id)
+                samples = []
+                for _ in range(posts):
+                    topic_id = rng.randint(1, topics)
+                    start = time.perf_counter()
+                    with engine.begin() as conn:
+                        now = datetime.utcnow()
+                        conn.execute(ForumPost.__table__.insert().values(
+                            content='Box this lap', topic_id=topic_id, author_id=user_id, created_at=now
+                        ))
+                        write_counters(conn, topic_id, 1, user_id, now)
+                    samples.append((time.perf_counter() - start) * 1000)
+                with lock:
+                    latencies.extend(samples)
+
+            workers = [threading.Thread(target=writer, args=(i,)) for i in range(1, threads + 1)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            rollup_ms = 0.0
+            if write_counters is _delta_counters:
+                start = time.perf_counter()
+                rollup(engine)
+                rollup_ms = (time.perf_counter() - start) * 1000
+
+            with engine.connect() as conn:
+                post_count = conn.execute(
+                    db.select(ForumCategory.__table__.c.post_count).where(ForumCategory.__table__.c.id == 1)
+                ).scalar()
+            if post_count != topics + total:
+                raise click.ClickException(f"{label}: category post_count {post_count}, expected {topics + total}")
+
+            latencies.sort()
+            click.echo(
+                f"{label:16s} {total / elapsed:8.0f} posts/s   "
+                f"median {statistics.median(latencies):6.2f} ms   p95 {latencies[int(len(latencies) * 0.95) - 1]:7.2f} ms"
+                + (f"   rollup of {total} posts {rollup_ms:7.1f} ms" if rollup_ms else '')
+            )
+        finally:
+            engine.dispose()
+            os.remove(path)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+def _naive_register(conn, event_id, user_id):
+    """The old attend_event: read, check in Python, insert, write the count back"""
+    events = CommunityEvent.__table__
+    count, capacity = conn.execute(
+        db.select(events.c.attendee_count, events.c.max_attendees).where(events.c.id == event_id)
+    ).one()
+    if capacity and count >= capacity:
+        return registration.WAITLISTED, None
+    existing = conn.execute(event_attendees.select().where(
+        event_attendees.c.user_id == user_id, event_attendees.c.event_id == event_id
+    )).first()
+    if existing:
+        return registration.ALREADY_REGISTERED, None
+    conn.execute(event_attendees.insert().values(user_id=user_id, event_id=event_id))
+    conn.execute(events.update().where(events.c.id == event_id).values(attendee_count=count + 1))
+    return registration.REGISTERED, count + 1
+
+
+@bench_cli.command('event-rush')
+@click.option('--registrations', default=1000, show_default=True, help='Concurrent registration requests.')
+@click.option('--seats', default=100, show_default=True)
+@click.option('--duplicates', default=100, show_default=True, help='Extra requests from already registering users.')
+@click.option('--cancels', default=20, show_default=True, help='Concurrent cancellations after the rush.')
+@click.option('--naive', is_flag=True, help='Also run the old read-check-insert registration.')
+def bench_event_rush(registrations, seats, duplicates, cancels, naive):
+    """Fire concurrent registrations at one event and check nobody is overbooked"""
+    strategies = [('conditional UPDATE', registration.register)]
+    if naive:
+        strategies.insert(0, ('read-check-insert', _naive_register))
+    tables = [User.__table__, CommunityEvent.__table__, event_attendees, registration.event_waitlist]
+
+    for label, register in strategies:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        # One connection per thread, waiting on SQLite's write lock like clients on row locks
+        engine = db.create_engine(f'sqlite:///{path}', poolclass=NullPool, connect_args={'timeout': 120})
+
+        try:
+            db.metadata.create_all(engine, tables=tables)
+            with engine.begin() as conn:
+                conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+                conn.execute(User.__table__.insert(), [
+                    {'id': i, 'username': f'fan{i}', 'email': f'fan{i}@example.com', 'password_hash': 'x'}
+                    for i in range(1, registrations + 1)
+                ])
+                conn.execute(CommunityEvent.__table__.insert().values(
+                    id=1, title='Grand Prix watch party', description='', event_type=EventType.RACE_WATCH.name,
+                    start_time=datetime.utcnow() + timedelta(days=7), max_attendees=seats,
+                    attendee_count=0, organizer_id=1
+                ))
+
+            user_ids = list(range(1, registrations + 1)) + random.Random(0).sample(
+                range(1, registrations + 1), min(duplicates, registrations)
+            )
+            outcomes = []
+            errors = []
+            lock = threading.Lock()
+            barrier = None
+
+            def call(fn, user_id):
+                barrier.wait()
+                try:
+                    with engine.begin() as conn:
+                        outcome = fn(conn, 1, user_id)
+                    with lock:
+                        outcomes.append((user_id, outcome[0]))
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e).splitlines()[0])
+
+            def rush(fn, ids):
+                nonlocal barrier
+                barrier = threading.Barrier(len(ids))
+                threads = [threading.Thread(target=call, args=(fn, user_id)) for user_id in ids]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                return time.perf_counter() - start
+
+            def state():
+                with engine.connect() as conn:
+                    rows = conn.execute(db.select(db.func.count()).select_from(event_attendees)).scalar()
+                    count = conn.execute(db.select(CommunityEvent.__table__.c.attendee_count)).scalar()
+                    waiting = conn.execute(
+                        db.select(registration.event_waitlist.c.user_id).order_by(registration.event_waitlist.c.id)
+                    ).scalars().all()
+                    attendees = set(conn.execute(db.select(event_attendees.c.user_id)).scalars())
+                return rows, count, waiting, attendees
+
+            elapsed = rush(register, user_ids)
+            registered = sum(1 for _, outcome in outcomes if outcome == registration.REGISTERED)
+            rows, count, waiting, attendees = state()
+            click.echo(
+                f"{label}: {len(user_ids)} requests in {elapsed:.2f} s -> {registered} registered, "
+                f"{len(waiting)} waitlisted, {len(errors)} errors; {rows} attendee rows, attendee_count {count}"
+            )
+            if errors:
+                click.echo(f"  first error: {errors[0]}")
+            if register is _naive_register:
+                continue
+
+            expected_waiting = registrations - seats
+            if not (registered == rows == count == seats and len(waiting) == expected_waiting and not errors):
+                raise click.ClickException(
+                    f"Expected exactly {seats} registrations and {expected_waiting} on the waitlist"
+                )
+
+            # Cancel some seats at once; each must go to the next in line
+            outcomes.clear()
+            cancelled = sorted(attendees)[:cancels]
+            elapsed = rush(registration.cancel, cancelled)
+            rows, count, after, attendees = state()
+            promoted = set(waiting[:cancels])
+            click.echo(
+                f"  {len(cancelled)} cancellations in {elapsed:.2f} s -> {rows} attendee rows, "
+                f"attendee_count {count}, {len(after)} waitlisted"
+            )
+            if errors or rows != seats or count != seats or not promoted <= attendees or after != waiting[cancels:]:
+                raise click.ClickException('Cancelled seats did not go to the head of the waitlist')
+            click.echo("  OK: no overbooking, no duplicates, waitlist promoted in order")
+        finally:
+            engine.dispose()
+            os.remove(path)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
@@ -0,0 +1,264 @@
+"""In-process caching with TTL, LRU eviction and tag-based invalidation.
+
+`LRUCache` is a small thread-safe cache. Entries expire after a TTL, the
+least recently used entry is evicted when the cache is full, and every
+entry can carry tags so that a write path can drop exactly the entries it
+affects (e.g. every cached page that contains article 7).
+
+`cached_response` caches the serialized JSON of a GET endpoint keyed on the
+endpoint and its query arguments, and answers with an ETag so clients can
+revalidate with If-None-Match.
+
+Each app process has its own caches, so invalidations are also written to
+`cache_invalidations` in the transaction of the change. Every process polls
+that table at most once per CACHE_POLL_INTERVAL and drops the listed tags,
+so other processes are never stale for longer than that.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, g, request, url_for
+from src.models.user import db
+from src.jobs import start_job
+
+cache_invalidations = db.Table(
+    'cache_invalidations',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('tag', db.String(100), nullable=False),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow, index=True),
+)
+
+# Rows committed slightly out of order are still picked up within this window
+POLL_OVERLAP = timedelta(seconds=5)
+
+# News tags: list membership, and the pages that show a given article
+NEWS_LIST_TAG = 'news:list'
+
+
+def news_article_tag(article_id):
+    return f'news:article:{article_id}'
+
+
+class LRUCache:
+    """Thread-safe LRU cache with per-entry TTL and tags"""
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of the tags"""
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class CacheRegistry:
+    """The app's named caches plus the shared invalidation log"""
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._poll_interval = 1.0
+        self._last_poll = 0.0
+        self._polled_until = None
+        self._seen = {}
+        self._dirty = False
+        self.enabled = True
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self._poll_interval = app.config.get('CACHE_POLL_INTERVAL', 1.0)
+        self._polled_until = datetime.utcnow()
+        start_job(app, 'cache-invalidations-prune', 600, prune_invalidations)
+
+    def get_cache(self, name, max_entries=1024, ttl=60):
+        with self._lock:
+            if name not in self._caches:
+                self._caches[name] = LRUCache(max_entries, ttl)
+            return self._caches[name]
+
+    def invalidate(self, *tags):
+        """Record an invalidation in the current transaction; the caller commits.
+
+        Local caches are dropped right away and again once the row is
+        visible, so a request racing with the commit cannot keep old data.
+        """
+        if not tags:
+            return
+        db.session.execute(cache_invalidations.insert(), [
+            {'tag': tag, 'created_at': datetime.utcnow()} for tag in tags
+        ])
+        self._invalidate_local(tags)
+        self._dirty = True
+
+    def poll(self):
+        """Apply invalidations recorded by any process since the last poll"""
+        now = time.monotonic()
+        if not self._dirty and now - self._last_poll < self._poll_interval:
+            return
+
+        with self._lock:
+            self._last_poll = now
+            self._dirty = False
+            since = self._polled_until - POLL_OVERLAP
+            polled_at = datetime.utcnow()
+
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(cache_invalidations.c.id, cache_invalidations.c.tag)
+                .where(cache_invalidations.c.created_at >= since)
+            ).all()
+
+        tags = set()
+        with self._lock:
+            for row in rows:
+                if row.id not in self._seen:
+                    self._seen[row.id] = polled_at
+                    tags.add(row.tag)
+            self._seen = {i: t for i, t in self._seen.items() if t >= since}
+            self._polled_until = polled_at
+
+        if tags:
+            self._invalidate_local(tags)
+
+    def _invalidate_local(self, tags):
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            cache.invalidate(*tags)
+
+
+cache_registry = CacheRegistry()
+
+
+def invalidate_cache(*tags):
+    cache_registry.invalidate(*tags)
+
+
+def prune_invalidations():
+    db.session.execute(cache_invalidations.delete().where(
+        cache_invalidations.c.created_at < datetime.utcnow() - timedelta(hours=1)
+    ))
+    db.session.commit()
+
+
+def tag_response(*tags):
+    """Attach invalidation tags to the response being cached"""
+    g.setdefault('cache_tags', set()).update(tags)
+
+
+def cached_response(cache_name, tags=(), ttl=None):
+    """Cache a GET view's successful JSON responses and serve them with ETags.
+
+    The key is the endpoint plus its sorted query arguments. `tags` apply
+    to every entry; the view can add more with `tag_response()`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not cache_registry.enabled or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            cache_registry.poll()
+            cache = cache_registry.get_cache(
+                cache_name, current_app.config.get('CACHE_MAX_ENTRIES', 1024),
+                current_app.config.get('CACHE_TTL', 60)
+            )
+            key = (request.endpoint, tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True))))
+
+            entry = cache.get(key)
+            if entry is None:
+                g.cache_tags = set(tags)
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                entry = (body, response.mimetype, etag)
+                cache.set(key, entry, ttl=ttl, tags=g.cache_tags)
+
+            body, mimetype, etag = entry
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+
+        return wrapper
+    return decorator
+
+
+def warm_endpoints(app, endpoints):
+    """Render cached GET endpoints so the first real request is a hit"""
+    with app.test_request_context():
+        paths = [url_for(endpoint) for endpoint in endpoints]
+
+    for path in paths:
+        with app.test_request_context(path):
+            try:
+                app.full_dispatch_request()
+            except Exception as e:
+                app.logger.error(f"Cache warm-up of {path} failed: {str(e)}")
@@ -3,12 +3,51 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import User, UserRole, db
 from src.models.community import (
     ForumCategory, ForumTopic, ForumPost, InterestGroup, CommunityEvent, 
-    EventType, group_memberships, event_attendees
+    EventType, group_memberships
 )
+from src.counters import counters
+from src.forum_counters import add_deltas, add_latest, check_counters
+from src.groups import is_group_member, join_group, leave_group, member_group_ids
+from src.unread import mark_category_read, mark_topic_read, unread_counts
+from src.registration import (
+    ALREADY_REGISTERED, ALREADY_WAITLISTED, LEFT_WAITLIST, NOT_REGISTERED, WAITLISTED, cancel, register
+)
+from src.live import (
+    TooManySubscribers, category_channel, event_channel, event_stream, publish_event, topic_channel
+)
+from src.pagination import paginate, InvalidCursor
+from sqlalchemy.orm import configure_mappers, joinedload, load_only, selectinload
 from datetime import datetime
+import click
 
 community_bp = Blueprint('community', __name__)
 
+
+def topic_loading():
+    """Loader options that fetch topics with their category and author up front"""
+    # ForumTopic.category is a backref, which only exists once mappers are configured
+    configure_mappers()
+    return [joinedload(ForumTopic.category), selectinload(ForumTopic.author)]
+
+
+def post_loading():
+    """Loader options that batch-load the authors of a page of posts"""
+    return [selectinload(ForumPost.author)]
+
+
+def _publish_attendance(event_id):
+    """Announce an event's current attendee count on its live stream"""
+    events = CommunityEvent.__table__
+    attendee_count, max_attendees = db.session.execute(
+        db.select(events.c.attendee_count, events.c.max_attendees).where(events.c.id == event_id)
+    ).one()
+    publish_event(event_channel(event_id), 'attendance', {
+        'event_id': event_id,
+        'attendee_count': attendee_count,
+        'max_attendees': max_attendees
+    })
+
+
 # Forum routes
 
 @community_bp.route('/forum/categories', methods=['GET'])
@@ -71,17 +110,14 @@ def create_forum_category():
         return jsonify({'error': 'Failed to create forum category'}), 500
 
 @community_bp.route('/forum/topics', methods=['GET'])
+@jwt_required(optional=True)
 def get_forum_topics():
-    """Get forum topics with filtering and pagination"""
+    """Get forum topics with filtering and pagination, with unread counts when signed in"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         category_id = request.args.get('category_id', type=int)
         search = request.args.get('search', '')
         
-        per_page = min(per_page, 100)
-        
-        query = ForumTopic.query
+        query = ForumTopic.query.options(*topic_loading())
         
         if category_id:
             query = query.filter_by(category_id=category_id)
@@ -91,27 +127,27 @@ def get_forum_topics():
             query = query.filter(ForumTopic.title.ilike(search_term))
         
         # Order by pinned first, then by last post date
-        query = query.order_by(
-            ForumTopic.is_pinned.desc(),
-            ForumTopic.last_post_at.desc()
-        )
+        topics, pagination = paginate(query, [
+            (ForumTopic.is_pinned, True),
+            (ForumTopic.last_post_at, True),
+            (ForumTopic.id, True)
+        ], 'topics')
         
-        topics = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        topic_dicts = [topic.to_dict() for topic in topics]
+        
+        current_user_id = get_jwt_identity()
+        if current_user_id is not None:
+            unread = unread_counts(int(current_user_id), [topic.id for topic in topics])
+            for topic_dict in topic_dicts:
+                topic_dict['unread_count'], topic_dict['has_unread'] = unread.get(topic_dict['id'], (0, False))
         
         return jsonify({
-            'forum_topics': [topic.to_dict() for topic in topics.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': topics.total,
-                'pages': topics.pages,
-                'has_next': topics.has_next,
-                'has_prev': topics.has_prev
-            }
+            'forum_topics': topic_dicts,
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         current_app.logger.error(f"Get forum topics error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve forum topics'}), 500
@@ -155,12 +191,17 @@ def create_forum_topic():
         
         db.session.add(topic)
         
-        # Update category stats
-        category.topic_count += 1
-        category.post_count += 1
+        # Category and user stats are folded in by the counter rollup
+        add_deltas(
+            (ForumCategory, category_id, 'topic_count', 1),
+            (ForumCategory, category_id, 'post_count', 1),
+            (User, user.id, 'forum_posts_count', 1)
+        )
         
-        # Update user stats
-        user.forum_posts_count += 1
+        db.session.flush()
+        # The author's own topic is not unread for them
+        mark_topic_read(user.id, topic.id, 0)
+        publish_event(category_channel(category_id), 'topic', topic.to_dict())
         
         db.session.commit()
         
@@ -178,20 +219,19 @@ def create_forum_topic():
 def get_forum_topic(topic_id):
     """Get a specific forum topic with its posts"""
     try:
-        topic = ForumTopic.query.get(topic_id)
+        topic = ForumTopic.query.options(*topic_loading()).get(topic_id)
         if not topic:
             return jsonify({'error': 'Forum topic not found'}), 404
         
-        # Increment view count
-        topic.views += 1
-        db.session.commit()
+        # Count the view; flushed to the database in the background
+        counters.incr(ForumTopic, topic.id, 'views')
         
         # Get posts with pagination
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         per_page = min(per_page, 100)
         
-        posts = ForumPost.query.filter_by(topic_id=topic_id).order_by(
+        posts = ForumPost.query.options(*post_loading()).filter_by(topic_id=topic_id).order_by(
             ForumPost.created_at.asc()
         ).paginate(
             page=page, per_page=per_page, error_out=False
@@ -214,6 +254,96 @@ def get_forum_topic(topic_id):
         current_app.logger.error(f"Get forum topic error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve forum topic'}), 500
 
+@community_bp.route('/forum/topics/<int:topic_id>/stream', methods=['GET'])
+def stream_forum_topic(topic_id):
+    """Stream new posts in a forum topic as Server-Sent Events"""
+    try:
+        if not ForumTopic.query.get(topic_id):
+            return jsonify({'error': 'Forum topic not found'}), 404
+        
+        return event_stream(topic_channel(topic_id))
+        
+    except TooManySubscribers:
+        return jsonify({'error': 'Too many live connections, try again later'}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        current_app.logger.error(f"Stream forum topic error: {str(e)}")
+        return jsonify({'error': 'Failed to open forum topic stream'}), 500
+
+@community_bp.route('/forum/categories/<int:category_id>/stream', methods=['GET'])
+def stream_forum_category(category_id):
+    """Stream new topics in a forum category as Server-Sent Events"""
+    try:
+        if not ForumCategory.query.get(category_id):
+            return jsonify({'error': 'Forum category not found'}), 404
+        
+        return event_stream(category_channel(category_id))
+        
+    except TooManySubscribers:
+        return jsonify({'error': 'Too many live connections, try again later'}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        current_app.logger.error(f"Stream forum category error: {str(e)}")
+        return jsonify({'error': 'Failed to open forum category stream'}), 500
+
+@community_bp.route('/forum/topics/<int:topic_id>/read', methods=['POST'])
+@jwt_required()
+def mark_forum_topic_read(topic_id):
+    """Mark a topic read up to a post (default: its latest post)"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not ForumTopic.query.get(topic_id):
+            return jsonify({'error': 'Forum topic not found'}), 404
+        
+        latest_post_id = db.session.query(db.func.max(ForumPost.id)).filter(
+            ForumPost.topic_id == topic_id
+        ).scalar() or 0
+        
+        data = request.get_json(silent=True) or {}
+        post_id = data.get('last_read_post_id', latest_post_id)
+        if not isinstance(post_id, int) or isinstance(post_id, bool) or post_id < 0:
+            return jsonify({'error': 'last_read_post_id must be a post id'}), 400
+        
+        mark_topic_read(user.id, topic_id, min(post_id, latest_post_id))
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Topic marked as read',
+            'last_read_post_id': min(post_id, latest_post_id)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Mark topic read error: {str(e)}")
+        return jsonify({'error': 'Failed to mark topic as read'}), 500
+
+@community_bp.route('/forum/categories/<int:category_id>/read', methods=['POST'])
+@jwt_required()
+def mark_forum_category_read(category_id):
+    """Mark every topic in a category as read"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not ForumCategory.query.get(category_id):
+            return jsonify({'error': 'Forum category not found'}), 404
+        
+        mark_category_read(user.id, category_id)
+        db.session.commit()
+        
+        return jsonify({'message': 'Category marked as read'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Mark category read error: {str(e)}")
+        return jsonify({'error': 'Failed to mark category as read'}), 500
+
 @community_bp.route('/forum/topics/<int:topic_id>/posts', methods=['POST'])
 @jwt_required()
 def create_forum_post(topic_id):
@@ -249,15 +379,18 @@ def create_forum_post(topic_id):
         
         db.session.add(post)
         
-        # Update topic stats
-        topic.reply_count += 1
-        topic.last_post_at = datetime.utcnow()
-        
-        # Update category stats
-        topic.category.post_count += 1
+        # Topic, category and user stats are folded in by the counter rollup
+        add_deltas(
+            (ForumTopic, topic_id, 'reply_count', 1),
+            (ForumCategory, topic.category_id, 'post_count', 1),
+            (User, user.id, 'forum_posts_count', 1)
+        )
+        add_latest(ForumTopic, topic_id, 'last_post_at', datetime.utcnow())
         
-        # Update user stats
-        user.forum_posts_count += 1
+        db.session.flush()
+        # Replying reads the topic up to the reply
+        mark_topic_read(user.id, topic_id, post.id)
+        publish_event(topic_channel(topic_id), 'post', post.to_dict())
         
         db.session.commit()
         
@@ -277,36 +410,25 @@ def create_forum_post(topic_id):
 def get_interest_groups():
     """Get all public interest groups"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '')
         
-        per_page = min(per_page, 100)
-        
         query = InterestGroup.query.filter_by(is_public=True)
         
         if search:
             search_term = f"%{search}%"
             query = query.filter(InterestGroup.name.ilike(search_term))
         
-        query = query.order_by(InterestGroup.member_count.desc())
-        
-        groups = query.paginate(
-            page=page, per_page=per_page, error_out=False
+        groups, pagination = paginate(
+            query, [(InterestGroup.member_count, True), (InterestGroup.id, True)], 'groups'
         )
         
         return jsonify({
-            'interest_groups': [group.to_dict() for group in groups.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': groups.total,
-                'pages': groups.pages,
-                'has_next': groups.has_next,
-                'has_prev': groups.has_prev
-            }
+            'interest_groups': [group.to_dict() for group in groups],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         current_app.logger.error(f"Get interest groups error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve interest groups'}), 500
@@ -344,18 +466,14 @@ def create_interest_group():
             avatar=avatar,
             is_public=is_public,
             creator_id=current_user_id,
-            member_count=1  # Creator is automatically a member
+            member_count=0
         )
         
         db.session.add(group)
         db.session.flush()  # Get the group ID
         
-        # Add creator as member
-        membership = group_memberships.insert().values(
-            user_id=current_user_id,
-            group_id=group.id
-        )
-        db.session.execute(membership)
+        # Creator is automatically a member
+        join_group(group.id, user.id)
         
         db.session.commit()
         
@@ -369,18 +487,129 @@ def create_interest_group():
         current_app.logger.error(f"Create interest group error: {str(e)}")
         return jsonify({'error': 'Failed to create interest group'}), 500
 
+@community_bp.route('/groups/<int:group_id>/join', methods=['POST'])
+@jwt_required()
+def join_interest_group(group_id):
+    """Join a public interest group"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        group = InterestGroup.query.get(group_id)
+        if not group:
+            return jsonify({'error': 'Group not found'}), 404
+        
+        if not group.is_public:
+            return jsonify({'error': 'This group is private'}), 403
+        
+        if not join_group(group_id, user.id):
+            return jsonify({'error': 'Already a member of this group'}), 409
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Joined group successfully',
+            'interest_group': group.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Join group error: {str(e)}")
+        return jsonify({'error': 'Failed to join group'}), 500
+
+@community_bp.route('/groups/<int:group_id>/join', methods=['DELETE'])
+@jwt_required()
+def leave_interest_group(group_id):
+    """Leave an interest group"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        group = InterestGroup.query.get(group_id)
+        if not group:
+            return jsonify({'error': 'Group not found'}), 404
+        
+        if group.creator_id == user.id:
+            return jsonify({'error': 'The group creator cannot leave the group'}), 400
+        
+        if not leave_group(group_id, user.id):
+            return jsonify({'error': 'Not a member of this group'}), 404
+        
+        db.session.commit()
+        
+        return jsonify({'message': 'Left group successfully'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Leave group error: {str(e)}")
+        return jsonify({'error': 'Failed to leave group'}), 500
+
+@community_bp.route('/groups/<int:group_id>/members', methods=['GET'])
+@jwt_required(optional=True)
+def get_group_members(group_id):
+    """List a group's members, newest first; private groups only to their members"""
+    try:
+        group = InterestGroup.query.get(group_id)
+        if not group:
+            return jsonify({'error': 'Group not found'}), 404
+        
+        if not group.is_public and not is_group_member(get_jwt_identity(), group_id):
+            return jsonify({'error': 'Members only'}), 403
+        
+        query = User.query.options(load_only(User.id, User.username)).join(
+            group_memberships, group_memberships.c.user_id == User.id
+        ).filter(group_memberships.c.group_id == group_id)
+        
+        members, pagination = paginate(
+            query, [(group_memberships.c.joined_at, True), (User.id, True)], 'members'
+        )
+        
+        return jsonify({
+            'members': [{'id': member.id, 'username': member.username} for member in members],
+            'pagination': pagination
+        }), 200
+        
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except Exception as e:
+        current_app.logger.error(f"Get group members error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve group members'}), 500
+
+@community_bp.route('/groups/mine', methods=['GET'])
+@jwt_required()
+def get_my_groups():
+    """Get the groups the current user belongs to"""
+    try:
+        group_ids = member_group_ids(get_jwt_identity())
+        
+        groups = []
+        if group_ids:
+            groups = InterestGroup.query.filter(
+                InterestGroup.id.in_(group_ids)
+            ).order_by(InterestGroup.name).all()
+        
+        return jsonify({
+            'interest_groups': [group.to_dict() for group in groups]
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get my groups error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve your groups'}), 500
+
 # Community Events routes
 
 @community_bp.route('/events', methods=['GET'])
 def get_community_events():
     """Get upcoming community events"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         event_type = request.args.get('type', '')
         
-        per_page = min(per_page, 100)
-        
         # Only show future events
         query = CommunityEvent.query.filter(
             CommunityEvent.start_time >= datetime.utcnow()
@@ -393,24 +622,17 @@ def get_community_events():
             except ValueError:
                 return jsonify({'error': 'Invalid event type'}), 400
         
-        query = query.order_by(CommunityEvent.start_time.asc())
-        
-        events = query.paginate(
-            page=page, per_page=per_page, error_out=False
+        events, pagination = paginate(
+            query, [(CommunityEvent.start_time, False), (CommunityEvent.id, False)], 'events'
         )
         
         return jsonify({
-            'community_events': [event.to_dict() for event in events.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': events.total,
-                'pages': events.pages,
-                'has_next': events.has_next,
-                'has_prev': events.has_prev
-            }
+            'community_events': [event.to_dict() for event in events],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         current_app.logger.error(f"Get community events error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve community events'}), 500
@@ -487,7 +709,7 @@ def create_community_event():
 @community_bp.route('/events/<int:event_id>/attend', methods=['POST'])
 @jwt_required()
 def attend_event(event_id):
-    """Register to attend an event"""
+    """Register to attend an event, or join its waitlist when it is full"""
     try:
         current_user_id = get_jwt_identity()
         user = User.query.get(current_user_id)
@@ -499,35 +721,25 @@ def attend_event(event_id):
         if not event:
             return jsonify({'error': 'Event not found'}), 404
         
-        # Check if event is full
-        if event.max_attendees and event.attendee_count >= event.max_attendees:
-            return jsonify({'error': 'Event is full'}), 400
-        
-        # Check if user is already attending
-        existing_attendance = db.session.execute(
-            event_attendees.select().where(
-                (event_attendees.c.user_id == current_user_id) &
-                (event_attendees.c.event_id == event_id)
-            )
-        ).first()
+        # Seat check and insert are one conditional UPDATE, see registration.py
+        outcome, value = register(db.session.connection(), event_id, user.id)
         
-        if existing_attendance:
+        if outcome == ALREADY_REGISTERED:
             return jsonify({'error': 'Already registered for this event'}), 409
         
-        # Add attendance
-        attendance = event_attendees.insert().values(
-            user_id=current_user_id,
-            event_id=event_id
-        )
-        db.session.execute(attendance)
-        
-        # Update attendee count
-        event.attendee_count += 1
+        if outcome in (WAITLISTED, ALREADY_WAITLISTED):
+            db.session.commit()
+            return jsonify({
+                'message': 'Event is full, added to the waitlist',
+                'waitlist_position': value
+            }), 202
         
+        _publish_attendance(event_id)
         db.session.commit()
         
         return jsonify({
-            'message': 'Successfully registered for event'
+            'message': 'Successfully registered for event',
+            'attendee_count': value
         }), 200
         
     except Exception as e:
@@ -535,6 +747,58 @@ def attend_event(event_id):
         current_app.logger.error(f"Attend event error: {str(e)}")
         return jsonify({'error': 'Failed to register for event'}), 500
 
+@community_bp.route('/events/<int:event_id>/attend', methods=['DELETE'])
+@jwt_required()
+def cancel_event_attendance(event_id):
+    """Cancel a registration or leave the waitlist; the seat goes to the next in line"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        event = CommunityEvent.query.get(event_id)
+        if not event:
+            return jsonify({'error': 'Event not found'}), 404
+        
+        outcome, promoted_user_id = cancel(db.session.connection(), event_id, user.id)
+        
+        if outcome == NOT_REGISTERED:
+            return jsonify({'error': 'Not registered for this event'}), 404
+        
+        if outcome == LEFT_WAITLIST:
+            db.session.commit()
+            return jsonify({'message': 'Removed from the waitlist'}), 200
+        
+        _publish_attendance(event_id)
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Registration cancelled',
+            'promoted_from_waitlist': promoted_user_id is not None
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Cancel attendance error: {str(e)}")
+        return jsonify({'error': 'Failed to cancel registration'}), 500
+
+@community_bp.route('/events/<int:event_id>/stream', methods=['GET'])
+def stream_event_attendance(event_id):
+    """Stream attendance changes of an event as Server-Sent Events"""
+    try:
+        if not CommunityEvent.query.get(event_id):
+            return jsonify({'error': 'Event not found'}), 404
+        
+        return event_stream(event_channel(event_id))
+        
+    except TooManySubscribers:
+        return jsonify({'error': 'Too many live connections, try again later'}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        current_app.logger.error(f"Stream event error: {str(e)}")
+        return jsonify({'error': 'Failed to open event stream'}), 500
+
 @community_bp.route('/community/stats', methods=['GET'])
 def get_community_stats():
     """Get community statistics"""
@@ -557,3 +821,18 @@ def get_community_stats():
         current_app.logger.error(f"Get community stats error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve community statistics'}), 500
 
+@community_bp.cli.command('check-counters')
+@click.option('--fix', is_flag=True, help='Reset drifted counters to the recomputed values.')
+def check_counters_command(fix):
+    """Compare forum and group counters with counts recomputed from the rows they count"""
+    drifted = check_counters(fix=fix)
+    for table_name, column, row_id, stored, expected in drifted:
+        click.echo(f"{table_name}.{column} id={row_id}: {stored}, expected {expected}")
+    db.session.commit()
+
+    if not drifted:
+        click.echo("All community counters match")
+    elif fix:
+        click.echo(f"Fixed {len(drifted)} community counters")
+    else:
+        raise click.ClickException(f"{len(drifted)} community counters drifted; run with --fix to repair")
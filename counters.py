@@ -0,0 +1,225 @@
+"""Write-behind aggregation for view and download counters.
+
+Read endpoints call `counters.incr()` instead of updating the row and
+committing. Increments are summed in memory and appended to a per-process
+log file, and a background job flushes them in batches of
+`UPDATE ... SET col = col + n`.
+
+Crash safety: before a flush the active log is renamed to a batch file
+whose name is the batch id. The batch id is recorded in the same
+transaction as the UPDATEs, and the file is deleted after commit. At
+startup any batch or log file left behind by a dead process is replayed,
+unless its batch id was already recorded, so every increment that reached
+the log is applied exactly once.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from src.models.user import db
+from src.jobs import start_job
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+counter_batches = db.Table(
+    'counter_batches',
+    db.Column('batch_id', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, default=datetime.utcnow, nullable=False),
+)
+
+LOG_PREFIX = 'counters-'
+
+
+def _lock_file(f, blocking=True):
+    if fcntl is None:
+        return True
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        fcntl.flock(f.fileno(), flags)
+        return True
+    except OSError:
+        return False
+
+
+class CounterBuffer:
+    """Buffers counter increments and flushes them periodically"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._batches = []
+        self._log = None
+        self._log_dir = None
+        self._token = None
+        self._seq = 0
+        self._fsync = False
+        self._max_pending = 10000
+        self._job = None
+
+    def init_app(self, app):
+        self._log_dir = app.config.get('COUNTER_LOG_DIR')
+        self._fsync = app.config.get('COUNTER_LOG_FSYNC', False)
+        self._max_pending = app.config.get('COUNTER_MAX_PENDING', 10000)
+        self._token = f'{os.getpid()}-{time.time_ns()}'
+
+        if self._log_dir:
+            os.makedirs(self._log_dir, exist_ok=True)
+
+        with app.app_context():
+            self.recover()
+
+        self._open_log()
+        self._job = start_job(
+            app, 'counters', app.config.get('COUNTER_FLUSH_INTERVAL', 5),
+            self.flush, run_at_exit=True
+        )
+
+    def incr(self, model, row_id, column, amount=1):
+        """Add `amount` to `model.column` for the row with id `row_id`"""
+        table = model.__table__
+        if column not in table.c:
+            raise ValueError(f"{table.name} has no column {column}")
+
+        key = (table.name, column, row_id)
+        with self._lock:
+            self._pending[key] += amount
+            if self._log is not None:
+                self._log.write(f'{table.name}\t{column}\t{row_id}\t{amount}\n')
+                self._log.flush()
+                if self._fsync:
+                    os.fsync(self._log.fileno())
+            overflow = len(self._pending) >= self._max_pending
+
+        if overflow and self._job is not None:
+            self._job.wake()
+
+    def pending(self, model, row_id, column):
+        """Return the not yet flushed increment for one counter"""
+        with self._lock:
+            return self._pending.get((model.__table__.name, column, row_id), 0)
+
+    def flush(self):
+        """Apply all buffered increments; returns the number of counters updated"""
+        with self._lock:
+            if self._pending:
+                self._batches.append(self._rotate_log() + (self._pending,))
+                self._pending = defaultdict(int)
+            batches = self._batches
+            self._batches = []
+
+        updated = 0
+        for i, (batch_id, batch_path, batch_file, deltas) in enumerate(batches):
+            try:
+                self._apply(batch_id, deltas)
+            except Exception:
+                # Retry the same batch ids on the next flush so nothing is
+                # applied twice; the files are still replayed on restart
+                with self._lock:
+                    self._batches = batches[i:] + self._batches
+                raise
+
+            if batch_file is not None:
+                os.remove(batch_path)
+                batch_file.close()
+            updated += len(deltas)
+        return updated
+
+    def recover(self):
+        """Replay log and batch files left behind by processes that died"""
+        if not self._log_dir:
+            return
+
+        for path in sorted(glob.glob(os.path.join(self._log_dir, LOG_PREFIX + '*'))):
+            try:
+                f = open(path, 'r+')
+            except FileNotFoundError:
+                continue  # flushed by its owner in the meantime
+
+            with f:
+                # A live process holds a lock on every file it still owns
+                if not _lock_file(f, blocking=False):
+                    continue
+                batch_id = os.path.splitext(os.path.basename(path))[0]
+                deltas = self._parse(f)
+                if deltas:
+                    self._apply(batch_id, deltas)
+                    logger.info(f"Recovered {len(deltas)} counter increments from {path}")
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # Batch ids only need to outlive their files
+        with db.engine.begin() as conn:
+            conn.execute(counter_batches.delete().where(
+                counter_batches.c.applied_at < datetime.utcnow() - timedelta(days=7)
+            ))
+
+    def _open_log(self):
+        if not self._log_dir:
+            return
+        path = os.path.join(self._log_dir, f'{LOG_PREFIX}{self._token}.log')
+        self._log = open(path, 'a')
+        _lock_file(self._log)
+
+    def _rotate_log(self):
+        """Turn the active log into a batch file; caller holds the lock"""
+        self._seq += 1
+        batch_id = f'{LOG_PREFIX}{self._token}-{self._seq}'
+        if self._log is None:
+            return batch_id, None, None
+
+        # The renamed file keeps its lock until the batch is applied
+        batch_file = self._log
+        batch_path = os.path.join(self._log_dir, f'{batch_id}.batch')
+        os.rename(batch_file.name, batch_path)
+        self._open_log()
+        return batch_id, batch_path, batch_file
+
+    @staticmethod
+    def _parse(f):
+        deltas = defaultdict(int)
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) != 4:
+                continue  # torn write at crash time
+            table_name, column, row_id, amount = parts
+            table = db.metadata.tables.get(table_name)
+            if table is None or column not in table.c:
+                continue
+            deltas[(table_name, column, int(row_id))] += int(amount)
+        return deltas
+
+    @staticmethod
+    def _apply(batch_id, deltas):
+        by_column = defaultdict(list)
+        for (table_name, column, row_id), amount in deltas.items():
+            if amount:
+                by_column[(table_name, column)].append({'row_id': row_id, 'amount': amount})
+
+        with db.engine.begin() as conn:
+            already_applied = conn.execute(
+                counter_batches.select().where(counter_batches.c.batch_id == batch_id)
+            ).first()
+            if already_applied:
+                return
+
+            for (table_name, column), rows in by_column.items():
+                table = db.metadata.tables[table_name]
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == db.bindparam('row_id'))
+                    .values({column: table.c[column] + db.bindparam('amount')}),
+                    rows
+                )
+
+            conn.execute(counter_batches.insert().values(batch_id=batch_id))
+
+
+counters = CounterBuffer()
@@ -0,0 +1,66 @@
+"""Small SQL helpers shared by the route modules and benchmarks"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from src.models.user import db
+
+
+def insert_ignore(table, bind=None):
+    """Return an INSERT for `table` that skips rows violating a unique key.
+
+    Compiles to INSERT OR IGNORE on SQLite and ON CONFLICT DO NOTHING on
+    PostgreSQL, so the statement's rowcount tells whether a row was added.
+    """
+    dialect = (bind or db.session.get_bind()).dialect.name
+
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return db.insert(table).prefix_with('IGNORE')
+
+
+def lock_table(table):
+    """Keep other transactions from writing `table` until this one ends.
+
+    Takes an EXCLUSIVE lock on PostgreSQL, which still lets readers through,
+    and the database write lock on SQLite. Statements run afterwards in the
+    transaction see every write committed before the lock was granted.
+    """
+    session_bind = db.session.get_bind()
+    if session_bind.dialect.name == 'postgresql':
+        db.session.execute(db.text(f'LOCK TABLE {table.name} IN EXCLUSIVE MODE'))
+    else:
+        # Any write statement, even one matching no rows, takes SQLite's write lock
+        column = list(table.c)[0]
+        db.session.execute(table.update().where(db.false()).values({column: column}))
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Collect the SQL statements run on `engine` (default: db.engine) in the block"""
+    engine = engine or db.engine
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """Fail with AssertionError when the block runs more than `limit` statements.
+
+    Used to pin the query count of an endpoint, so that an N+1 regression
+    (a relationship lazy-loaded once per row) fails instead of going unnoticed.
+    """
+    with count_queries(engine) as statements:
+        yield statements
+    if len(statements) > limit:
+        listing = '\n'.join(f'  {statement}' for statement in statements)
+        raise AssertionError(f"{len(statements)} queries, at most {limit} expected:\n{listing}")
@@ -0,0 +1,33 @@
+from flask import Blueprint, jsonify, request, current_app
+from src.models.user import db
+from src.syndication import get_feed, rebuild_feeds
+import click
+
+feeds_bp = Blueprint('feeds', __name__)
+
+@feeds_bp.route('/<path:name>', methods=['GET'])
+def get_feed_document(name):
+    """Serve a precomputed RSS, Atom or JSON feed"""
+    try:
+        feed = get_feed(name)
+        if feed is None:
+            return jsonify({'error': 'Feed not found'}), 404
+
+        response = current_app.response_class(feed.body, content_type=feed.content_type)
+        response.set_etag(feed.etag)
+        response.last_modified = feed.updated_at
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get('FEED_MAX_AGE', 60)
+        return response.make_conditional(request)
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Get feed error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve feed'}), 500
+
+@feeds_bp.cli.command('rebuild')
+def rebuild_feeds_command():
+    """Re-render every news and research feed"""
+    rebuild_feeds()
+    db.session.commit()
+    click.echo("Rebuilt all feeds")
@@ -0,0 +1,176 @@
+"""Denormalized forum counters maintained through a delta log.
+
+Topic reply counts, category topic/post counts and users' forum post counts
+used to be incremented in the transaction that created the post, and the
+topic's `last_post_at` set there too. That way every post in a busy
+category waited for the same category and topic row locks. Now the write
+path only appends rows to `forum_counter_deltas`, which never contend, and
+a background rollup folds them into the columns in batches. Counter rows
+carry a `delta` to add; timestamp rows such as `last_post_at` carry a
+`value` the column is raised to if it is older.
+
+The deltas commit together with the post, so a counter is always exactly
+`column + pending deltas`, even while a rollup is behind. That is also
+what `check_counters()` compares against the counts recomputed from the
+topics and posts themselves.
+"""
+from collections import defaultdict
+from src.models.user import User, db
+from src.models.community import ForumCategory, ForumTopic, ForumPost, InterestGroup, group_memberships
+from src.jobs import start_job
+
+forum_counter_deltas = db.Table(
+    'forum_counter_deltas',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('table_name', db.String(50), nullable=False),
+    db.Column('column_name', db.String(50), nullable=False),
+    db.Column('row_id', db.Integer, nullable=False),
+    db.Column('delta', db.Integer, nullable=False),
+    # Set on "raise the column to at least this" rows, whose delta is 0
+    db.Column('value', db.DateTime, nullable=True),
+)
+
+# Deltas folded per rollup transaction
+ROLLUP_BATCH = 10000
+
+
+def add_deltas(*changes):
+    """Record (model, row_id, column, delta) changes; the caller commits"""
+    db.session.execute(forum_counter_deltas.insert(), [
+        {'table_name': model.__table__.name, 'column_name': column, 'row_id': row_id, 'delta': delta}
+        for model, row_id, column, delta in changes
+    ])
+
+
+def add_latest(model, row_id, column, value):
+    """Record that a timestamp column should become at least value; the caller commits"""
+    db.session.execute(forum_counter_deltas.insert().values(
+        table_name=model.__table__.name, column_name=column, row_id=row_id, delta=0, value=value
+    ))
+
+
+def rollup(engine=None):
+    """Fold pending deltas into the counter columns; returns the number folded.
+
+    The deltas are deleted with RETURNING in the same transaction as the
+    UPDATEs, so concurrent rollups in several processes never apply a
+    delta twice.
+    """
+    engine = engine or db.engine
+    folded = 0
+    while True:
+        with engine.begin() as conn:
+            batch = db.select(forum_counter_deltas.c.id).order_by(forum_counter_deltas.c.id).limit(ROLLUP_BATCH)
+            rows = conn.execute(
+                forum_counter_deltas.delete()
+                .where(forum_counter_deltas.c.id.in_(batch.scalar_subquery()))
+                .returning(
+                    forum_counter_deltas.c.table_name, forum_counter_deltas.c.column_name,
+                    forum_counter_deltas.c.row_id, forum_counter_deltas.c.delta,
+                    forum_counter_deltas.c.value
+                )
+            ).all()
+            if not rows:
+                return folded
+
+            sums = defaultdict(int)
+            latest = {}
+            for table_name, column, row_id, delta, value in rows:
+                key = (table_name, column, row_id)
+                if value is not None:
+                    latest[key] = max(value, latest.get(key, value))
+                else:
+                    sums[key] += delta
+
+            by_column = defaultdict(list)
+            for (table_name, column, row_id), amount in sums.items():
+                if amount:
+                    by_column[(table_name, column)].append({'row_id': row_id, 'amount': amount})
+
+            for (table_name, column), updates in by_column.items():
+                table = db.metadata.tables[table_name]
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == db.bindparam('row_id'))
+                    .values({column: db.func.coalesce(table.c[column], 0) + db.bindparam('amount')}),
+                    updates
+                )
+
+            by_column = defaultdict(list)
+            for (table_name, column, row_id), value in latest.items():
+                by_column[(table_name, column)].append({'row_id': row_id, 'value': value})
+
+            for (table_name, column), updates in by_column.items():
+                table = db.metadata.tables[table_name]
+                raised = db.case(
+                    (db.or_(table.c[column].is_(None), table.c[column] < db.bindparam('value')),
+                     db.bindparam('value')),
+                    else_=table.c[column]
+                )
+                conn.execute(
+                    table.update().where(table.c.id == db.bindparam('row_id')).values({column: raised}),
+                    updates
+                )
+            folded += len(rows)
+
+        if len(rows) < ROLLUP_BATCH:
+            return folded
+
+
+def _count(model, *conditions):
+    return db.select(db.func.count()).select_from(model).where(*conditions).scalar_subquery()
+
+
+def _counters():
+    """(model, column, expected value) for every maintained counter"""
+    topic_posts = db.select(db.func.count()).select_from(ForumPost).join(
+        ForumTopic, ForumTopic.id == ForumPost.topic_id
+    ).where(ForumTopic.category_id == ForumCategory.id).scalar_subquery()
+
+    return [
+        (ForumTopic, 'reply_count', _count(ForumPost, ForumPost.topic_id == ForumTopic.id)),
+        (ForumCategory, 'topic_count', _count(ForumTopic, ForumTopic.category_id == ForumCategory.id)),
+        (ForumCategory, 'post_count', _count(ForumTopic, ForumTopic.category_id == ForumCategory.id) + topic_posts),
+        (User, 'forum_posts_count',
+         _count(ForumTopic, ForumTopic.author_id == User.id) + _count(ForumPost, ForumPost.author_id == User.id)),
+        # Maintained inline by src.groups; it never has pending deltas
+        (InterestGroup, 'member_count', _count(group_memberships, group_memberships.c.group_id == InterestGroup.id)),
+    ]
+
+
+def _pending(model, column):
+    table = model.__table__
+    return db.select(db.func.coalesce(db.func.sum(forum_counter_deltas.c.delta), 0)).where(
+        forum_counter_deltas.c.table_name == table.name,
+        forum_counter_deltas.c.column_name == column,
+        forum_counter_deltas.c.row_id == table.c.id
+    ).scalar_subquery()
+
+
+def check_counters(fix=False):
+    """Return [(table, column, id, stored, expected)] for counters that drifted.
+
+    A counter is correct when its column plus its pending deltas equals
+    the recomputed count. With `fix`, drifted columns are set so that this
+    holds again; the caller commits.
+    """
+    drifted = []
+    for model, column, expected in _counters():
+        table = model.__table__
+        stored = db.func.coalesce(table.c[column], 0) + _pending(model, column)
+        rows = db.session.execute(
+            db.select(table.c.id, stored, expected).where(stored != expected).order_by(table.c.id)
+        ).all()
+        drifted.extend((table.name, column, row_id, value, actual) for row_id, value, actual in rows)
+
+        if fix and rows:
+            db.session.execute(
+                table.update().where(table.c.id.in_([row.id for row in rows])).values(
+                    {column: expected - _pending(model, column)}
+                )
+            )
+    return drifted
+
+
+def init_app(app):
+    start_job(app, 'forum-counter-rollup', app.config.get('FORUM_COUNTER_ROLLUP_INTERVAL', 2), rollup)
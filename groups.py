@@ -0,0 +1,80 @@
+"""Interest group membership.
+
+Joining or leaving changes `group_memberships` and `member_count` in the
+same transaction. The count only moves when the INSERT or DELETE actually
+changed a row, so a retried or concurrent request cannot count a member
+twice.
+
+Group-scoped permission checks ask `is_group_member()`, which is served from
+a cached set of group ids per user. A membership change invalidates that
+user's set through the cache registry: locally right away, and in other
+processes within CACHE_POLL_INTERVAL.
+"""
+from flask import current_app
+from src.models.user import db
+from src.models.community import InterestGroup, group_memberships
+from src.cache import cache_registry, invalidate_cache
+from src.dbutil import insert_ignore
+
+
+def member_tag(user_id):
+    return f'groups:member:{user_id}'
+
+
+def _membership_cache():
+    return cache_registry.get_cache(
+        'group-memberships',
+        current_app.config.get('GROUP_MEMBERSHIP_CACHE_SIZE', 10000),
+        current_app.config.get('GROUP_MEMBERSHIP_CACHE_TTL', 300)
+    )
+
+
+def member_group_ids(user_id):
+    """Return the frozenset of group ids the user belongs to"""
+    user_id = int(user_id)
+    if cache_registry.enabled:
+        cache_registry.poll()
+        cache = _membership_cache()
+        group_ids = cache.get(user_id)
+        if group_ids is not None:
+            return group_ids
+
+    group_ids = frozenset(db.session.execute(
+        db.select(group_memberships.c.group_id).where(group_memberships.c.user_id == user_id)
+    ).scalars())
+    if cache_registry.enabled:
+        cache.set(user_id, group_ids, tags=[member_tag(user_id)])
+    return group_ids
+
+
+def is_group_member(user_id, group_id):
+    return user_id is not None and group_id in member_group_ids(user_id)
+
+
+def _adjust_member_count(group_id, delta):
+    groups = InterestGroup.__table__
+    db.session.execute(groups.update().where(groups.c.id == group_id).values(
+        member_count=db.func.coalesce(groups.c.member_count, 0) + delta
+    ))
+
+
+def join_group(group_id, user_id):
+    """Add a member; returns False when already one. The caller commits"""
+    added = db.session.execute(insert_ignore(group_memberships).values(
+        user_id=user_id, group_id=group_id
+    )).rowcount
+    if added:
+        _adjust_member_count(group_id, 1)
+        invalidate_cache(member_tag(user_id))
+    return bool(added)
+
+
+def leave_group(group_id, user_id):
+    """Remove a member; returns False when not one. The caller commits"""
+    removed = db.session.execute(group_memberships.delete().where(
+        group_memberships.c.group_id == group_id, group_memberships.c.user_id == user_id
+    )).rowcount
+    if removed:
+        _adjust_member_count(group_id, -1)
+        invalidate_cache(member_tag(user_id))
+    return bool(removed)
@@ -0,0 +1,264 @@
+"""Streaming bulk import of news articles and research paper metadata.
+
+`flask news import FILE` and `flask research import FILE` read NDJSON (one
+JSON object per line) or CSV with a header row. Each record is validated
+with the same rules as the create endpoints, and the valid rows of a
+chunk are inserted with one executemany. Slugs and author names are also
+resolved with one query per chunk.
+
+Every chunk is its own transaction, and that transaction also records how
+far into the file the import got in `import_checkpoints`. A failed or
+interrupted import continues after the last committed chunk when run
+again, without duplicating rows. `--restart` ignores the checkpoint.
+
+Records may contain `status`, `published_at`, `created_at` and `author`
+(a username; the --author option is the default) besides the fields the
+endpoints accept. Research papers are imported without a file: their
+download returns 404, and PDF processing and `migrate-storage` skip them.
+"""
+import csv
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+import click
+from sqlalchemy.exc import IntegrityError
+from src.models.user import User, db
+from src.models.news import NewsArticle, NewsCategory, NewsStatus
+from src.models.research import ResearchPaper, ResearchCategory, ResearchStatus
+from src.stats import NEWS, RESEARCH, adjust_stats
+from src.cache import NEWS_LIST_TAG, invalidate_cache
+from src.syndication import refresh_feeds
+from src.slugs import SLUG_ATTEMPTS, allocate_slugs
+from src.tags import set_tags_bulk
+from src.validation import ValidationError, parse_utc, validate_news_article, validate_research_paper
+
+import_checkpoints = db.Table(
+    'import_checkpoints',
+    db.Column('source', db.String(500), primary_key=True),
+    db.Column('line', db.Integer, nullable=False),
+    db.Column('imported', db.Integer, nullable=False, default=0),
+    db.Column('skipped', db.Integer, nullable=False, default=0),
+    db.Column('updated_at', db.DateTime, nullable=False),
+)
+
+
+def read_records(path, fmt):
+    """Yield (line_number, record, error) for each record in the file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record, None
+            return
+
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, 'Expected a JSON object'
+                continue
+            yield line_number, record, None
+
+
+def _status(record, enum, default):
+    value = str(record.get('status') or default.value).strip().lower()
+    try:
+        return enum(value)
+    except ValueError:
+        raise ValidationError('Invalid status')
+
+
+def _datetime(record, field):
+    value = record.get(field)
+    if not value:
+        return None
+    try:
+        return parse_utc(str(value).strip())
+    except ValueError:
+        raise ValidationError(f'Invalid {field}')
+
+
+class NewsImport:
+    kind = NEWS
+
+    def build_row(self, record, now):
+        row = validate_news_article(record)
+        row['status'] = _status(record, NewsStatus, NewsStatus.DRAFT)
+        row['published_at'] = _datetime(record, 'published_at')
+        if row['status'] == NewsStatus.PUBLISHED and row['published_at'] is None:
+            row['published_at'] = now
+        row['created_at'] = _datetime(record, 'created_at') or row['published_at'] or now
+        row['updated_at'] = now
+        row['views'] = 0
+        return row
+
+    def insert(self, rows):
+        for attempt in range(SLUG_ATTEMPTS):
+            for row, slug in zip(rows, allocate_slugs([row['title'] for row in rows])):
+                row['slug'] = slug
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(NewsArticle.__table__.insert(), rows)
+                return
+            except IntegrityError:
+                # A concurrent writer took one of the slugs; allocate the chunk again
+                if attempt == SLUG_ATTEMPTS - 1:
+                    raise
+
+    def after_chunk(self, rows):
+        # Slugs are unique, so they give back the ids executemany does not return
+        ids = dict(db.session.query(NewsArticle.slug, NewsArticle.id).filter(
+            NewsArticle.slug.in_([row['slug'] for row in rows])
+        ).all())
+        set_tags_bulk(
+            {ids[row['slug']]: row['tags'] for row in rows if row['tags']},
+            {ids[row['slug']] for row in rows if row['status'] == NewsStatus.PUBLISHED}
+        )
+
+    def finish(self):
+        invalidate_cache(NEWS_LIST_TAG)
+        refresh_feeds(NEWS, list(NewsCategory))
+
+
+class ResearchImport:
+    kind = RESEARCH
+
+    def build_row(self, record, now):
+        row = validate_research_paper(record)
+        row['status'] = _status(record, ResearchStatus, ResearchStatus.PENDING)
+        row['published_at'] = _datetime(record, 'published_at')
+        if row['status'] == ResearchStatus.APPROVED and row['published_at'] is None:
+            row['published_at'] = now
+        row['created_at'] = _datetime(record, 'created_at') or row['published_at'] or now
+        row['updated_at'] = now
+        row['views'] = row['downloads'] = row['likes'] = 0
+        row['filename'] = row['file_path'] = row['file_size'] = None
+        return row
+
+    def insert(self, rows):
+        db.session.execute(ResearchPaper.__table__.insert(), rows)
+
+    def after_chunk(self, rows):
+        users = User.__table__
+        counts = Counter(row['author_id'] for row in rows)
+        db.session.execute(
+            users.update().where(users.c.id == db.bindparam('user_id')).values(
+                research_count=db.func.coalesce(users.c.research_count, 0) + db.bindparam('added')
+            ),
+            [{'user_id': user_id, 'added': added} for user_id, added in counts.items()]
+        )
+
+    def finish(self):
+        refresh_feeds(RESEARCH, list(ResearchCategory))
+
+
+IMPORTS = {NEWS: NewsImport(), RESEARCH: ResearchImport()}
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _author_ids(usernames):
+    rows = db.session.query(User.username, User.id).filter(User.username.in_(usernames))
+    return dict(rows.all())
+
+
+def _save_checkpoint(source, line, imported, skipped, exists):
+    values = {'line': line, 'imported': imported, 'skipped': skipped, 'updated_at': datetime.utcnow()}
+    if exists:
+        db.session.execute(
+            import_checkpoints.update().where(import_checkpoints.c.source == source).values(**values)
+        )
+    else:
+        db.session.execute(import_checkpoints.insert().values(source=source, **values))
+
+
+def run_import(kind, path, fmt=None, chunk_size=1000, default_author='admin', restart=False):
+    """Import a file in chunked transactions; returns (imported, skipped)"""
+    importer = IMPORTS[kind]
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    source = f'{kind}:{os.path.abspath(path)}'
+
+    checkpoint = db.session.execute(
+        db.select(import_checkpoints).where(import_checkpoints.c.source == source)
+    ).first()
+    if checkpoint is not None and restart:
+        db.session.execute(import_checkpoints.delete().where(import_checkpoints.c.source == source))
+        db.session.commit()
+        checkpoint = None
+
+    start_line = checkpoint.line if checkpoint else 0
+    imported = checkpoint.imported if checkpoint else 0
+    skipped = checkpoint.skipped if checkpoint else 0
+    if checkpoint:
+        click.echo(f"Resuming after line {start_line} ({imported} imported, {skipped} skipped so far)")
+
+    records = (entry for entry in read_records(path, fmt) if entry[0] > start_line)
+    has_checkpoint = checkpoint is not None
+    started = time.perf_counter()
+    imported_now = 0
+
+    for chunk in _chunks(records, chunk_size):
+        now = datetime.utcnow()
+        usernames = {
+            str(record.get('author') or default_author).strip()
+            for _, record, error in chunk if error is None
+        }
+        author_ids = _author_ids(usernames)
+
+        rows = []
+        for line_number, record, error in chunk:
+            try:
+                if error is not None:
+                    raise ValidationError(error)
+                row = importer.build_row(record, now)
+                author = str(record.get('author') or default_author).strip()
+                if author not in author_ids:
+                    raise ValidationError(f'Unknown author: {author}')
+                row['author_id'] = author_ids[author]
+                rows.append(row)
+            except ValidationError as e:
+                skipped += 1
+                click.echo(f"line {line_number}: {e}", err=True)
+
+        if rows:
+            importer.insert(rows)
+            for (status, category), count in Counter(
+                (row['status'], row['category']) for row in rows
+            ).items():
+                adjust_stats(importer.kind, status, category, count)
+            importer.after_chunk(rows)
+
+        imported += len(rows)
+        imported_now += len(rows)
+        _save_checkpoint(source, chunk[-1][0], imported, skipped, has_checkpoint)
+        has_checkpoint = True
+        db.session.commit()
+
+        elapsed = time.perf_counter() - started
+        click.echo(
+            f"Imported {imported}, skipped {skipped} (line {chunk[-1][0]}, "
+            f"{imported_now / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+
+    # Feeds and caches once at the end, which also covers chunks of an earlier run
+    if imported:
+        importer.finish()
+        db.session.commit()
+
+    return imported, skipped
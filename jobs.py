@@ -0,0 +1,90 @@
+"""Periodic background jobs running inside the app process"""
+import atexit
+import logging
+import multiprocessing
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    """Run a function every `interval` seconds on a daemon thread.
+
+    The function runs inside an application context. Errors are logged and
+    the job keeps running. `wake()` runs the job early, and `stop()` can run
+    it one final time, which is how buffered work gets flushed at shutdown.
+    """
+
+    def __init__(self, app, name, interval, func):
+        self.app = app
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or not self.interval or self.interval <= 0:
+            return
+        self._thread = threading.Thread(
+            target=self._loop, name=f'job-{self.name}', daemon=True
+        )
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def run_once(self):
+        # Serialize runs so a wake-up and the timer never overlap
+        with self._run_lock:
+            with self.app.app_context():
+                try:
+                    return self.func()
+                except Exception as e:
+                    logger.error(f"Background job {self.name} failed: {str(e)}")
+
+    def stop(self, run_final=False):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+        if run_final:
+            self.run_once()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.run_once()
+
+
+def start_job(app, name, interval, func, run_at_exit=False):
+    """Register and start a periodic job on the app.
+
+    Jobs are only started when BACKGROUND_JOBS_ENABLED is true, but a job
+    with run_at_exit still runs once when the process shuts down. Nothing
+    runs in multiprocessing workers, which re-import the main module when
+    they are spawned.
+    """
+    job = PeriodicJob(app, name, interval, func)
+    app.extensions.setdefault('periodic_jobs', {})[name] = job
+
+    if multiprocessing.parent_process() is not None:
+        return job
+
+    if app.config.get('BACKGROUND_JOBS_ENABLED', True):
+        job.start()
+
+    if run_at_exit:
+        atexit.register(job.stop, run_final=True)
+
+    return job
+
+
+def get_job(app, name):
+    """Return a registered job by name, or None"""
+    return app.extensions.get('periodic_jobs', {}).get(name)
@@ -0,0 +1,75 @@
+"""Per-user likes for research papers.
+
+Each like is a row in `research_paper_likes` keyed by (user_id, paper_id),
+so a user can like a paper at most once. The denormalized
+`ResearchPaper.likes` counter is adjusted in the same transaction, and only
+when a row was actually inserted or deleted.
+"""
+from datetime import datetime
+from src.models.user import db
+from src.models.research import ResearchPaper
+from src.dbutil import insert_ignore
+
+research_paper_likes = db.Table(
+    'research_paper_likes',
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('paper_id', db.Integer, db.ForeignKey('research_papers.id'), primary_key=True, index=True),
+    db.Column('created_at', db.DateTime, default=datetime.utcnow, nullable=False),
+)
+
+
+def _adjust_likes(paper_id, delta):
+    db.session.execute(
+        db.update(ResearchPaper)
+        .where(ResearchPaper.id == paper_id)
+        .values(likes=ResearchPaper.likes + delta)
+    )
+
+
+def like_paper(user_id, paper_id):
+    """Record a like; returns False if the user already liked the paper"""
+    result = db.session.execute(
+        insert_ignore(research_paper_likes).values(
+            user_id=user_id, paper_id=paper_id, created_at=datetime.utcnow()
+        )
+    )
+    if result.rowcount == 0:
+        return False
+
+    _adjust_likes(paper_id, 1)
+    return True
+
+
+def unlike_paper(user_id, paper_id):
+    """Remove a like; returns False if there was nothing to remove"""
+    result = db.session.execute(
+        research_paper_likes.delete().where(
+            research_paper_likes.c.user_id == user_id,
+            research_paper_likes.c.paper_id == paper_id
+        )
+    )
+    if result.rowcount == 0:
+        return False
+
+    _adjust_likes(paper_id, -1)
+    return True
+
+
+def liked_paper_ids(user_id, paper_ids):
+    """Return the subset of paper_ids the user has liked, in one query"""
+    if not paper_ids:
+        return set()
+
+    rows = db.session.execute(
+        db.select(research_paper_likes.c.paper_id).where(
+            research_paper_likes.c.user_id == user_id,
+            research_paper_likes.c.paper_id.in_(paper_ids)
+        )
+    )
+    return {row.paper_id for row in rows}
+
+
+def get_like_count(paper_id):
+    return db.session.execute(
+        db.select(ResearchPaper.likes).where(ResearchPaper.id == paper_id)
+    ).scalar() or 0
@@ -0,0 +1,302 @@
+"""Live forum and event updates over Server-Sent Events.
+
+Write paths call `publish_event()` before they commit. The event becomes a
+row in `live_events` in the same transaction, so only committed changes are
+ever announced. Because the id comes from the database, it means the same
+thing in every app process.
+
+Each process polls that table once per SSE_POLL_INTERVAL, and only while it
+has subscribers. A poll reads the rows with an id above the highest one it
+has seen, and new rows are fanned out in memory to the local streams. A new
+post therefore costs one query per process rather than one per connected
+client. Ids can commit out of order, so an id skipped by a poll is kept as
+a gap and asked for again by later polls. The gap is dropped after
+SSE_GAP_TIMEOUT, by which time its transaction has most likely rolled back.
+An event found through a gap is delivered after newer ones. Every payload
+carries the id of its post, topic or event, so clients can order them.
+
+Every stream has a bounded queue of SSE_QUEUE_SIZE events. When a consumer
+is too slow to keep up, it is evicted rather than buffered without limit.
+Its stream ends, and the browser's EventSource reconnects with a
+Last-Event-ID header; the events it missed are then replayed from the table.
+
+A waiting stream holds no database connection. It does hold a worker,
+which with sync workers is a whole thread. Serve streams from gevent
+workers (`gunicorn -k gevent`), where each idle client costs one greenlet.
+"""
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, request
+from src.models.user import db
+from src.jobs import start_job
+
+live_events = db.Table(
+    'live_events',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('channel', db.String(100), nullable=False, index=True),
+    db.Column('event', db.String(50), nullable=False),
+    db.Column('data', db.Text, nullable=False),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow, index=True),
+)
+
+# Skipped ids are polled for this long before their transaction is assumed gone
+GAP_TIMEOUT = timedelta(minutes=5)
+
+# Gaps tracked at most; beyond this, the oldest are given up first
+MAX_GAPS = 10000
+
+# How long clients wait before reconnecting, in milliseconds
+RETRY_MS = 3000
+
+
+def topic_channel(topic_id):
+    """New posts in a forum topic"""
+    return f'forum:topic:{topic_id}'
+
+
+def category_channel(category_id):
+    """New topics in a forum category"""
+    return f'forum:category:{category_id}'
+
+
+def event_channel(event_id):
+    """Attendance changes of a community event"""
+    return f'events:{event_id}'
+
+
+class TooManySubscribers(Exception):
+    """Raised when this process already serves SSE_MAX_SUBSCRIBERS streams"""
+
+
+def format_event(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+
+class Subscription:
+    """One stream's bounded queue of (id, event, data) tuples"""
+
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.queue = queue.Queue(size)
+        self.evicted = False
+
+    def offer(self, item):
+        """Queue an event; returns False when the queue is full"""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+
+class EventBus:
+    """Per-process fan-out of `live_events` rows to subscribed streams"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._count = 0
+        self._last_id = None
+        self._gaps = {}
+        self.gap_timeout = GAP_TIMEOUT
+        self.queue_size = 100
+        self.keepalive = 15
+        self.max_subscribers = 5000
+        self.replay_limit = 100
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.queue_size = app.config.get('SSE_QUEUE_SIZE', 100)
+        self.keepalive = app.config.get('SSE_KEEPALIVE', 15)
+        self.max_subscribers = app.config.get('SSE_MAX_SUBSCRIBERS', 5000)
+        self.replay_limit = app.config.get('SSE_REPLAY_LIMIT', 100)
+        self.gap_timeout = timedelta(seconds=app.config.get('SSE_GAP_TIMEOUT', GAP_TIMEOUT.total_seconds()))
+        start_job(app, 'live-events', app.config.get('SSE_POLL_INTERVAL', 1.0), self.poll)
+        start_job(app, 'live-events-prune', 600, prune_events)
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers()
+            subscription = Subscription(channel, self.queue_size)
+            self._subscribers.setdefault(channel, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+            self._count -= 1
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._count
+
+    def start_from_latest(self):
+        """Start polling after the newest row when nothing is being polled yet"""
+        with self._lock:
+            if self._last_id is not None:
+                return
+        with db.engine.connect() as conn:
+            latest = conn.execute(db.select(db.func.coalesce(db.func.max(live_events.c.id), 0))).scalar()
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = latest
+
+    def poll(self):
+        """Deliver events committed by any process since the last poll"""
+        with self._lock:
+            channels = list(self._subscribers)
+            last_id = self._last_id
+            gaps = list(self._gaps)
+
+        # Nobody here is listening; the next subscriber starts from the newest row
+        if not channels:
+            with self._lock:
+                self._last_id = None
+                self._gaps = {}
+            return 0
+        if last_id is None:
+            self.start_from_latest()
+            return 0
+
+        # Every new id is read, so skipped ones show up as gaps; only the
+        # rows of channels with subscribers carry their payload
+        wanted = live_events.c.channel.in_(channels)
+        condition = live_events.c.id > last_id
+        if gaps:
+            condition = db.or_(condition, live_events.c.id.in_(gaps))
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(
+                    live_events.c.id, live_events.c.channel,
+                    db.case((wanted, live_events.c.event)).label('event'),
+                    db.case((wanted, live_events.c.data)).label('data')
+                ).where(condition).order_by(live_events.c.id)
+            ).all()
+
+        polled_at = datetime.utcnow()
+        delivered = 0
+        with self._lock:
+            if self._last_id is None:
+                return 0  # everyone left while the query ran
+            ids = {row.id for row in rows}
+            newest = max(ids, default=last_id)
+            if newest > last_id:
+                for missing in range(max(last_id + 1, newest - MAX_GAPS), newest):
+                    if missing not in ids:
+                        self._gaps[missing] = polled_at
+                self._last_id = max(self._last_id, newest)
+
+            for row in rows:
+                self._gaps.pop(row.id, None)
+                if row.data is None:
+                    continue
+                for subscription in list(self._subscribers.get(row.channel, ())):
+                    if subscription.offer((row.id, row.event, row.data)):
+                        delivered += 1
+                    else:
+                        self._evict(subscription)
+
+            expired = polled_at - self.gap_timeout
+            self._gaps = {i: t for i, t in self._gaps.items() if t >= expired}
+            if len(self._gaps) > MAX_GAPS:
+                self._gaps = dict(sorted(self._gaps.items())[-MAX_GAPS:])
+        return delivered
+
+    def _evict(self, subscription):
+        """Drop a consumer whose queue is full; caller holds the lock"""
+        subscription.evicted = True
+        subscribers = self._subscribers.get(subscription.channel, set())
+        if subscription in subscribers:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+            self._count -= 1
+            self.evictions += 1
+
+    def stream(self, subscription, replay=()):
+        """Yield the SSE body: the replayed events, then live ones until evicted"""
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            last_id = 0
+            for row in replay:
+                last_id = row.id
+                yield format_event(row.id, row.event, row.data)
+
+            while not subscription.evicted:
+                try:
+                    event_id, event, data = subscription.queue.get(timeout=self.keepalive)
+                except queue.Empty:
+                    # Comment lines keep proxies from closing the connection
+                    # and reveal clients that went away
+                    yield ': keepalive\n\n'
+                    continue
+                if subscription.evicted:
+                    break
+                if event_id > last_id:
+                    yield format_event(event_id, event, data)
+        finally:
+            self.unsubscribe(subscription)
+
+
+event_bus = EventBus()
+
+
+def publish_event(channel, event, data):
+    """Record an event in the current transaction; the caller commits"""
+    db.session.execute(live_events.insert().values(
+        channel=channel, event=event, data=json.dumps(data, default=str), created_at=datetime.utcnow()
+    ))
+
+
+def prune_events():
+    db.session.execute(live_events.delete().where(
+        live_events.c.created_at < datetime.utcnow() - timedelta(hours=1)
+    ))
+    db.session.commit()
+
+
+def _last_event_id():
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def event_stream(channel):
+    """Streaming text/event-stream response for a channel.
+
+    Raises TooManySubscribers when the process is at its stream limit.
+    """
+    subscription = event_bus.subscribe(channel)
+    try:
+        event_bus.start_from_latest()
+        replay = []
+        last_event_id = _last_event_id()
+        if last_event_id is not None:
+            with db.engine.connect() as conn:
+                replay = conn.execute(
+                    db.select(live_events.c.id, live_events.c.event, live_events.c.data)
+                    .where(live_events.c.channel == channel, live_events.c.id > last_event_id)
+                    .order_by(live_events.c.id).limit(event_bus.replay_limit)
+                ).all()
+    except Exception:
+        event_bus.unsubscribe(subscription)
+        raise
+
+    response = current_app.response_class(event_bus.stream(subscription, replay), mimetype='text/event-stream')
+    # The generator's own cleanup does not run if it never started
+    response.call_on_close(lambda: event_bus.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
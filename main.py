@@ -12,6 +12,8 @@ from src.routes.auth import auth_bp
 from src.routes.research import research_bp
 from src.routes.news import news_bp
 from src.routes.community import community_bp
+from src.routes.feeds import feeds_bp
+from src.benchmarks import bench_cli
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -29,6 +31,10 @@ app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(research_bp, url_prefix='/api')
 app.register_blueprint(news_bp, url_prefix='/api')
 app.register_blueprint(community_bp, url_prefix='/api')
+app.register_blueprint(feeds_bp, url_prefix='/feeds')
+
+# Register CLI commands
+app.cli.add_command(bench_cli)
 
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
@@ -38,18 +44,127 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 
+# Let a front proxy serve paper downloads instead of the Python worker:
+# USE_X_SENDFILE for Apache/lighttpd, DOWNLOAD_ACCEL_REDIRECT_PREFIX for an
+# nginx internal location that maps to UPLOAD_FOLDER
+app.config['USE_X_SENDFILE'] = False
+app.config['DOWNLOAD_ACCEL_REDIRECT_PREFIX'] = None  # e.g. '/protected-uploads/'
+
 # Create upload directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Background job configuration
+app.config['BACKGROUND_JOBS_ENABLED'] = True
+
+# View/download/like counters are buffered and flushed in batches
+app.config['COUNTER_FLUSH_INTERVAL'] = 5  # seconds
+app.config['COUNTER_MAX_PENDING'] = 10000  # flush early above this many counters
+app.config['COUNTER_LOG_DIR'] = os.path.join(os.path.dirname(__file__), 'database', 'counters')
+app.config['COUNTER_LOG_FSYNC'] = False
+
+# Precomputed /research/stats and /news/stats rows are recomputed periodically
+app.config['STATS_RECONCILE_INTERVAL'] = 300  # seconds
+
+# Uploaded PDFs are validated, text-extracted and thumbnailed in worker
+# processes; at most PDF_QUEUE_DEPTH papers per app process are in flight,
+# the rest wait in the database. PDF_WORKERS = 0 leaves processing to
+# `flask research process-pdfs`
+app.config['PDF_WORKERS'] = 2
+app.config['PDF_QUEUE_DEPTH'] = 20
+app.config['PDF_SWEEP_INTERVAL'] = 30  # seconds
+app.config['PDF_PROCESSING_TIMEOUT'] = 600  # seconds before a stuck paper is retried
+app.config['PDF_TEXT_MAX_CHARS'] = 200000
+app.config['PDF_THUMBNAIL_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails')
+
+# sort_by=trending ranks papers by views/downloads/likes with exponential decay
+app.config['TRENDING_INTERVAL'] = 300  # seconds between recomputes
+app.config['TRENDING_HALF_LIFE_HOURS'] = 24
+app.config['TRENDING_WEIGHTS'] = {'views': 1.0, 'downloads': 3.0, 'likes': 5.0}
+
+# Moderators claim pending papers for this long before they return to the queue
+app.config['REVIEW_LEASE_SECONDS'] = 900
+
+# Precomputed related papers, refit by a background job (or on demand with
+# `flask research rebuild-related`); approvals in between are merged in
+# against at most RELATED_RECENT_LIMIT recently added papers
+app.config['RELATED_TOP_K'] = 20
+app.config['RELATED_REBUILD_INTERVAL'] = 3600  # seconds
+app.config['RELATED_RECENT_LIMIT'] = 2000  # papers
+app.config['RELATED_MODEL_PATH'] = os.path.join(os.path.dirname(__file__), 'database', 'related_model.npz')
+
+# /news and /news/featured responses are cached per process and dropped when
+# articles are published, unpublished or edited; other processes pick up an
+# invalidation within CACHE_POLL_INTERVAL
+app.config['CACHE_ENABLED'] = True
+app.config['CACHE_TTL'] = 60  # seconds
+app.config['CACHE_MAX_ENTRIES'] = 1024
+app.config['CACHE_POLL_INTERVAL'] = 1.0  # seconds
+
+# RSS/Atom/JSON feeds under /feeds are re-rendered on publish and approval;
+# item links point at SITE_URL
+app.config['SITE_URL'] = 'https://vgh0i1c11z6d.manus.space'
+app.config['FEED_ITEM_LIMIT'] = 50
+app.config['FEED_MAX_AGE'] = 60  # seconds clients may reuse a feed before revalidating
+
+# Articles with a publish_at/unpublish_at are switched by a periodic job, which
+# then renders these endpoints so the first readers hit a warm cache
+app.config['SCHEDULER_INTERVAL'] = 15  # seconds
+app.config['SCHEDULER_WARM_ENDPOINTS'] = ['news.get_news_articles', 'news.get_featured_news']
+
+# Per-user sets of group ids answer membership checks; a join or leave
+# invalidates the user's set like any other cache entry
+app.config['GROUP_MEMBERSHIP_CACHE_SIZE'] = 10000  # users
+app.config['GROUP_MEMBERSHIP_CACHE_TTL'] = 300  # seconds
+
+# /forum/.../stream and /events/<id>/stream push updates as Server-Sent Events.
+# Each process polls live_events every SSE_POLL_INTERVAL while it has streams;
+# a stream whose SSE_QUEUE_SIZE queue overflows is dropped and its client
+# resumes with Last-Event-ID. Serve streams from gevent workers
+app.config['SSE_POLL_INTERVAL'] = 1.0  # seconds
+app.config['SSE_QUEUE_SIZE'] = 100  # events per stream
+app.config['SSE_KEEPALIVE'] = 15  # seconds between keepalive comments
+app.config['SSE_MAX_SUBSCRIBERS'] = 5000  # streams per process
+app.config['SSE_REPLAY_LIMIT'] = 100  # missed events replayed on reconnect
+app.config['SSE_GAP_TIMEOUT'] = 300  # seconds a skipped event id is polled for
+
+# Forum post/topic counters are appended as deltas and folded into the
+# topic, category and user columns by a periodic rollup
+app.config['FORUM_COUNTER_ROLLUP_INTERVAL'] = 2  # seconds
+
 db.init_app(app)
 
 # Import all models to ensure they're registered with SQLAlchemy
 from src.models.research import ResearchPaper
 from src.models.news import NewsArticle
 from src.models.community import ForumCategory, ForumTopic, ForumPost, InterestGroup, CommunityEvent
+from src.storage import StoredFile
+from src.processing import pdf_pipeline
+from src.search import ensure_search_index
+from src.slugs import ensure_slug_index
+from src.registration import ensure_attendee_index
+from src.unread import ensure_read_index
+from src.syndication import ensure_feeds
+from src.counters import counters
+from src import forum_counters, related, scheduling, stats, trending
+from src.cache import cache_registry
+from src.live import event_bus
 
 with app.app_context():
     db.create_all()
+    ensure_search_index()
+    ensure_slug_index()
+    ensure_attendee_index()
+    ensure_read_index()
+
+counters.init_app(app)
+stats.init_app(app)
+trending.init_app(app)
+related.init_app(app)
+cache_registry.init_app(app)
+scheduling.init_app(app)
+event_bus.init_app(app)
+forum_counters.init_app(app)
+pdf_pipeline.init_app(app)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -187,6 +302,9 @@ def create_default_data():
             db.session.add(paper)
     
     try:
+        db.session.commit()
+        stats.reconcile_stats()
+        ensure_feeds()
         db.session.commit()
         print("Default data created successfully!")
     except Exception as e:
@@ -2,34 +2,40 @@ from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import User, UserRole, db
 from src.models.news import NewsArticle, NewsCategory, NewsStatus
+from src.counters import counters
+from src.stats import NEWS, adjust_stats, move_stats, get_stats
+from src.pagination import paginate, InvalidCursor
+from src.projection import NEWS_SUMMARY, InvalidFields
+from src.syndication import refresh_feeds
+from src.slugs import assign_slug
+from src.validation import ValidationError, parse_utc, validate_news_article
+from src.importer import run_import
+from src.tags import count_published, get_tag_facets, rebuild_tags, set_article_tags, tag_filter
+from src.scheduling import clear_schedule, get_schedules, schedule_to_dict, set_schedule
+from src.cache import (
+    NEWS_LIST_TAG, cache_registry, cached_response, invalidate_cache, news_article_tag, tag_response
+)
 from datetime import datetime
-import re
+import click
 
 news_bp = Blueprint('news', __name__)
 
-def generate_slug(title):
-    """Generate URL-friendly slug from title"""
-    # Convert to lowercase and replace spaces with hyphens
-    slug = re.sub(r'[^\w\s-]', '', title.lower())
-    slug = re.sub(r'[-\s]+', '-', slug)
-    return slug.strip('-')
-
 @news_bp.route('/news', methods=['GET'])
+@cached_response('news', tags=[NEWS_LIST_TAG])
 def get_news_articles():
     """Get all published news articles with filtering and pagination"""
     try:
         # Query parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         category = request.args.get('category', '')
+        tag = request.args.get('tag', '')
         search = request.args.get('search', '')
         sort_by = request.args.get('sort_by', 'newest')
+        fields = NEWS_SUMMARY.parse()
         
-        # Limit per_page to prevent abuse
-        per_page = min(per_page, 100)
-        
-        # Base query - only published articles
-        query = NewsArticle.query.filter_by(status=NewsStatus.PUBLISHED)
+        # Base query - only published articles, without their bodies
+        query = NewsArticle.query.filter_by(status=NewsStatus.PUBLISHED).options(
+            *(NEWS_SUMMARY.options(fields) if fields else NEWS_SUMMARY.default_options())
+        )
         
         # Apply filters
         if category:
@@ -39,6 +45,9 @@ def get_news_articles():
             except ValueError:
                 return jsonify({'error': 'Invalid category'}), 400
         
+        if tag:
+            query = query.filter(tag_filter(tag))
+        
         if search:
             search_term = f"%{search}%"
             query = query.filter(
@@ -47,33 +56,30 @@ def get_news_articles():
                 (NewsArticle.excerpt.ilike(search_term))
             )
         
-        # Apply sorting
-        if sort_by == 'newest':
-            query = query.order_by(NewsArticle.published_at.desc())
-        elif sort_by == 'oldest':
-            query = query.order_by(NewsArticle.published_at.asc())
-        elif sort_by == 'most_viewed':
-            query = query.order_by(NewsArticle.views.desc())
-        else:
-            query = query.order_by(NewsArticle.published_at.desc())
+        # Sort keys, each ending with the id so the order is unique
+        sort_options = {
+            'newest': [(NewsArticle.published_at, True), (NewsArticle.id, True)],
+            'oldest': [(NewsArticle.published_at, False), (NewsArticle.id, False)],
+            'most_viewed': [(NewsArticle.views, True), (NewsArticle.id, True)],
+        }
+        if sort_by not in sort_options:
+            sort_by = 'newest'
         
-        # Paginate results
-        articles = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        articles, pagination = paginate(query, sort_options[sort_by], sort_by)
+        tag_response(*[news_article_tag(article.id) for article in articles])
         
         return jsonify({
-            'news_articles': [article.to_summary_dict() for article in articles.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': articles.total,
-                'pages': articles.pages,
-                'has_next': articles.has_next,
-                'has_prev': articles.has_prev
-            }
+            'news_articles': [
+                NEWS_SUMMARY.serialize(article, fields) if fields else article.to_summary_dict()
+                for article in articles
+            ],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Get news articles error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve news articles'}), 500
@@ -90,9 +96,8 @@ def get_news_article(article_id):
         if not article:
             return jsonify({'error': 'News article not found'}), 404
         
-        # Increment view count
-        article.views += 1
-        db.session.commit()
+        # Count the view; flushed to the database in the background
+        counters.incr(NewsArticle, article.id, 'views')
         
         return jsonify({
             'news_article': article.to_public_dict()
@@ -106,17 +111,29 @@ def get_news_article(article_id):
 def get_news_article_by_slug(slug):
     """Get a specific news article by slug"""
     try:
-        article = NewsArticle.query.filter_by(
-            slug=slug, 
-            status=NewsStatus.PUBLISHED
-        ).first()
+        slug_cache = cache_registry.get_cache('news-slugs', current_app.config.get('CACHE_MAX_ENTRIES', 1024))
+        cache_registry.poll()
+        article_id = slug_cache.get(slug)
+        if article_id is None:
+            article_id = db.session.query(NewsArticle.id).filter_by(
+                slug=slug,
+                status=NewsStatus.PUBLISHED
+            ).scalar()
+            if article_id is not None:
+                slug_cache.set(slug, article_id, tags=[news_article_tag(article_id)])
+        
+        article = None
+        if article_id is not None:
+            article = NewsArticle.query.filter_by(
+                id=article_id,
+                status=NewsStatus.PUBLISHED
+            ).first()
         
         if not article:
             return jsonify({'error': 'News article not found'}), 404
         
-        # Increment view count
-        article.views += 1
-        db.session.commit()
+        # Count the view; flushed to the database in the background
+        counters.incr(NewsArticle, article.id, 'views')
         
         return jsonify({
             'news_article': article.to_public_dict()
@@ -127,12 +144,14 @@ def get_news_article_by_slug(slug):
         return jsonify({'error': 'Failed to retrieve news article'}), 500
 
 @news_bp.route('/news/featured', methods=['GET'])
+@cached_response('news', tags=[NEWS_LIST_TAG])
 def get_featured_news():
     """Get featured news articles (latest 5)"""
     try:
         articles = NewsArticle.query.filter_by(
             status=NewsStatus.PUBLISHED
-        ).order_by(NewsArticle.published_at.desc()).limit(5).all()
+        ).options(*NEWS_SUMMARY.default_options()).order_by(NewsArticle.published_at.desc()).limit(5).all()
+        tag_response(*[news_article_tag(article.id) for article in articles])
         
         return jsonify({
             'featured_articles': [article.to_summary_dict() for article in articles]
@@ -157,54 +176,23 @@ def create_news_article():
         
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['title', 'content', 'category']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} is required'}), 400
-        
-        title = data['title'].strip()
-        content = data['content'].strip()
-        category = data['category'].strip()
-        
-        if len(title) < 5:
-            return jsonify({'error': 'Title must be at least 5 characters long'}), 400
-        
-        if len(content) < 50:
-            return jsonify({'error': 'Content must be at least 50 characters long'}), 400
-        
-        # Validate category
         try:
-            category_enum = NewsCategory(category)
-        except ValueError:
-            return jsonify({'error': 'Invalid category'}), 400
-        
-        # Generate slug
-        base_slug = generate_slug(title)
-        slug = base_slug
-        counter = 1
+            fields = validate_news_article(data)
+        except ValidationError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Ensure slug is unique
-        while NewsArticle.query.filter_by(slug=slug).first():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
+        title = fields['title']
+        category_enum = fields['category']
         
-        # Create article
+        # Create article with a unique slug
         article = NewsArticle(
-            title=title,
-            content=content,
-            excerpt=data.get('excerpt', '').strip(),
-            category=category_enum,
-            slug=slug,
-            meta_description=data.get('meta_description', '').strip(),
-            featured_image=data.get('featured_image', '').strip(),
-            featured_image_alt=data.get('featured_image_alt', '').strip(),
-            tags=data.get('tags', '').strip(),
             author_id=current_user_id,
-            status=NewsStatus.DRAFT
+            status=NewsStatus.DRAFT,
+            **fields
         )
-        
-        db.session.add(article)
+        assign_slug(article, title)
+        set_article_tags(article.id, article.tags, published=False)
+        adjust_stats(NEWS, NewsStatus.DRAFT, category_enum, 1)
         db.session.commit()
         
         return jsonify({
@@ -233,6 +221,7 @@ def update_news_article(article_id):
             return jsonify({'error': 'News article not found'}), 404
         
         data = request.get_json()
+        old_category = article.category
         
         # Update fields if provided
         if 'title' in data:
@@ -242,19 +231,7 @@ def update_news_article(article_id):
             
             # Update slug if title changed
             if new_title != article.title:
-                base_slug = generate_slug(new_title)
-                slug = base_slug
-                counter = 1
-                
-                # Ensure slug is unique (excluding current article)
-                while NewsArticle.query.filter(
-                    NewsArticle.slug == slug,
-                    NewsArticle.id != article_id
-                ).first():
-                    slug = f"{base_slug}-{counter}"
-                    counter += 1
-                
-                article.slug = slug
+                assign_slug(article, new_title)
             
             article.title = new_title
         
@@ -270,6 +247,7 @@ def update_news_article(article_id):
         if 'category' in data:
             try:
                 category_enum = NewsCategory(data['category'])
+                move_stats(NEWS, article.status, article.category, article.status, category_enum)
                 article.category = category_enum
             except ValueError:
                 return jsonify({'error': 'Invalid category'}), 400
@@ -285,8 +263,17 @@ def update_news_article(article_id):
         
         if 'tags' in data:
             article.tags = data['tags'].strip()
+            set_article_tags(article.id, article.tags, published=article.status == NewsStatus.PUBLISHED)
+        
+        # Title, text, category and tags decide which filtered lists show the article
+        if article.status == NewsStatus.PUBLISHED and {'title', 'content', 'excerpt', 'category', 'tags'} & data.keys():
+            invalidate_cache(news_article_tag(article.id), NEWS_LIST_TAG)
+        else:
+            invalidate_cache(news_article_tag(article.id))
         
         article.updated_at = datetime.utcnow()
+        if article.status == NewsStatus.PUBLISHED:
+            refresh_feeds(NEWS, {old_category, article.category})
         db.session.commit()
         
         return jsonify({
@@ -317,9 +304,14 @@ def publish_news_article(article_id):
         if article.status == NewsStatus.PUBLISHED:
             return jsonify({'error': 'Article is already published'}), 400
         
+        move_stats(NEWS, article.status, article.category, NewsStatus.PUBLISHED, article.category)
         article.status = NewsStatus.PUBLISHED
         article.published_at = datetime.utcnow()
         article.updated_at = datetime.utcnow()
+        clear_schedule(article.id, publish=True, unpublish=False)
+        count_published([article.id], 1)
+        invalidate_cache(news_article_tag(article.id), NEWS_LIST_TAG)
+        refresh_feeds(NEWS, [article.category])
         
         db.session.commit()
         
@@ -348,8 +340,15 @@ def unpublish_news_article(article_id):
         if not article:
             return jsonify({'error': 'News article not found'}), 404
         
+        if article.status == NewsStatus.PUBLISHED:
+            count_published([article.id], -1)
+        
+        move_stats(NEWS, article.status, article.category, NewsStatus.DRAFT, article.category)
         article.status = NewsStatus.DRAFT
         article.updated_at = datetime.utcnow()
+        clear_schedule(article.id)
+        invalidate_cache(news_article_tag(article.id), NEWS_LIST_TAG)
+        refresh_feeds(NEWS, [article.category])
         
         db.session.commit()
         
@@ -363,6 +362,108 @@ def unpublish_news_article(article_id):
         current_app.logger.error(f"Unpublish news article error: {str(e)}")
         return jsonify({'error': 'Failed to unpublish news article'}), 500
 
+@news_bp.route('/news/<int:article_id>/schedule', methods=['GET'])
+@jwt_required()
+def get_news_schedule(article_id):
+    """Get the publishing schedule of an article (admin/moderator only)"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        if not NewsArticle.query.get(article_id):
+            return jsonify({'error': 'News article not found'}), 404
+        
+        schedule = get_schedules([article_id]).get(article_id)
+        
+        return jsonify({
+            'schedule': schedule_to_dict(schedule) if schedule else None
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get news schedule error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve schedule'}), 500
+
+@news_bp.route('/news/<int:article_id>/schedule', methods=['PUT'])
+@jwt_required()
+def schedule_news_article(article_id):
+    """Schedule an article to be published and/or unpublished (admin/moderator only)"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        article = NewsArticle.query.get(article_id)
+        if not article:
+            return jsonify({'error': 'News article not found'}), 404
+        
+        data = request.get_json() or {}
+        publish_at = data.get('publish_at')
+        unpublish_at = data.get('unpublish_at')
+        
+        if not publish_at and not unpublish_at:
+            return jsonify({'error': 'publish_at or unpublish_at is required'}), 400
+        
+        try:
+            publish_at = parse_utc(publish_at) if publish_at else None
+            unpublish_at = parse_utc(unpublish_at) if unpublish_at else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid datetime format'}), 400
+        
+        now = datetime.utcnow()
+        if publish_at and article.status == NewsStatus.PUBLISHED:
+            return jsonify({'error': 'Article is already published'}), 400
+        
+        if (publish_at and publish_at <= now) or (unpublish_at and unpublish_at <= now):
+            return jsonify({'error': 'Scheduled times must be in the future'}), 400
+        
+        if publish_at and unpublish_at and unpublish_at <= publish_at:
+            return jsonify({'error': 'unpublish_at must be after publish_at'}), 400
+        
+        if unpublish_at and not publish_at and article.status != NewsStatus.PUBLISHED:
+            return jsonify({'error': 'Only published articles can be scheduled to unpublish alone'}), 400
+        
+        set_schedule(article.id, publish_at, unpublish_at, current_user_id)
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'News article scheduled successfully',
+            'schedule': schedule_to_dict(get_schedules([article.id])[article.id])
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Schedule news article error: {str(e)}")
+        return jsonify({'error': 'Failed to schedule news article'}), 500
+
+@news_bp.route('/news/<int:article_id>/schedule', methods=['DELETE'])
+@jwt_required()
+def cancel_news_schedule(article_id):
+    """Cancel an article's pending publish and unpublish times (admin/moderator only)"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        if not NewsArticle.query.get(article_id):
+            return jsonify({'error': 'News article not found'}), 404
+        
+        clear_schedule(article_id)
+        db.session.commit()
+        
+        return jsonify({'message': 'Schedule cancelled successfully'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Cancel news schedule error: {str(e)}")
+        return jsonify({'error': 'Failed to cancel schedule'}), 500
+
 @news_bp.route('/news/drafts', methods=['GET'])
 @jwt_required()
 def get_draft_articles():
@@ -374,28 +475,23 @@ def get_draft_articles():
         if not user or not user.has_role(UserRole.MODERATOR):
             return jsonify({'error': 'Moderator access required'}), 403
         
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        per_page = min(per_page, 100)
-        
-        articles = NewsArticle.query.filter_by(
-            status=NewsStatus.DRAFT
-        ).order_by(NewsArticle.updated_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+        query = NewsArticle.query.filter_by(status=NewsStatus.DRAFT)
+        articles, pagination = paginate(
+            query, [(NewsArticle.updated_at, True), (NewsArticle.id, True)], 'drafts'
         )
+        schedules = get_schedules([article.id for article in articles])
         
         return jsonify({
-            'news_articles': [article.to_dict() for article in articles.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': articles.total,
-                'pages': articles.pages,
-                'has_next': articles.has_next,
-                'has_prev': articles.has_prev
-            }
+            'news_articles': [
+                dict(article.to_dict(), schedule=schedule_to_dict(schedules[article.id])
+                     if article.id in schedules else None)
+                for article in articles
+            ],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         current_app.logger.error(f"Get draft articles error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve draft articles'}), 500
@@ -420,25 +516,47 @@ def get_news_categories():
         current_app.logger.error(f"Get news categories error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve categories'}), 500
 
+@news_bp.route('/news/tags', methods=['GET'])
+@cached_response('news', tags=[NEWS_LIST_TAG])
+def get_news_tags():
+    """Get tags of published articles with their article counts"""
+    try:
+        limit = max(min(request.args.get('limit', 50, type=int), 200), 1)
+        prefix = request.args.get('prefix', '').strip()
+        
+        return jsonify({
+            'tags': [
+                {'name': name, 'count': count}
+                for name, count in get_tag_facets(limit, prefix or None)
+            ]
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get news tags error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve tags'}), 500
+
 @news_bp.route('/news/stats', methods=['GET'])
 def get_news_stats():
     """Get news statistics"""
     try:
-        total_articles = NewsArticle.query.filter_by(status=NewsStatus.PUBLISHED).count()
-        draft_articles = NewsArticle.query.filter_by(status=NewsStatus.DRAFT).count()
-        total_views = db.session.query(db.func.sum(NewsArticle.views)).scalar() or 0
+        stats = get_stats(NEWS)
+        published = NewsStatus.PUBLISHED.value
+        
+        total_articles = sum(count for (status, _), (count, _, _) in stats.items() if status == published)
+        draft_articles = sum(
+            count for (status, _), (count, _, _) in stats.items()
+            if status == NewsStatus.DRAFT.value
+        )
+        total_views = sum(views for _, views, _ in stats.values())
         
         # Category breakdown
-        category_stats = []
-        for category in NewsCategory:
-            count = NewsArticle.query.filter_by(
-                category=category, 
-                status=NewsStatus.PUBLISHED
-            ).count()
-            category_stats.append({
+        category_stats = [
+            {
                 'category': category.value,
-                'count': count
-            })
+                'count': stats.get((published, category.value), (0, 0, 0))[0]
+            }
+            for category in NewsCategory
+        ]
         
         return jsonify({
             'total_articles': total_articles,
@@ -451,3 +569,21 @@ def get_news_stats():
         current_app.logger.error(f"Get news stats error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve news statistics'}), 500
 
+@news_bp.cli.command('rebuild-tags')
+def rebuild_tags_command():
+    """Rebuild the tag index and facet counts from the articles' tag strings"""
+    count = rebuild_tags()
+    invalidate_cache(NEWS_LIST_TAG)
+    db.session.commit()
+    click.echo(f"Indexed tags of {count} news articles")
+
+@news_bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help='Defaults to csv for .csv files, else ndjson.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--author', default='admin', show_default=True, help='Username for records without an author.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an earlier run of this file.')
+def import_news_command(path, fmt, chunk_size, author, restart):
+    """Bulk import news articles from NDJSON or CSV"""
+    imported, skipped = run_import(NEWS, path, fmt, chunk_size, author, restart)
+    click.echo(f"Imported {imported} news articles, skipped {skipped}")
@@ -0,0 +1,180 @@
+"""Pagination for list endpoints.
+
+Endpoints describe their ordering as sort keys, a list of
+(column, descending) pairs ending with a unique column such as the id.
+`paginate()` then serves either classic page/per_page pagination or, when
+a `cursor` argument is present, keyset pagination: the cursor encodes the
+sort key values of the last row, and the next page is read with a WHERE
+condition instead of OFFSET, so deep pages cost the same as the first.
+
+`include_total=false` skips the COUNT(*) query in both modes.
+"""
+import base64
+import json
+from datetime import datetime
+from flask import request
+from src.models.user import db
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor is malformed or belongs to another sort order"""
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(sort_name, values):
+    payload = json.dumps({'s': sort_name, 'v': [_encode_value(v) for v in values]})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_name, key_count):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(v) for v in payload['v']]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Malformed cursor')
+
+    if payload.get('s') != sort_name or len(values) != key_count:
+        raise InvalidCursor('Cursor does not match the requested sort order')
+    return values
+
+
+def _python_type(expr):
+    try:
+        return expr.type.python_type
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+def _value_fits(value, python_type):
+    """Whether a decoded cursor value can be compared with a key of python_type"""
+    if value is None:
+        return True
+    if isinstance(value, bool):
+        return python_type is bool
+    if python_type is float:
+        return isinstance(value, (int, float))
+    if python_type is None:
+        return isinstance(value, (str, int, float, datetime))
+    return isinstance(value, python_type)
+
+
+def _check_values(sort_keys, values):
+    """Raise InvalidCursor unless each value has its sort key's type"""
+    for (expr, _), value in zip(sort_keys, values):
+        if not _value_fits(value, _python_type(expr)):
+            raise InvalidCursor('Cursor values do not match the sort keys')
+
+
+def _nullable(expr):
+    column = getattr(expr, 'expression', expr)
+    return getattr(column, 'nullable', True)
+
+
+def _ordering(sort_keys, nulls_last=False):
+    clauses = []
+    for expr, descending in sort_keys:
+        clause = expr.desc() if descending else expr.asc()
+        if nulls_last and _nullable(expr):
+            clause = clause.nulls_last()
+        clauses.append(clause)
+    return clauses
+
+
+def _after(sort_keys, values):
+    """WHERE condition selecting rows that sort after the given key values.
+
+    Keyset ordering puts NULLs last in both directions.
+    """
+    (expr, descending), value = sort_keys[0], values[0]
+
+    if value is None:
+        beyond = db.false()
+        equal = expr.is_(None)
+    else:
+        beyond = expr < value if descending else expr > value
+        if _nullable(expr):
+            beyond = db.or_(beyond, expr.is_(None))
+        equal = expr == value
+
+    if len(sort_keys) == 1:
+        return beyond
+    return db.or_(beyond, db.and_(equal, _after(sort_keys[1:], values[1:])))
+
+
+def paginate(query, sort_keys, sort_name='default', default_per_page=20, max_per_page=100):
+    """Order and paginate a query from the request arguments.
+
+    Returns (items, pagination) where pagination is the dict the endpoint
+    puts in its response. Raises InvalidCursor for a bad cursor.
+    """
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    per_page = max(min(per_page, max_per_page), 1)
+    include_total = request.args.get('include_total', 'true').lower() != 'false'
+
+    if 'cursor' in request.args:
+        return _paginate_keyset(query, sort_keys, sort_name, per_page, include_total)
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    ordered = query.order_by(None).order_by(*_ordering(sort_keys))
+
+    if include_total:
+        result = ordered.paginate(page=page, per_page=per_page, error_out=False)
+        return result.items, {
+            'page': page,
+            'per_page': per_page,
+            'total': result.total,
+            'pages': result.pages,
+            'has_next': result.has_next,
+            'has_prev': result.has_prev
+        }
+
+    items = ordered.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return items[:per_page], {
+        'page': page,
+        'per_page': per_page,
+        'total': None,
+        'pages': None,
+        'has_next': len(items) > per_page,
+        'has_prev': page > 1
+    }
+
+
+def _paginate_keyset(query, sort_keys, sort_name, per_page, include_total):
+    cursor = request.args.get('cursor', '')
+    keyed = query.order_by(None)
+
+    if cursor:
+        values = decode_cursor(cursor, sort_name, len(sort_keys))
+        _check_values(sort_keys, values)
+        keyed = keyed.filter(_after(sort_keys, values))
+
+    # Select the key values alongside each row to build the next cursor
+    rows = keyed.add_columns(*[expr for expr, _ in sort_keys]).order_by(
+        *_ordering(sort_keys, nulls_last=True)
+    ).limit(per_page + 1).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    pagination = {
+        'per_page': per_page,
+        'cursor': cursor or None,
+        'next_cursor': encode_cursor(sort_name, list(rows[-1][1:])) if has_next else None,
+        'has_next': has_next
+    }
+    if include_total:
+        pagination['total'] = query.order_by(None).count()
+
+    return [row[0] for row in rows], pagination
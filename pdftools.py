@@ -0,0 +1,105 @@
+"""PDF inspection run inside the processing worker processes.
+
+Nothing here touches Flask or the database, so the functions can be pickled
+to a ProcessPoolExecutor. Text extraction and thumbnails use PyMuPDF when it
+is installed, text extraction falls back to pypdf, and without either only
+the signature check and an approximate page count are available.
+"""
+import os
+import re
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+PDF_MAGIC = b'%PDF-'
+THUMBNAIL_WIDTH = 300
+
+# Page objects, without matching the /Pages tree nodes
+_PAGE_RE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+
+class NotAPdf(ValueError):
+    """Raised when a file does not carry a PDF signature"""
+
+
+def is_pdf(path):
+    """Check the PDF signature; readers accept it within the first 1 KiB"""
+    with open(path, 'rb') as f:
+        return PDF_MAGIC in f.read(1024)
+
+
+def _count_pages_raw(path):
+    with open(path, 'rb') as f:
+        return len(_PAGE_RE.findall(f.read())) or None
+
+
+def _extract_fitz(path, thumbnail_path, max_chars):
+    with fitz.open(path) as doc:
+        text = []
+        length = 0
+        for page in doc:
+            if length >= max_chars:
+                break
+            chunk = page.get_text()
+            text.append(chunk)
+            length += len(chunk)
+
+        if thumbnail_path and doc.page_count:
+            page = doc[0]
+            zoom = THUMBNAIL_WIDTH / max(page.rect.width, 1)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            pixmap.save(thumbnail_path)
+        else:
+            thumbnail_path = None
+
+        return doc.page_count, ''.join(text)[:max_chars], thumbnail_path
+
+
+def _extract_pypdf(path, max_chars):
+    reader = pypdf.PdfReader(path)
+    text = []
+    length = 0
+    for page in reader.pages:
+        if length >= max_chars:
+            break
+        chunk = page.extract_text() or ''
+        text.append(chunk)
+        length += len(chunk)
+    return len(reader.pages), ''.join(text)[:max_chars]
+
+
+def process_pdf(path, thumbnail_path=None, max_chars=200000):
+    """Validate a PDF and extract its page count, text and first-page thumbnail.
+
+    Returns a dict with page_count, text and thumbnail_path; values the
+    installed libraries cannot produce are None. Raises NotAPdf for files
+    that are not PDFs.
+    """
+    if not is_pdf(path):
+        raise NotAPdf('File does not have a PDF signature')
+
+    if fitz is not None:
+        page_count, text, thumbnail_path = _extract_fitz(path, thumbnail_path, max_chars)
+    elif pypdf is not None:
+        page_count, text = _extract_pypdf(path, max_chars)
+        thumbnail_path = None
+    else:
+        page_count, text, thumbnail_path = _count_pages_raw(path), None, None
+
+    # NUL bytes from broken text layers are rejected by some databases
+    if text is not None:
+        text = text.replace('\x00', '').strip() or None
+
+    return {
+        'page_count': page_count,
+        'text': text,
+        'thumbnail_path': thumbnail_path,
+    }
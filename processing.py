@@ -0,0 +1,300 @@
+"""Background processing of uploaded research papers.
+
+Submitting a paper only adds a `queued` row to `research_paper_processing`.
+A periodic job claims queued rows and hands the PDFs to a
+ProcessPoolExecutor, which checks the PDF signature, extracts the page count
+and text and renders a first-page thumbnail (see `src.pdftools`). Results
+are written back from the future's done-callback, and the text is added to
+the search index.
+
+At most PDF_QUEUE_DEPTH papers are in flight per process; the rest wait in
+the table, so a burst of uploads never slows the upload requests down.
+Rows are claimed with a conditional UPDATE, so several app processes can
+share the queue, and rows stuck in `processing` after a crash are requeued
+once PDF_PROCESSING_TIMEOUT has passed.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from functools import partial
+from src.models.user import db
+from src.models.research import ResearchPaper
+from src.jobs import start_job
+from src.search import index_paper_body
+from src.storage import get_paper_file_hash, research_paper_files
+from src.pdftools import NotAPdf, process_pdf
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+INVALID = 'invalid'
+
+MAX_ATTEMPTS = 3
+
+
+class PaperProcessing(db.Model):
+    __tablename__ = 'research_paper_processing'
+
+    paper_id = db.Column(db.Integer, db.ForeignKey('research_papers.id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    page_count = db.Column(db.Integer)
+    text = db.deferred(db.Column(db.Text))
+    thumbnail_path = db.Column(db.String(500))
+    error = db.Column(db.String(500))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'page_count': self.page_count,
+            'has_thumbnail': bool(self.thumbnail_path),
+            'error': self.error,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+def queue_paper(paper_id):
+    """Queue a paper for processing; the caller commits"""
+    now = datetime.utcnow()
+    existing = db.session.get(PaperProcessing, paper_id)
+    if existing is None:
+        db.session.add(PaperProcessing(paper_id=paper_id, status=QUEUED, queued_at=now, updated_at=now))
+    else:
+        existing.status, existing.error, existing.attempts = QUEUED, None, 0
+        existing.queued_at = existing.updated_at = now
+
+
+def get_processing(paper_ids):
+    """Return {paper_id: PaperProcessing} for the given papers in one query"""
+    if not paper_ids:
+        return {}
+    rows = PaperProcessing.query.filter(PaperProcessing.paper_id.in_(paper_ids)).all()
+    return {row.paper_id: row for row in rows}
+
+
+def _store_result(paper_id, status, result=None, error=None):
+    values = {'status': status, 'error': error, 'updated_at': datetime.utcnow()}
+    if result is not None:
+        values.update(result)
+
+    db.session.execute(
+        db.update(PaperProcessing).where(PaperProcessing.paper_id == paper_id).values(**values)
+    )
+    if result is not None and result.get('text'):
+        index_paper_body(paper_id, result['text'])
+    db.session.commit()
+
+
+class PdfPipeline:
+    """Feeds queued papers to a process pool and records the results"""
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._workers = 0
+        self._queue_depth = 0
+        self._timeout = 600
+        self._max_chars = 200000
+        self._thumbnail_dir = None
+        self._job = None
+
+    def init_app(self, app):
+        self._app = app
+        self._workers = app.config.get('PDF_WORKERS', 2)
+        self._queue_depth = app.config.get('PDF_QUEUE_DEPTH', 20)
+        self._timeout = app.config.get('PDF_PROCESSING_TIMEOUT', 600)
+        self._max_chars = app.config.get('PDF_TEXT_MAX_CHARS', 200000)
+        self._thumbnail_dir = app.config.get('PDF_THUMBNAIL_DIR') or \
+            os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails')
+
+        self._job = start_job(
+            app, 'pdf-processing', app.config.get('PDF_SWEEP_INTERVAL', 30), self.sweep
+        )
+        atexit.register(self.shutdown)
+
+    def wake(self):
+        """Ask the pipeline to look for queued papers now"""
+        if self._job is not None:
+            self._job.wake()
+
+    def sweep(self):
+        """Requeue stale rows and submit queued papers up to the free capacity"""
+        if not self._workers:
+            return 0
+
+        self._requeue_stale()
+        with self._lock:
+            free = self._queue_depth - self._in_flight
+        if free <= 0:
+            return 0
+
+        candidates = db.session.query(PaperProcessing.paper_id).filter_by(
+            status=QUEUED
+        ).order_by(PaperProcessing.queued_at, PaperProcessing.paper_id).limit(free).all()
+
+        submitted = 0
+        for (paper_id,) in candidates:
+            args = self._claim(paper_id)
+            if args is not None:
+                self._submit(paper_id, args)
+                submitted += 1
+        return submitted
+
+    def process_now(self, paper_id):
+        """Process one queued paper in the current process (CLI and backfills)"""
+        args = self._claim(paper_id)
+        if args is not None:
+            self._record(paper_id, partial(process_pdf, *args))
+        row = db.session.get(PaperProcessing, paper_id)
+        return row.status if row else None
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # Cancelled papers stay in `processing` and are requeued later
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _claim(self, paper_id):
+        """Move a row from queued to processing; returns the worker arguments"""
+        result = db.session.execute(
+            db.update(PaperProcessing).where(
+                PaperProcessing.paper_id == paper_id,
+                PaperProcessing.status == QUEUED
+            ).values(
+                status=PROCESSING,
+                attempts=PaperProcessing.attempts + 1,
+                updated_at=datetime.utcnow()
+            )
+        )
+        db.session.commit()
+        if result.rowcount != 1:
+            return None  # claimed by another process
+
+        paper = db.session.get(ResearchPaper, paper_id)
+        if paper is None or not paper.file_path or not os.path.exists(paper.file_path):
+            _store_result(paper_id, FAILED, error='Paper file is missing')
+            return None
+
+        sha256 = get_paper_file_hash(paper_id)
+        if sha256 and self._reuse_result(paper_id, sha256):
+            return None
+
+        name = f'{sha256}.png' if sha256 else f'paper-{paper_id}.png'
+        thumbnail_path = os.path.join(self._thumbnail_dir, name[:2], name)
+        return paper.file_path, thumbnail_path, self._max_chars
+
+    def _reuse_result(self, paper_id, sha256):
+        """Copy the result of an already processed paper with the same file"""
+        done = PaperProcessing.query.join(
+            research_paper_files, research_paper_files.c.paper_id == PaperProcessing.paper_id
+        ).filter(
+            research_paper_files.c.sha256 == sha256,
+            PaperProcessing.paper_id != paper_id,
+            PaperProcessing.status.in_([DONE, INVALID])
+        ).first()
+        if done is None:
+            return False
+
+        _store_result(paper_id, done.status, {
+            'page_count': done.page_count,
+            'text': done.text,
+            'thumbnail_path': done.thumbnail_path,
+        }, error=done.error)
+        return True
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Forking a multithreaded server process is unsafe, so spawn
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _submit(self, paper_id, args):
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._get_executor().submit(process_pdf, *args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            self._requeue(paper_id)
+            raise
+        future.add_done_callback(partial(self._finished, paper_id))
+
+    def _finished(self, paper_id, future):
+        with self._lock:
+            self._in_flight -= 1
+
+        if future.cancelled():
+            return
+
+        with self._app.app_context():
+            try:
+                self._record(paper_id, future.result)
+            except Exception as e:
+                logger.error(f"Storing PDF processing result for paper {paper_id} failed: {str(e)}")
+                db.session.rollback()
+
+        self.wake()  # refill the pool from the queue
+
+    def _record(self, paper_id, get_result):
+        try:
+            result = get_result()
+        except NotAPdf as e:
+            _store_result(paper_id, INVALID, error=str(e))
+        except BrokenProcessPool:
+            # A worker died (e.g. a crash inside the PDF library); start a
+            # fresh pool and let the row be retried
+            with self._lock:
+                self._executor = None
+            self._requeue(paper_id)
+        except Exception as e:
+            logger.warning(f"Processing paper {paper_id} failed: {str(e)}")
+            _store_result(paper_id, FAILED, error=str(e)[:500])
+        else:
+            _store_result(paper_id, DONE, result)
+
+    def _requeue(self, paper_id):
+        db.session.execute(
+            db.update(PaperProcessing).where(
+                PaperProcessing.paper_id == paper_id,
+                PaperProcessing.attempts < MAX_ATTEMPTS
+            ).values(status=QUEUED, updated_at=datetime.utcnow())
+        )
+        db.session.execute(
+            db.update(PaperProcessing).where(
+                PaperProcessing.paper_id == paper_id,
+                PaperProcessing.attempts >= MAX_ATTEMPTS
+            ).values(status=FAILED, error='Processing failed repeatedly', updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def _requeue_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self._timeout)
+        stale = db.session.query(PaperProcessing.paper_id).filter(
+            PaperProcessing.status == PROCESSING,
+            PaperProcessing.updated_at < cutoff
+        ).all()
+        for (paper_id,) in stale:
+            self._requeue(paper_id)
+        if stale:
+            logger.warning(f"Requeued {len(stale)} papers stuck in PDF processing")
+
+
+pdf_pipeline = PdfPipeline()
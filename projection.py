@@ -0,0 +1,110 @@
+"""Column projection for list endpoints.
+
+List endpoints only emit summaries, so they should not hydrate the large
+text columns of every row. A `Projection` names the fields a client may ask
+for with `fields=` and the columns each one needs. The query then loads
+only those columns (plus the id and the author relationship when asked
+for), and rows are serialized from the same field list.
+
+Without `fields=`, the endpoint uses the projection's `default_options()`.
+These defer the columns its serializer never emits and batch-load the
+author instead of lazy-loading it once per row.
+"""
+from datetime import datetime
+from flask import request
+from sqlalchemy.orm import defer, load_only, selectinload
+from src.models.user import User
+from src.models.news import NewsArticle
+from src.models.research import ResearchPaper
+
+AUTHOR = object()
+
+
+class InvalidFields(ValueError):
+    """Raised when `fields=` names a field the endpoint does not offer"""
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return getattr(value, 'value', value)
+
+
+class Projection:
+    """The fields an endpoint offers and how to load and emit them.
+
+    `fields` maps each public field name to a column name, or to AUTHOR for
+    the author's username.
+    """
+
+    def __init__(self, model, fields, deferred=()):
+        self.model = model
+        self.fields = fields
+        self.deferred = deferred
+
+    def parse(self, param='fields'):
+        """Return the requested field names, or None when not given"""
+        raw = request.args.get(param, '').strip()
+        if not raw:
+            return None
+
+        names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidFields(
+                f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(self.fields))}"
+            )
+        return names
+
+    def default_options(self):
+        options = [defer(getattr(self.model, column)) for column in self.deferred]
+        return options + [selectinload(self.model.author).load_only(User.username)]
+
+    def options(self, names):
+        """Loader options that fetch exactly the columns behind `names`"""
+        columns = {'id'}
+        with_author = False
+        for name in names:
+            if self.fields[name] is AUTHOR:
+                with_author = True
+                columns.add('author_id')
+            else:
+                columns.add(self.fields[name])
+
+        options = [load_only(*[getattr(self.model, column) for column in sorted(columns)])]
+        if with_author:
+            options.append(selectinload(self.model.author).load_only(User.username))
+        return options
+
+    def serialize(self, item, names):
+        result = {}
+        for name in names:
+            column = self.fields[name]
+            if column is AUTHOR:
+                result[name] = item.author.username if item.author else None
+            else:
+                result[name] = _plain(getattr(item, column))
+        return result
+
+
+def _columns(*names):
+    return {name: name for name in names}
+
+
+NEWS_SUMMARY = Projection(
+    NewsArticle,
+    dict(_columns(
+        'id', 'title', 'slug', 'excerpt', 'category', 'tags', 'views', 'meta_description',
+        'featured_image', 'featured_image_alt', 'created_at', 'updated_at', 'published_at'
+    ), author=AUTHOR),
+    deferred=('content',)
+)
+
+RESEARCH_LIST = Projection(
+    ResearchPaper,
+    dict(_columns(
+        'id', 'title', 'abstract', 'keywords', 'category', 'views', 'downloads', 'likes',
+        'created_at', 'published_at'
+    ), author=AUTHOR),
+    deferred=('reviewer_comments', 'file_path')
+)
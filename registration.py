@@ -0,0 +1,192 @@
+"""Event registration with atomic capacity checks and a FIFO waitlist.
+
+Registering inserts the attendee row first and relies on the unique key on
+(user_id, event_id) to reject duplicates. It then claims a seat with one
+conditional UPDATE:
+
+    UPDATE community_events SET attendee_count = attendee_count + 1
+    WHERE id = :id AND (max_attendees IS NULL OR attendee_count < max_attendees)
+
+No row is read and checked in Python first, so concurrent requests can
+neither overbook the event nor register the same user twice. The event row
+is locked only from that UPDATE until the commit.
+
+When no seat is left, the attendee row is removed again and the user joins
+`event_waitlist`. A cancellation hands its seat straight to the oldest
+waitlist entry, so the seat never becomes free for a newcomer to take.
+
+The functions take a Connection, and the caller commits. Routes pass
+`db.session.connection()`.
+"""
+import logging
+from datetime import datetime
+from src.models.user import db
+from src.models.community import CommunityEvent, event_attendees
+from src.dbutil import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+event_waitlist = db.Table(
+    'event_waitlist',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('event_id', db.Integer, db.ForeignKey('community_events.id'), nullable=False),
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), nullable=False),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow),
+    db.UniqueConstraint('event_id', 'user_id', name='uq_event_waitlist_event_user'),
+    db.Index('ix_event_waitlist_event_order', 'event_id', 'id'),
+)
+
+attendee_index = db.Index(
+    'uq_event_attendees_user_event', event_attendees.c.user_id, event_attendees.c.event_id, unique=True
+)
+
+# register() outcomes
+REGISTERED = 'registered'
+WAITLISTED = 'waitlisted'
+ALREADY_REGISTERED = 'already_registered'
+ALREADY_WAITLISTED = 'already_waitlisted'
+
+# cancel() outcomes
+CANCELLED = 'cancelled'
+LEFT_WAITLIST = 'left_waitlist'
+NOT_REGISTERED = 'not_registered'
+
+
+def _claim_seat(conn, event_id):
+    """Take a seat if one is free; returns the new attendee count or None"""
+    events = CommunityEvent.__table__
+    return conn.execute(
+        events.update()
+        .where(
+            events.c.id == event_id,
+            db.or_(events.c.max_attendees.is_(None), events.c.attendee_count < events.c.max_attendees)
+        )
+        .values(attendee_count=events.c.attendee_count + 1)
+        .returning(events.c.attendee_count)
+    ).scalar()
+
+
+def _remove_attendee(conn, event_id, user_id):
+    return conn.execute(event_attendees.delete().where(
+        event_attendees.c.event_id == event_id, event_attendees.c.user_id == user_id
+    )).rowcount
+
+
+def waitlist_position(conn, event_id, user_id):
+    """1-based position on the event's waitlist, or None when not on it"""
+    entry = db.select(event_waitlist.c.id).where(
+        event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id
+    ).scalar_subquery()
+    position = conn.execute(
+        db.select(db.func.count()).select_from(event_waitlist).where(
+            event_waitlist.c.event_id == event_id, event_waitlist.c.id <= entry
+        )
+    ).scalar()
+    return position or None
+
+
+def register(conn, event_id, user_id):
+    """Register a user; returns (outcome, attendee count or waitlist position)"""
+    added = conn.execute(insert_ignore(event_attendees, bind=conn).values(
+        user_id=user_id, event_id=event_id
+    )).rowcount
+    if not added:
+        return ALREADY_REGISTERED, None
+
+    attendee_count = _claim_seat(conn, event_id)
+    if attendee_count is not None:
+        conn.execute(event_waitlist.delete().where(
+            event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id
+        ))
+        return REGISTERED, attendee_count
+
+    # Full: give the attendee row back and queue up instead
+    _remove_attendee(conn, event_id, user_id)
+    queued = conn.execute(insert_ignore(event_waitlist, bind=conn).values(
+        event_id=event_id, user_id=user_id, created_at=datetime.utcnow()
+    )).rowcount
+    position = waitlist_position(conn, event_id, user_id)
+    return (WAITLISTED if queued else ALREADY_WAITLISTED), position
+
+
+def _promote(conn, event_id):
+    """Move the oldest waitlist entry into the event; returns its user id or None"""
+    while True:
+        head = conn.execute(
+            db.select(event_waitlist.c.id, event_waitlist.c.user_id)
+            .where(event_waitlist.c.event_id == event_id)
+            .order_by(event_waitlist.c.id).limit(1)
+        ).first()
+        if head is None:
+            return None
+
+        # A concurrent cancellation may have promoted the same entry
+        if not conn.execute(event_waitlist.delete().where(event_waitlist.c.id == head.id)).rowcount:
+            continue
+        added = conn.execute(insert_ignore(event_attendees, bind=conn).values(
+            user_id=head.user_id, event_id=event_id
+        )).rowcount
+        if added:
+            return head.user_id
+
+
+def cancel(conn, event_id, user_id):
+    """Cancel a registration or leave the waitlist; returns (outcome, promoted user id)"""
+    if _remove_attendee(conn, event_id, user_id):
+        promoted = _promote(conn, event_id)
+        if promoted is None:
+            events = CommunityEvent.__table__
+            conn.execute(
+                events.update().where(events.c.id == event_id)
+                .values(attendee_count=events.c.attendee_count - 1)
+            )
+        return CANCELLED, promoted
+
+    left = conn.execute(event_waitlist.delete().where(
+        event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id
+    )).rowcount
+    return (LEFT_WAITLIST if left else NOT_REGISTERED), None
+
+
+def _remove_duplicate_attendees():
+    """Keep one row per (user_id, event_id) and recount the affected events"""
+    duplicates = db.session.execute(
+        db.select(event_attendees.c.user_id, event_attendees.c.event_id)
+        .group_by(event_attendees.c.user_id, event_attendees.c.event_id)
+        .having(db.func.count() > 1)
+    ).all()
+    if not duplicates:
+        return
+
+    for user_id, event_id in duplicates:
+        where = (event_attendees.c.user_id == user_id, event_attendees.c.event_id == event_id)
+        # Rows of a pair may be identical, so delete them all and put the first back
+        keep = db.session.execute(db.select(event_attendees).where(*where).limit(1)).mappings().first()
+        db.session.execute(event_attendees.delete().where(*where))
+        db.session.execute(event_attendees.insert().values(**keep))
+
+    events = CommunityEvent.__table__
+    event_ids = sorted({event_id for _, event_id in duplicates})
+    db.session.execute(events.update().where(events.c.id.in_(event_ids)).values(
+        attendee_count=db.select(db.func.count()).select_from(event_attendees)
+        .where(event_attendees.c.event_id == events.c.id).scalar_subquery()
+    ))
+    logger.warning(
+        f"Removed duplicate registrations of {len(duplicates)} attendees from {len(event_ids)} events"
+    )
+
+
+def ensure_attendee_index():
+    """Create the unique (user_id, event_id) index, first removing duplicate registrations.
+
+    register() relies on this index to reject duplicates, so failing to
+    create it is raised rather than logged.
+    """
+    try:
+        _remove_duplicate_attendees()
+        db.session.commit()
+        attendee_index.create(db.engine, checkfirst=True)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Could not create the unique event attendee index: {str(e)}")
+        raise
@@ -0,0 +1,398 @@
+"""Related-paper recommendations from TF-IDF similarity.
+
+Approved papers are turned into L2-normalized TF-IDF vectors over their
+title, keywords and abstract. The top-k most similar papers for every paper
+are precomputed into `research_related`, so `/research/<id>/related` is a
+single indexed lookup.
+
+`rebuild_related()` fits the vocabulary and recomputes every neighbour list.
+The fitted model (vocabulary, IDF weights and the vector matrix) is saved to
+RELATED_MODEL_PATH. When papers are approved afterwards,
+`add_related_papers()` vectorizes them against the saved vocabulary, stores
+their vectors in `research_related_vectors` and merges them into the
+neighbour lists of the papers they are close to, without touching the rest.
+Only the newest RELATED_RECENT_LIMIT stored vectors are compared against.
+
+Words first seen after the last rebuild are ignored until the next one. A
+background job therefore rebuilds every RELATED_REBUILD_INTERVAL, and right
+after startup when no model has been saved yet;
+`flask research rebuild-related` does the same on demand.
+"""
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+import numpy as np
+from scipy import sparse
+from flask import current_app
+from src.models.user import db
+from src.models.research import ResearchPaper, ResearchStatus
+from src.jobs import start_job
+
+logger = logging.getLogger(__name__)
+
+# Title and keywords count more than the abstract
+FIELD_WEIGHTS = (('title', 3), ('keywords', 2), ('abstract', 1))
+
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has have in is it its of on or that the '
+    'this to was we were which with our their these using via into than also'.split()
+)
+
+# Common-word pruning only starts once a word is in this many papers
+MIN_MAX_DF_COUNT = 50
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+research_related = db.Table(
+    'research_related',
+    db.Column('paper_id', db.Integer, db.ForeignKey('research_papers.id'), primary_key=True),
+    db.Column('rank', db.Integer, primary_key=True),
+    db.Column('related_id', db.Integer, db.ForeignKey('research_papers.id'), nullable=False),
+    db.Column('score', db.Float, nullable=False),
+)
+
+# Vectors of papers approved since the model file was last rebuilt
+research_related_vectors = db.Table(
+    'research_related_vectors',
+    db.Column('paper_id', db.Integer, db.ForeignKey('research_papers.id'), primary_key=True),
+    db.Column('term_indices', db.LargeBinary, nullable=False),
+    db.Column('weights', db.LargeBinary, nullable=False),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow, index=True),
+)
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall((text or '').lower()) if len(t) > 1 and t not in STOP_WORDS]
+
+
+def paper_tokens(title, abstract, keywords):
+    """Bag of words for a paper, with fields repeated by FIELD_WEIGHTS"""
+    fields = {'title': title, 'abstract': abstract, 'keywords': keywords}
+    tokens = []
+    for name, weight in FIELD_WEIGHTS:
+        tokens.extend(tokenize(fields[name]) * weight)
+    return tokens
+
+
+class TfidfModel:
+    """Vocabulary, IDF weights and normalized vectors of a set of papers"""
+
+    def __init__(self, vocabulary, idf, matrix, paper_ids):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.paper_ids = paper_ids
+
+    @classmethod
+    def fit(cls, documents, min_df=2, max_df=0.2, max_features=100000):
+        """Build a model from (paper_id, tokens) pairs"""
+        paper_ids, counts = [], []
+        df = Counter()
+        for paper_id, tokens in documents:
+            tf = Counter(tokens)
+            paper_ids.append(paper_id)
+            counts.append(tf)
+            df.update(tf.keys())
+
+        n = len(paper_ids)
+        # Words in over max_df of the papers carry little signal and make
+        # the similarity product dense; small collections keep everything
+        max_count = max(int(max_df * n), MIN_MAX_DF_COUNT)
+        terms = [t for t, c in df.most_common() if min_df <= c <= max_count][:max_features]
+        vocabulary = {term: i for i, term in enumerate(sorted(terms))}
+        idf = np.array([math.log((1 + n) / (1 + df[t])) + 1 for t in sorted(terms)], dtype=np.float32)
+
+        model = cls(vocabulary, idf, None, np.array(paper_ids, dtype=np.int64))
+        model.matrix = model._vectorize_counts(counts)
+        return model
+
+    def transform(self, token_lists):
+        return self._vectorize_counts(Counter(tokens) for tokens in token_lists)
+
+    def _vectorize_counts(self, counts):
+        indptr, indices, data = [0], [], []
+        for tf in counts:
+            row = sorted((self.vocabulary[t], c) for t, c in tf.items() if t in self.vocabulary)
+            for index, count in row:
+                indices.append(index)
+                # Sublinear term frequency
+                data.append((1 + math.log(count)) * self.idf[index])
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(indptr) - 1, len(self.vocabulary))
+        )
+        norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms).astype(np.float32) @ matrix
+
+    def save(self, path):
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        os.close(fd)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(
+            tmp_path, terms=np.array(terms), idf=self.idf, paper_ids=self.paper_ids,
+            data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            terms = f['terms'].tolist()
+            matrix = sparse.csr_matrix(
+                (f['data'], f['indices'], f['indptr']), shape=(len(f['paper_ids']), len(terms))
+            )
+            return cls({t: i for i, t in enumerate(terms)}, f['idf'], matrix, f['paper_ids'])
+
+
+def _top_k(scores, k):
+    """Indices of the k best scores, best first"""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+def all_neighbours(matrix, k, chunk_size=1000):
+    """Yield (row, [(column, score), ...]) with the k most similar rows of each row"""
+    transposed = matrix.T.tocsr()
+    for start in range(0, matrix.shape[0], chunk_size):
+        product = (matrix[start:start + chunk_size] @ transposed).tocsr()
+        for offset in range(product.shape[0]):
+            row = start + offset
+            lo, hi = product.indptr[offset], product.indptr[offset + 1]
+            columns, scores = product.indices[lo:hi], product.data[lo:hi]
+            keep = columns != row
+            columns, scores = columns[keep], scores[keep]
+            best = _top_k(scores, k)
+            yield row, [(int(columns[i]), float(scores[i])) for i in best]
+
+
+def vector_neighbours(matrix, vector, k):
+    """Return [(row, score), ...] for the k rows most similar to one vector"""
+    scores = (matrix @ vector.T).toarray().ravel()
+    rows = np.flatnonzero(scores > 0)
+    best = _top_k(scores[rows], k)
+    return [(int(rows[i]), float(scores[rows[i]])) for i in best]
+
+
+_model_cache = {'path': None, 'mtime': None, 'model': None}
+_model_lock = threading.Lock()
+
+
+def _model_path():
+    return current_app.config['RELATED_MODEL_PATH']
+
+
+def load_model():
+    """Return the saved model, cached until the file changes, or None"""
+    path = _model_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _model_lock:
+        if _model_cache['path'] != path or _model_cache['mtime'] != mtime:
+            _model_cache.update(path=path, mtime=mtime, model=TfidfModel.load(path))
+        return _model_cache['model']
+
+
+def _top_k_setting():
+    return current_app.config.get('RELATED_TOP_K', 20)
+
+
+def rebuild_related():
+    """Refit the model and recompute all neighbour lists; the caller commits"""
+    k = _top_k_setting()
+    papers = db.session.query(
+        ResearchPaper.id, ResearchPaper.title, ResearchPaper.abstract, ResearchPaper.keywords
+    ).filter(ResearchPaper.status == ResearchStatus.APPROVED).order_by(ResearchPaper.id).all()
+
+    model = TfidfModel.fit(
+        (paper_id, paper_tokens(title, abstract, keywords))
+        for paper_id, title, abstract, keywords in papers
+    )
+
+    db.session.execute(research_related.delete())
+    db.session.execute(research_related_vectors.delete())
+
+    rows = []
+    for row, neighbours in all_neighbours(model.matrix, k):
+        paper_id = int(model.paper_ids[row])
+        rows.extend(
+            {'paper_id': paper_id, 'rank': rank, 'related_id': int(model.paper_ids[column]), 'score': score}
+            for rank, (column, score) in enumerate(neighbours)
+        )
+        if len(rows) >= 10000:
+            db.session.execute(research_related.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(research_related.insert(), rows)
+
+    model.save(_model_path())
+    return len(papers)
+
+
+def _recent_vectors(model):
+    """Stack the newest vectors stored since the last rebuild under the model's vocabulary"""
+    rows = db.session.execute(
+        db.select(research_related_vectors)
+        .order_by(research_related_vectors.c.created_at.desc())
+        .limit(current_app.config.get('RELATED_RECENT_LIMIT', 2000))
+    ).all()
+    if not rows:
+        return None, []
+
+    indptr, indices, data = [0], [], []
+    for row in rows:
+        indices.append(np.frombuffer(row.term_indices, dtype=np.int32))
+        data.append(np.frombuffer(row.weights, dtype=np.float32))
+        indptr.append(indptr[-1] + len(indices[-1]))
+    matrix = sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices), np.array(indptr)),
+        shape=(len(rows), len(model.vocabulary))
+    )
+    return matrix, [row.paper_id for row in rows]
+
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def add_related_papers(papers):
+    """Compute neighbours for newly approved papers; the caller commits.
+
+    Each paper gets its own top-k list, and it is merged into the lists of
+    the papers it would now rank in. A whole batch shares one read of the
+    stored vectors and one write of the changed lists.
+
+    Without a saved model nothing is done, so that a review request never
+    fits one; the rebuild job then includes these papers.
+    """
+    if not papers:
+        return
+    model = load_model()
+    if model is None:
+        logger.warning(
+            f"No related-papers model at {_model_path()} yet; the rebuild job will include "
+            f"{len(papers)} newly approved papers"
+        )
+        return
+
+    k = _top_k_setting()
+    new_ids = [paper.id for paper in papers]
+    vectors = model.transform([paper_tokens(paper.title, paper.abstract, paper.keywords) for paper in papers])
+
+    # Store the batch's vectors first so its papers can rank in each other's lists
+    in_model = set(model.paper_ids.tolist())
+    db.session.execute(research_related_vectors.delete().where(
+        research_related_vectors.c.paper_id.in_(new_ids)
+    ))
+    now = datetime.utcnow()
+    stored = [
+        {
+            'paper_id': paper.id,
+            'created_at': now,
+            'term_indices': vectors[row].indices.astype(np.int32).tobytes(),
+            'weights': vectors[row].data.astype(np.float32).tobytes()
+        }
+        for row, paper in enumerate(papers) if paper.id not in in_model
+    ]
+    if stored:
+        db.session.execute(research_related_vectors.insert(), stored)
+
+    # Candidates: the saved matrix plus papers added since the last rebuild
+    recent_matrix, recent_ids = _recent_vectors(model)
+    scored_by_paper = {}
+    for row, paper in enumerate(papers):
+        vector = vectors[row]
+        scored = [(int(model.paper_ids[r]), score) for r, score in vector_neighbours(model.matrix, vector, k * 5)]
+        if recent_matrix is not None:
+            scored += [(recent_ids[r], score) for r, score in vector_neighbours(recent_matrix, vector, k * 5)]
+        scored_by_paper[paper.id] = sorted(
+            ((paper_id, score) for paper_id, score in scored if paper_id != paper.id),
+            key=lambda item: -item[1]
+        )[:k * 5]
+
+    # Current lists of the candidates, to merge the new papers into
+    lists = {paper_id: scored[:k] for paper_id, scored in scored_by_paper.items()}
+    candidate_ids = {
+        paper_id for scored in scored_by_paper.values() for paper_id, _ in scored
+    } - set(new_ids)
+    existing = {}
+    for chunk in _chunks(candidate_ids):
+        for row in db.session.execute(
+            db.select(research_related).where(research_related.c.paper_id.in_(chunk))
+            .order_by(research_related.c.paper_id, research_related.c.rank)
+        ):
+            existing.setdefault(row.paper_id, []).append((row.related_id, row.score))
+
+    for paper_id, scored in scored_by_paper.items():
+        for candidate_id, score in scored:
+            # New papers' own lists were computed with the whole batch stored
+            if candidate_id in scored_by_paper:
+                continue
+            current = lists.get(candidate_id, existing.get(candidate_id, []))
+            current = [item for item in current if item[0] != paper_id]
+            if len(current) < k or score > current[-1][1]:
+                lists[candidate_id] = sorted(current + [(paper_id, score)], key=lambda item: -item[1])[:k]
+
+    for chunk in _chunks(lists):
+        db.session.execute(research_related.delete().where(research_related.c.paper_id.in_(chunk)))
+    rows = [
+        {'paper_id': paper_id, 'rank': rank, 'related_id': related_id, 'score': score}
+        for paper_id, neighbours in lists.items()
+        for rank, (related_id, score) in enumerate(neighbours)
+    ]
+    if rows:
+        db.session.execute(research_related.insert(), rows)
+
+
+def get_related(paper_id, limit):
+    """Return [(paper, score), ...] of approved papers related to a paper"""
+    return db.session.query(ResearchPaper, research_related.c.score).join(
+        research_related, research_related.c.related_id == ResearchPaper.id
+    ).filter(
+        research_related.c.paper_id == paper_id,
+        ResearchPaper.status == ResearchStatus.APPROVED
+    ).order_by(research_related.c.rank).limit(limit).all()
+
+
+def rebuild_if_stale(max_age):
+    """Refit when the saved model is missing or older than max_age seconds.
+
+    Returns the number of papers fitted, or None when the model was fresh,
+    e.g. because another process on this host rebuilt it moments ago.
+    """
+    try:
+        age = time.time() - os.path.getmtime(_model_path())
+    except OSError:
+        age = None
+    if age is not None and age < max_age:
+        return None
+
+    count = rebuild_related()
+    db.session.commit()
+    return count
+
+
+def init_app(app):
+    interval = app.config.get('RELATED_REBUILD_INTERVAL', 3600)
+    job = start_job(app, 'related-rebuild', interval, lambda: rebuild_if_stale(interval / 2))
+    # A fresh deploy gets its model now rather than after a whole interval
+    if not os.path.exists(app.config['RELATED_MODEL_PATH']):
+        job.wake()
@@ -3,87 +3,145 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from src.models.user import User, UserRole, db
 from src.models.research import ResearchPaper, ResearchStatus, ResearchCategory
+from src.search import apply_search, rebuild_search_index
+from src.counters import counters
+from src.stats import RESEARCH, adjust_stats, move_stats, apply_moves, get_stats
+from src.pagination import paginate, InvalidCursor
+from src.validation import ValidationError, validate_research_paper
+from src.importer import run_import
+from src.projection import RESEARCH_LIST, InvalidFields
+from src.likes import like_paper, unlike_paper, liked_paper_ids, get_like_count
+from src.processing import PaperProcessing, QUEUED, pdf_pipeline, queue_paper, get_processing
+from src.related import add_related_papers, rebuild_related, get_related
+from src.trending import research_trending, add_trending_papers, remove_trending_papers
+from src.syndication import refresh_feeds
+from src.review_queue import (
+    claim_papers, get_claims, renew_claims, release_claims, claim_conflicts,
+    clear_claims, unclaimed_filter
+)
+from src.storage import (
+    StoredFile, store_upload, store_existing_file, attach_paper_file,
+    get_paper_file_hash, research_paper_files
+)
 from datetime import datetime
+import click
 import os
-import uuid
 
 research_bp = Blueprint('research', __name__)
 
 ALLOWED_EXTENSIONS = {'pdf'}
+MAX_LIKED_LOOKUP = 100
+MAX_BATCH_REVIEW = 500
+MAX_CLAIM_COUNT = 50
+
+REVIEW_ACTIONS = {
+    'approve': ResearchStatus.APPROVED,
+    'reject': ResearchStatus.REJECTED,
+    'request_revisions': ResearchStatus.REVISIONS_REQUIRED,
+}
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_unique_filename(original_filename):
-    """Generate a unique filename to prevent conflicts"""
-    ext = original_filename.rsplit('.', 1)[1].lower()
-    unique_id = str(uuid.uuid4())
-    return f"{unique_id}.{ext}"
+def is_paper_id(value):
+    """Check a JSON value is an integer id; JSON true/false are bools, not ids"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def accel_redirect_response(paper, etag):
+    """Build a response that lets nginx serve the file via X-Accel-Redirect"""
+    upload_root = current_app.config['UPLOAD_FOLDER']
+    stat = os.stat(paper.file_path)
+    relative_path = os.path.relpath(paper.file_path, upload_root).replace(os.sep, '/')
+    prefix = current_app.config['DOWNLOAD_ACCEL_REDIRECT_PREFIX'].rstrip('/')
+    
+    response = current_app.response_class(mimetype='application/pdf')
+    response.headers['X-Accel-Redirect'] = f"{prefix}/{relative_path}"
+    response.headers.set('Content-Disposition', 'attachment', filename=paper.filename)
+    response.set_etag(etag if isinstance(etag, str) else f"{stat.st_mtime}-{stat.st_size}")
+    response.last_modified = int(stat.st_mtime)
+    return response.make_conditional(request)
+
+def is_new_download(response):
+    """True if a download response starts a new logical download.
+    
+    Conditional hits (304), HEAD requests and resumed range requests that
+    do not start at byte 0 are not counted again.
+    """
+    if request.method != 'GET' or response.status_code not in (200, 206):
+        return False
+    
+    byte_range = request.range
+    return byte_range is None or byte_range.ranges[0][0] == 0
 
 @research_bp.route('/research', methods=['GET'])
 def get_research_papers():
     """Get all published research papers with filtering and pagination"""
     try:
         # Query parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         category = request.args.get('category', '')
         search = request.args.get('search', '')
         sort_by = request.args.get('sort_by', 'newest')
+        fields = RESEARCH_LIST.parse()
         
-        # Limit per_page to prevent abuse
-        per_page = min(per_page, 100)
-        
-        # Base query - only published papers
-        query = ResearchPaper.query.filter_by(status=ResearchStatus.APPROVED)
+        # Base query - only published papers. The trending table holds exactly
+        # the approved papers, so that sort reads its score index directly
+        if sort_by == 'trending':
+            query = ResearchPaper.query.join(
+                research_trending, research_trending.c.paper_id == ResearchPaper.id
+            )
+        else:
+            query = ResearchPaper.query.filter_by(status=ResearchStatus.APPROVED)
+        query = query.options(
+            *(RESEARCH_LIST.options(fields) if fields else RESEARCH_LIST.default_options())
+        )
         
         # Apply filters
         if category:
             try:
                 category_enum = ResearchCategory(category)
-                query = query.filter_by(category=category_enum)
+                # Not filter_by: after the trending join it resolves against research_trending
+                query = query.filter(ResearchPaper.category == category_enum)
             except ValueError:
                 return jsonify({'error': 'Invalid category'}), 400
         
+        search_rank = None
         if search:
-            search_term = f"%{search}%"
-            query = query.filter(
-                (ResearchPaper.title.ilike(search_term)) |
-                (ResearchPaper.abstract.ilike(search_term)) |
-                (ResearchPaper.keywords.ilike(search_term))
-            )
+            query, search_rank = apply_search(query, search)
         
-        # Apply sorting
-        if sort_by == 'newest':
-            query = query.order_by(ResearchPaper.published_at.desc())
-        elif sort_by == 'oldest':
-            query = query.order_by(ResearchPaper.published_at.asc())
-        elif sort_by == 'most_viewed':
-            query = query.order_by(ResearchPaper.views.desc())
-        elif sort_by == 'most_liked':
-            query = query.order_by(ResearchPaper.likes.desc())
-        else:
-            query = query.order_by(ResearchPaper.published_at.desc())
+        # Sort keys, each ending with the id so the order is unique
+        sort_options = {
+            'newest': [(ResearchPaper.published_at, True), (ResearchPaper.id, True)],
+            'oldest': [(ResearchPaper.published_at, False), (ResearchPaper.id, False)],
+            'most_viewed': [(ResearchPaper.views, True), (ResearchPaper.id, True)],
+            'most_liked': [(ResearchPaper.likes, True), (ResearchPaper.id, True)],
+        }
+        if search_rank is not None:
+            sort_options['relevance'] = [(search_rank, False)] + sort_options['newest']
         
-        # Paginate results
-        papers = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if sort_by == 'trending':
+            sort_options['trending'] = [
+                (research_trending.c.score, True), (research_trending.c.paper_id, True)
+            ]
+        
+        if sort_by not in sort_options:
+            sort_by = 'newest'
+        
+        papers, pagination = paginate(query, sort_options[sort_by], sort_by)
         
         return jsonify({
-            'research_papers': [paper.to_public_dict() for paper in papers.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': papers.total,
-                'pages': papers.pages,
-                'has_next': papers.has_next,
-                'has_prev': papers.has_prev
-            }
+            'research_papers': [
+                RESEARCH_LIST.serialize(paper, fields) if fields else paper.to_public_dict()
+                for paper in papers
+            ],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Get research papers error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve research papers'}), 500
@@ -100,9 +158,8 @@ def get_research_paper(paper_id):
         if not paper:
             return jsonify({'error': 'Research paper not found'}), 404
         
-        # Increment view count
-        paper.views += 1
-        db.session.commit()
+        # Count the view; flushed to the database in the background
+        counters.incr(ResearchPaper, paper.id, 'views')
         
         return jsonify({
             'research_paper': paper.to_public_dict()
@@ -112,6 +169,36 @@ def get_research_paper(paper_id):
         current_app.logger.error(f"Get research paper error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve research paper'}), 500
 
+@research_bp.route('/research/<int:paper_id>/related', methods=['GET'])
+def get_related_research_papers(paper_id):
+    """Get approved papers similar to a research paper"""
+    try:
+        limit = request.args.get('limit', 5, type=int)
+        limit = max(min(limit, current_app.config.get('RELATED_TOP_K', 20)), 1)
+        
+        paper = ResearchPaper.query.filter_by(
+            id=paper_id, 
+            status=ResearchStatus.APPROVED
+        ).first()
+        
+        if not paper:
+            return jsonify({'error': 'Research paper not found'}), 404
+        
+        related = []
+        for related_paper, score in get_related(paper.id, limit):
+            paper_data = related_paper.to_public_dict()
+            paper_data['similarity'] = round(score, 4)
+            related.append(paper_data)
+        
+        return jsonify({
+            'paper_id': paper.id,
+            'related_papers': related
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get related research papers error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve related research papers'}), 500
+
 @research_bp.route('/research', methods=['POST'])
 @jwt_required()
 def submit_research_paper():
@@ -128,25 +215,12 @@ def submit_research_paper():
             return jsonify({'error': 'Researcher role required to submit papers'}), 403
         
         # Validate form data
-        title = request.form.get('title', '').strip()
-        abstract = request.form.get('abstract', '').strip()
-        keywords = request.form.get('keywords', '').strip()
-        category = request.form.get('category', '').strip()
-        
-        if not all([title, abstract, category]):
-            return jsonify({'error': 'Title, abstract, and category are required'}), 400
-        
-        if len(title) < 10:
-            return jsonify({'error': 'Title must be at least 10 characters long'}), 400
-        
-        if len(abstract) < 50:
-            return jsonify({'error': 'Abstract must be at least 50 characters long'}), 400
-        
-        # Validate category
         try:
-            category_enum = ResearchCategory(category)
-        except ValueError:
-            return jsonify({'error': 'Invalid category'}), 400
+            fields = validate_research_paper(request.form)
+        except ValidationError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        category_enum = fields['category']
         
         # Handle file upload
         if 'file' not in request.files:
@@ -159,37 +233,41 @@ def submit_research_paper():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Only PDF files are allowed'}), 400
         
-        # Generate unique filename and save file
+        # Stream the file into content-addressed storage (deduplicated by hash)
         original_filename = secure_filename(file.filename)
-        unique_filename = generate_unique_filename(original_filename)
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        file.save(file_path)
-        file_size = os.path.getsize(file_path)
+        stored_file = store_upload(file.stream, current_app.config['UPLOAD_FOLDER'])
         
         # Create research paper record
         paper = ResearchPaper(
-            title=title,
-            abstract=abstract,
-            keywords=keywords,
-            category=category_enum,
             filename=original_filename,
-            file_path=file_path,
-            file_size=file_size,
+            file_path=stored_file.path,
+            file_size=stored_file.size,
             author_id=current_user_id,
-            status=ResearchStatus.PENDING
+            status=ResearchStatus.PENDING,
+            **fields
         )
         
         db.session.add(paper)
+        db.session.flush()
+        attach_paper_file(paper.id, stored_file.sha256)
+        adjust_stats(RESEARCH, ResearchStatus.PENDING, category_enum, 1)
+        
+        # Text extraction and thumbnails happen in the background
+        queue_paper(paper.id)
         
         # Update user research count
         user.research_count += 1
         
         db.session.commit()
+        pdf_pipeline.wake()
+        
+        paper_data = paper.to_dict()
+        paper_data['file_sha256'] = stored_file.sha256
+        paper_data['processing'] = db.session.get(PaperProcessing, paper.id).to_dict()
         
         return jsonify({
             'message': 'Research paper submitted successfully',
-            'research_paper': paper.to_dict()
+            'research_paper': paper_data
         }), 201
         
     except Exception as e:
@@ -209,19 +287,36 @@ def download_research_paper(paper_id):
         if not paper:
             return jsonify({'error': 'Research paper not found'}), 404
         
-        if not os.path.exists(paper.file_path):
+        # Bulk-imported papers carry metadata only
+        if not paper.file_path:
+            return jsonify({'error': 'Research paper has no file'}), 404
+        
+        # Content hash gives a strong ETag; legacy files fall back to
+        # Werkzeug's mtime/size based one
+        etag = get_paper_file_hash(paper.id) or True
+        
+        try:
+            if current_app.config.get('DOWNLOAD_ACCEL_REDIRECT_PREFIX'):
+                response = accel_redirect_response(paper, etag)
+            else:
+                # Handles If-None-Match, If-Modified-Since and Range, and
+                # honours USE_X_SENDFILE
+                response = send_file(
+                    paper.file_path,
+                    as_attachment=True,
+                    download_name=paper.filename,
+                    mimetype='application/pdf',
+                    etag=etag,
+                    conditional=True
+                )
+        except FileNotFoundError:
             return jsonify({'error': 'File not found on server'}), 404
         
-        # Increment download count
-        paper.downloads += 1
-        db.session.commit()
+        # Count the download; flushed to the database in the background
+        if is_new_download(response):
+            counters.incr(ResearchPaper, paper.id, 'downloads')
         
-        return send_file(
-            paper.file_path,
-            as_attachment=True,
-            download_name=paper.filename,
-            mimetype='application/pdf'
-        )
+        return response
         
     except Exception as e:
         current_app.logger.error(f"Download research paper error: {str(e)}")
@@ -230,8 +325,9 @@ def download_research_paper(paper_id):
 @research_bp.route('/research/<int:paper_id>/like', methods=['POST'])
 @jwt_required()
 def like_research_paper(paper_id):
-    """Like/unlike a research paper"""
+    """Like a research paper"""
     try:
+        current_user_id = get_jwt_identity()
         paper = ResearchPaper.query.filter_by(
             id=paper_id, 
             status=ResearchStatus.APPROVED
@@ -240,14 +336,14 @@ def like_research_paper(paper_id):
         if not paper:
             return jsonify({'error': 'Research paper not found'}), 404
         
-        # For simplicity, just increment likes
-        # In a full implementation, you'd track individual user likes
-        paper.likes += 1
+        # Liking twice is a no-op rather than another increment
+        created = like_paper(current_user_id, paper.id)
         db.session.commit()
         
         return jsonify({
-            'message': 'Research paper liked successfully',
-            'likes': paper.likes
+            'message': 'Research paper liked successfully' if created else 'Research paper already liked',
+            'liked': True,
+            'likes': get_like_count(paper.id)
         }), 200
         
     except Exception as e:
@@ -255,6 +351,124 @@ def like_research_paper(paper_id):
         current_app.logger.error(f"Like research paper error: {str(e)}")
         return jsonify({'error': 'Failed to like research paper'}), 500
 
+@research_bp.route('/research/<int:paper_id>/like', methods=['DELETE'])
+@jwt_required()
+def unlike_research_paper(paper_id):
+    """Remove the current user's like from a research paper"""
+    try:
+        current_user_id = get_jwt_identity()
+        paper = ResearchPaper.query.filter_by(
+            id=paper_id, 
+            status=ResearchStatus.APPROVED
+        ).first()
+        
+        if not paper:
+            return jsonify({'error': 'Research paper not found'}), 404
+        
+        removed = unlike_paper(current_user_id, paper.id)
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Research paper unliked successfully' if removed else 'Research paper was not liked',
+            'liked': False,
+            'likes': get_like_count(paper.id)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Unlike research paper error: {str(e)}")
+        return jsonify({'error': 'Failed to unlike research paper'}), 500
+
+@research_bp.route('/research/liked', methods=['GET'])
+@jwt_required()
+def get_liked_research_papers():
+    """Get which of the given paper ids the current user has liked"""
+    try:
+        current_user_id = get_jwt_identity()
+        
+        try:
+            paper_ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma-separated list of integers'}), 400
+        
+        if len(paper_ids) > MAX_LIKED_LOOKUP:
+            return jsonify({'error': f'At most {MAX_LIKED_LOOKUP} ids can be checked at once'}), 400
+        
+        liked = liked_paper_ids(current_user_id, paper_ids)
+        
+        return jsonify({
+            'liked_ids': sorted(liked),
+            'liked': {str(paper_id): paper_id in liked for paper_id in paper_ids}
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get liked research papers error: {str(e)}")
+        return jsonify({'error': 'Failed to get liked research papers'}), 500
+
+def update_related_papers(papers):
+    """Merge newly approved papers into the related-paper lists"""
+    try:
+        add_related_papers(papers)
+        db.session.commit()
+    except Exception as e:
+        # The review itself is already committed; the next rebuild catches up
+        db.session.rollback()
+        current_app.logger.error(f"Update related papers error: {str(e)}")
+
+def get_visible_paper(paper_id):
+    """Return a paper the current user may inspect, or None"""
+    paper = ResearchPaper.query.get(paper_id)
+    if not paper or paper.status == ResearchStatus.APPROVED:
+        return paper
+    
+    current_user_id = get_jwt_identity()
+    if current_user_id is None:
+        return None
+    if str(paper.author_id) == str(current_user_id):
+        return paper
+    
+    user = User.query.get(current_user_id)
+    return paper if user and user.has_role(UserRole.MODERATOR) else None
+
+@research_bp.route('/research/<int:paper_id>/processing', methods=['GET'])
+@jwt_required(optional=True)
+def get_research_processing(paper_id):
+    """Get the background processing status of a research paper"""
+    try:
+        paper = get_visible_paper(paper_id)
+        if not paper:
+            return jsonify({'error': 'Research paper not found'}), 404
+        
+        row = db.session.get(PaperProcessing, paper.id)
+        
+        return jsonify({
+            'paper_id': paper.id,
+            'processing': row.to_dict() if row else None
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get research processing error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve processing status'}), 500
+
+@research_bp.route('/research/<int:paper_id>/thumbnail', methods=['GET'])
+@jwt_required(optional=True)
+def get_research_thumbnail(paper_id):
+    """Get the first-page thumbnail of a research paper"""
+    try:
+        paper = get_visible_paper(paper_id)
+        row = db.session.get(PaperProcessing, paper.id) if paper else None
+        
+        if not row or not row.thumbnail_path:
+            return jsonify({'error': 'Thumbnail not found'}), 404
+        
+        return send_file(row.thumbnail_path, mimetype='image/png', conditional=True, max_age=86400)
+        
+    except FileNotFoundError:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    except Exception as e:
+        current_app.logger.error(f"Get research thumbnail error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve thumbnail'}), 500
+
 # Admin/Moderator routes for research management
 
 @research_bp.route('/research/pending', methods=['GET'])
@@ -268,28 +482,30 @@ def get_pending_research():
         if not user or not user.has_role(UserRole.MODERATOR):
             return jsonify({'error': 'Moderator access required'}), 403
         
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        per_page = min(per_page, 100)
+        query = ResearchPaper.query.filter_by(status=ResearchStatus.PENDING)
+        if request.args.get('unclaimed', 'false').lower() == 'true':
+            query = query.filter(unclaimed_filter())
         
-        papers = ResearchPaper.query.filter_by(
-            status=ResearchStatus.PENDING
-        ).order_by(ResearchPaper.created_at.asc()).paginate(
-            page=page, per_page=per_page, error_out=False
+        papers, pagination = paginate(
+            query, [(ResearchPaper.created_at, False), (ResearchPaper.id, False)], 'pending'
         )
         
+        # Page count and thumbnail state help moderators triage
+        processing = get_processing([paper.id for paper in papers])
+        research_papers = []
+        for paper in papers:
+            paper_data = paper.to_dict()
+            row = processing.get(paper.id)
+            paper_data['processing'] = row.to_dict() if row else None
+            research_papers.append(paper_data)
+        
         return jsonify({
-            'research_papers': [paper.to_dict() for paper in papers.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': papers.total,
-                'pages': papers.pages,
-                'has_next': papers.has_next,
-                'has_prev': papers.has_prev
-            }
+            'research_papers': research_papers,
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         current_app.logger.error(f"Get pending research error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve pending research'}), 500
@@ -313,25 +529,40 @@ def review_research_paper(paper_id):
         action = data.get('action')  # 'approve', 'reject', 'request_revisions'
         comments = data.get('comments', '').strip()
         
-        if action not in ['approve', 'reject', 'request_revisions']:
+        if action not in REVIEW_ACTIONS:
             return jsonify({'error': 'Invalid action'}), 400
         
+        if claim_conflicts(current_user_id, [paper.id]):
+            return jsonify({'error': 'Research paper is claimed by another moderator'}), 409
+        
+        old_status = paper.status
+        
         # Update paper status
+        paper.status = REVIEW_ACTIONS[action]
         if action == 'approve':
-            paper.status = ResearchStatus.APPROVED
             paper.published_at = datetime.utcnow()
-        elif action == 'reject':
-            paper.status = ResearchStatus.REJECTED
-        elif action == 'request_revisions':
-            paper.status = ResearchStatus.REVISIONS_REQUIRED
         
         paper.reviewer_comments = comments
         paper.reviewed_by = current_user_id
         paper.reviewed_at = datetime.utcnow()
         paper.updated_at = datetime.utcnow()
         
+        move_stats(RESEARCH, old_status, paper.category, paper.status, paper.category)
+        clear_claims([paper.id])
+        
+        if paper.status == ResearchStatus.APPROVED:
+            add_trending_papers([paper.id])
+        else:
+            remove_trending_papers([paper.id])
+        
+        if ResearchStatus.APPROVED in (old_status, paper.status):
+            refresh_feeds(RESEARCH, [paper.category])
+        
         db.session.commit()
         
+        if paper.status == ResearchStatus.APPROVED:
+            update_related_papers([paper])
+        
         return jsonify({
             'message': f'Research paper {action}d successfully',
             'research_paper': paper.to_dict()
@@ -342,6 +573,289 @@ def review_research_paper(paper_id):
         current_app.logger.error(f"Review research paper error: {str(e)}")
         return jsonify({'error': 'Failed to review research paper'}), 500
 
+@research_bp.route('/research/review/batch', methods=['POST'])
+@jwt_required()
+def batch_review_research_papers():
+    """Approve, reject or request revisions for many papers at once (moderator/admin only)"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        data = request.get_json() or {}
+        items = data.get('items')
+        mode = data.get('mode', 'atomic')  # 'atomic' or 'partial'
+        
+        if mode not in ['atomic', 'partial']:
+            return jsonify({'error': 'mode must be atomic or partial'}), 400
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        
+        if len(items) > MAX_BATCH_REVIEW:
+            return jsonify({'error': f'At most {MAX_BATCH_REVIEW} papers can be reviewed at once'}), 400
+        
+        # Load every referenced paper with one query
+        paper_ids = [item.get('paper_id') for item in items if isinstance(item, dict)]
+        papers = {
+            paper.id: paper for paper in ResearchPaper.query.filter(
+                ResearchPaper.id.in_([i for i in paper_ids if is_paper_id(i)])
+            ).all()
+        }
+        
+        conflicts = claim_conflicts(current_user_id, list(papers))
+        
+        # Validate everything before writing anything
+        results = []
+        valid = []
+        seen = set()
+        for item in items:
+            item = item if isinstance(item, dict) else {}
+            paper_id = item.get('paper_id')
+            action = item.get('action')
+            comments = item.get('comments') or ''
+            
+            if not is_paper_id(paper_id):
+                error = 'paper_id must be an integer'
+            elif paper_id in seen:
+                error = 'Duplicate paper_id'
+            elif action not in REVIEW_ACTIONS:
+                error = 'Invalid action'
+            elif not isinstance(comments, str):
+                error = 'comments must be a string'
+            elif paper_id not in papers:
+                error = 'Research paper not found'
+            elif paper_id in conflicts:
+                error = 'Research paper is claimed by another moderator'
+            else:
+                error = None
+                valid.append((papers[paper_id], action, comments.strip()))
+            
+            if is_paper_id(paper_id):
+                seen.add(paper_id)
+            results.append({'paper_id': paper_id, 'action': action, 'ok': error is None, 'error': error})
+        
+        failed = sum(1 for result in results if not result['ok'])
+        if failed and mode == 'atomic':
+            for result in results:
+                if result['ok']:
+                    result['ok'], result['error'] = False, 'Not applied: batch contains invalid items'
+            return jsonify({
+                'error': 'Batch contains invalid items; nothing was applied',
+                'applied': 0,
+                'failed': len(results),
+                'results': results
+            }), 400
+        
+        # One bulk UPDATE per action, with per-paper comments in a CASE
+        now = datetime.utcnow()
+        by_action = {}
+        for paper, action, comments in valid:
+            by_action.setdefault(action, []).append((paper, comments))
+        
+        # Statuses before the UPDATEs, which leave the loaded papers untouched
+        moves = [
+            (paper.status, paper.category, REVIEW_ACTIONS[action], paper.category)
+            for paper, action, _ in valid
+        ]
+        for action, entries in by_action.items():
+            new_status = REVIEW_ACTIONS[action]
+            values = {
+                'status': new_status,
+                'reviewer_comments': db.case(
+                    {paper.id: comments for paper, comments in entries},
+                    value=ResearchPaper.id
+                ),
+                'reviewed_by': current_user_id,
+                'reviewed_at': now,
+                'updated_at': now
+            }
+            if action == 'approve':
+                values['published_at'] = now
+            
+            db.session.execute(
+                db.update(ResearchPaper)
+                .where(ResearchPaper.id.in_([paper.id for paper, _ in entries]))
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        
+        apply_moves(RESEARCH, moves)
+        clear_claims([paper.id for paper, _, _ in valid])
+        add_trending_papers([paper.id for paper, _ in by_action.get('approve', [])])
+        remove_trending_papers([
+            paper.id for paper, action, _ in valid if action != 'approve'
+        ])
+        feed_categories = {
+            old_category for old_status, old_category, new_status, _ in moves
+            if ResearchStatus.APPROVED in (old_status, new_status)
+        }
+        if feed_categories:
+            refresh_feeds(RESEARCH, feed_categories)
+        db.session.commit()
+        
+        if 'approve' in by_action:
+            update_related_papers([paper for paper, _ in by_action['approve']])
+        
+        statuses = {
+            paper.id: REVIEW_ACTIONS[action].value for paper, action, _ in valid
+        }
+        for result in results:
+            if result['ok']:
+                result['status'] = statuses[result['paper_id']]
+        
+        return jsonify({
+            'message': f'Reviewed {len(valid)} research papers',
+            'applied': len(valid),
+            'failed': failed,
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Batch review research papers error: {str(e)}")
+        return jsonify({'error': 'Failed to review research papers'}), 500
+
+def claimed_papers_response(papers, leases):
+    """Serialize claimed papers with their lease expiry and processing state"""
+    processing = get_processing([paper.id for paper in papers])
+    research_papers = []
+    for paper in papers:
+        paper_data = paper.to_dict()
+        row = processing.get(paper.id)
+        paper_data['processing'] = row.to_dict() if row else None
+        paper_data['lease_expires_at'] = leases[paper.id].isoformat()
+        research_papers.append(paper_data)
+    return research_papers
+
+def get_paper_ids(data):
+    """Read a list of at most MAX_BATCH_REVIEW paper ids from a JSON body, or None if invalid"""
+    paper_ids = data.get('paper_ids')
+    if not isinstance(paper_ids, list) or len(paper_ids) > MAX_BATCH_REVIEW:
+        return None
+    if not all(is_paper_id(i) for i in paper_ids):
+        return None
+    return paper_ids
+
+@research_bp.route('/research/review/claim', methods=['POST'])
+@jwt_required()
+def claim_research_papers():
+    """Claim the next pending papers for review with a time-limited lease (moderator/admin only)"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        count = data.get('count', 10)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            return jsonify({'error': 'count must be a positive integer'}), 400
+        count = min(count, MAX_CLAIM_COUNT)
+        
+        # Papers in these categories are offered first
+        try:
+            categories = [ResearchCategory(c) for c in data.get('categories', [])]
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid category'}), 400
+        
+        papers, lease_expires_at = claim_papers(
+            current_user_id, count, current_app.config['REVIEW_LEASE_SECONDS'], categories
+        )
+        db.session.commit()
+        
+        return jsonify({
+            'research_papers': claimed_papers_response(
+                papers, {paper.id: lease_expires_at for paper in papers}
+            ),
+            'lease_expires_at': lease_expires_at.isoformat()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Claim research papers error: {str(e)}")
+        return jsonify({'error': 'Failed to claim research papers'}), 500
+
+@research_bp.route('/research/review/claims', methods=['GET'])
+@jwt_required()
+def get_claimed_research_papers():
+    """Get the papers the current moderator holds a live lease on"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        leases = get_claims(current_user_id)
+        papers = ResearchPaper.query.filter(
+            ResearchPaper.id.in_(list(leases))
+        ).order_by(ResearchPaper.created_at.asc()).all()
+        
+        return jsonify({
+            'research_papers': claimed_papers_response(papers, leases)
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get claimed research papers error: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve claimed research papers'}), 500
+
+@research_bp.route('/research/review/renew', methods=['POST'])
+@jwt_required()
+def renew_research_claims():
+    """Extend the leases on papers the current moderator has claimed"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        paper_ids = get_paper_ids(request.get_json(silent=True) or {})
+        if paper_ids is None:
+            return jsonify({'error': f'paper_ids must be a list of at most {MAX_BATCH_REVIEW} integers'}), 400
+        
+        renewed = renew_claims(current_user_id, paper_ids, current_app.config['REVIEW_LEASE_SECONDS'])
+        db.session.commit()
+        
+        return jsonify({
+            'renewed': renewed,
+            'leases': {str(paper_id): expires.isoformat() for paper_id, expires in get_claims(current_user_id).items()}
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Renew research claims error: {str(e)}")
+        return jsonify({'error': 'Failed to renew claims'}), 500
+
+@research_bp.route('/research/review/release', methods=['POST'])
+@jwt_required()
+def release_research_claims():
+    """Return claimed papers to the review queue"""
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or not user.has_role(UserRole.MODERATOR):
+            return jsonify({'error': 'Moderator access required'}), 403
+        
+        paper_ids = get_paper_ids(request.get_json(silent=True) or {})
+        if paper_ids is None:
+            return jsonify({'error': f'paper_ids must be a list of at most {MAX_BATCH_REVIEW} integers'}), 400
+        
+        released = release_claims(current_user_id, paper_ids)
+        db.session.commit()
+        
+        return jsonify({'released': released}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Release research claims error: {str(e)}")
+        return jsonify({'error': 'Failed to release claims'}), 500
+
 @research_bp.route('/research/my-papers', methods=['GET'])
 @jwt_required()
 def get_my_research_papers():
@@ -398,22 +912,25 @@ def get_research_categories():
 def get_research_stats():
     """Get research statistics"""
     try:
-        total_papers = ResearchPaper.query.filter_by(status=ResearchStatus.APPROVED).count()
-        pending_papers = ResearchPaper.query.filter_by(status=ResearchStatus.PENDING).count()
-        total_downloads = db.session.query(db.func.sum(ResearchPaper.downloads)).scalar() or 0
-        total_views = db.session.query(db.func.sum(ResearchPaper.views)).scalar() or 0
+        stats = get_stats(RESEARCH)
+        approved = ResearchStatus.APPROVED.value
+        
+        total_papers = sum(count for (status, _), (count, _, _) in stats.items() if status == approved)
+        pending_papers = sum(
+            count for (status, _), (count, _, _) in stats.items()
+            if status == ResearchStatus.PENDING.value
+        )
+        total_downloads = sum(downloads for _, _, downloads in stats.values())
+        total_views = sum(views for _, views, _ in stats.values())
         
         # Category breakdown
-        category_stats = []
-        for category in ResearchCategory:
-            count = ResearchPaper.query.filter_by(
-                category=category, 
-                status=ResearchStatus.APPROVED
-            ).count()
-            category_stats.append({
+        category_stats = [
+            {
                 'category': category.value,
-                'count': count
-            })
+                'count': stats.get((approved, category.value), (0, 0, 0))[0]
+            }
+            for category in ResearchCategory
+        ]
         
         return jsonify({
             'total_papers': total_papers,
@@ -427,3 +944,99 @@ def get_research_stats():
         current_app.logger.error(f"Get research stats error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve research statistics'}), 500
 
+@research_bp.cli.command('reindex')
+def reindex_research_command():
+    """Rebuild the full-text search index from existing papers"""
+    count = rebuild_search_index()
+    click.echo(f"Indexed {count} research papers")
+
+@research_bp.cli.command('rebuild-related')
+def rebuild_related_command():
+    """Refit the related-papers model and recompute all neighbour lists"""
+    count = rebuild_related()
+    db.session.commit()
+    click.echo(f"Computed related papers for {count} research papers")
+
+@research_bp.cli.command('migrate-storage')
+@click.option('--batch-size', default=100, show_default=True)
+def migrate_storage_command(batch_size):
+    """Move existing paper files into content-addressed storage"""
+    upload_root = current_app.config['UPLOAD_FOLDER']
+    migrated = missing = 0
+    legacy_paths = []
+    
+    def commit_batch():
+        # Originals are only deleted once the papers point at their blobs
+        db.session.commit()
+        for path in legacy_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        legacy_paths.clear()
+    
+    papers = ResearchPaper.query.outerjoin(
+        research_paper_files, research_paper_files.c.paper_id == ResearchPaper.id
+    ).filter(
+        research_paper_files.c.paper_id.is_(None),
+        ResearchPaper.file_path.isnot(None)
+    ).order_by(ResearchPaper.id).all()
+    
+    for paper in papers:
+        if not os.path.exists(paper.file_path):
+            missing += 1
+            continue
+        
+        stored_file = store_existing_file(paper.file_path, upload_root)
+        if os.path.abspath(paper.file_path) != os.path.abspath(stored_file.path):
+            legacy_paths.append(paper.file_path)
+        
+        paper.file_path = stored_file.path
+        attach_paper_file(paper.id, stored_file.sha256)
+        migrated += 1
+        
+        if migrated % batch_size == 0:
+            commit_batch()
+            click.echo(f"Migrated {migrated} files...")
+    
+    commit_batch()
+    
+    blob_count = StoredFile.query.count()
+    click.echo(f"Migrated {migrated} files ({missing} missing on disk); {blob_count} unique files stored")
+
+@research_bp.cli.command('process-pdfs')
+@click.option('--all', 'queue_all', is_flag=True, help='Also queue papers that were never processed')
+def process_pdfs_command(queue_all):
+    """Process queued papers in this process, e.g. to backfill existing uploads"""
+    if queue_all:
+        unprocessed = db.session.query(ResearchPaper.id).outerjoin(
+            PaperProcessing, PaperProcessing.paper_id == ResearchPaper.id
+        ).filter(PaperProcessing.paper_id.is_(None)).all()
+        for (paper_id,) in unprocessed:
+            queue_paper(paper_id)
+        db.session.commit()
+        click.echo(f"Queued {len(unprocessed)} papers")
+    
+    queued = db.session.query(PaperProcessing.paper_id).filter_by(
+        status=QUEUED
+    ).order_by(PaperProcessing.queued_at).all()
+    
+    results = {}
+    for (paper_id,) in queued:
+        status = pdf_pipeline.process_now(paper_id)
+        if status:
+            results[status] = results.get(status, 0) + 1
+    
+    summary = ', '.join(f"{count} {status}" for status, count in sorted(results.items()))
+    click.echo(f"Processed {sum(results.values())} papers" + (f" ({summary})" if summary else ''))
+
+@research_bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help='Defaults to csv for .csv files, else ndjson.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--author', default='admin', show_default=True, help='Username for records without an author.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an earlier run of this file.')
+def import_research_command(path, fmt, chunk_size, author, restart):
+    """Bulk import research paper metadata (without files) from NDJSON or CSV"""
+    imported, skipped = run_import(RESEARCH, path, fmt, chunk_size, author, restart)
+    click.echo(f"Imported {imported} research papers, skipped {skipped}")
+    if imported:
+        click.echo("Run `flask research rebuild-related` to include them in related papers")
@@ -0,0 +1,157 @@
+"""Claim leases for the research review queue.
+
+A moderator claims the next pending papers for a limited time instead of
+everyone reading the same oldest-first page. Claims live in
+`research_review_claims`, one row per paper. Claiming is a conditional
+UPDATE that takes over expired leases plus an INSERT that skips papers which
+already have a claim row. Both statements are atomic, so concurrent
+moderators never block on or receive the same paper; they only skip what
+someone else got first. Expired leases go back to the pool without any
+cleanup step.
+
+Queue order: resubmissions (pending papers that were reviewed before)
+first, then the moderator's preferred categories, then oldest first.
+"""
+import uuid
+from datetime import datetime, timedelta
+from src.models.user import db
+from src.models.research import ResearchPaper, ResearchStatus
+from src.dbutil import insert_ignore
+
+# Claim attempts per request when other moderators win the race
+CLAIM_ROUNDS = 3
+
+research_review_claims = db.Table(
+    'research_review_claims',
+    db.Column('paper_id', db.Integer, db.ForeignKey('research_papers.id'), primary_key=True),
+    db.Column('moderator_id', db.Integer, db.ForeignKey('users.id'), nullable=False, index=True),
+    db.Column('claim_token', db.String(32), nullable=False, index=True),
+    db.Column('lease_expires_at', db.DateTime, nullable=False, index=True),
+    db.Column('claimed_at', db.DateTime, nullable=False),
+)
+
+
+def _live_claim_exists(now):
+    return db.exists().where(
+        research_review_claims.c.paper_id == ResearchPaper.id,
+        research_review_claims.c.lease_expires_at >= now
+    )
+
+
+def unclaimed_filter(now=None):
+    """Condition for pending papers that nobody holds a live lease on"""
+    return ~_live_claim_exists(now or datetime.utcnow())
+
+
+def _priority_order(categories):
+    order = [db.case((ResearchPaper.reviewed_at.isnot(None), 0), else_=1)]
+    if categories:
+        order.append(db.case((ResearchPaper.category.in_(categories), 0), else_=1))
+    return order + [ResearchPaper.created_at.asc(), ResearchPaper.id.asc()]
+
+
+def claim_papers(moderator_id, count, lease_seconds, categories=()):
+    """Claim up to `count` unclaimed pending papers; the caller commits.
+
+    Returns (papers, lease_expires_at).
+    """
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=lease_seconds)
+    token = uuid.uuid4().hex
+    claimed = 0
+
+    for _ in range(CLAIM_ROUNDS):
+        candidates = [row.id for row in db.session.query(ResearchPaper.id).filter(
+            ResearchPaper.status == ResearchStatus.PENDING,
+            unclaimed_filter(now)
+        ).order_by(*_priority_order(categories)).limit(count - claimed)]
+        if not candidates:
+            break
+
+        values = {
+            'moderator_id': moderator_id,
+            'claim_token': token,
+            'lease_expires_at': expires,
+            'claimed_at': now,
+        }
+        # Take over expired leases, then create claims for unclaimed papers
+        db.session.execute(
+            research_review_claims.update().where(
+                research_review_claims.c.paper_id.in_(candidates),
+                research_review_claims.c.lease_expires_at < now
+            ).values(**values)
+        )
+        db.session.execute(
+            insert_ignore(research_review_claims),
+            [dict(values, paper_id=paper_id) for paper_id in candidates]
+        )
+
+        claimed = db.session.execute(
+            db.select(db.func.count()).where(research_review_claims.c.claim_token == token)
+        ).scalar()
+        if claimed >= count:
+            break
+
+    papers = ResearchPaper.query.join(
+        research_review_claims, research_review_claims.c.paper_id == ResearchPaper.id
+    ).filter(
+        research_review_claims.c.claim_token == token
+    ).order_by(*_priority_order(categories)).all()
+    return papers, expires
+
+
+def get_claims(moderator_id):
+    """Return {paper_id: lease_expires_at} of a moderator's live claims"""
+    rows = db.session.execute(
+        db.select(research_review_claims.c.paper_id, research_review_claims.c.lease_expires_at).where(
+            research_review_claims.c.moderator_id == moderator_id,
+            research_review_claims.c.lease_expires_at >= datetime.utcnow()
+        )
+    )
+    return {row.paper_id: row.lease_expires_at for row in rows}
+
+
+def renew_claims(moderator_id, paper_ids, lease_seconds):
+    """Extend a moderator's live leases; returns the number renewed"""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        research_review_claims.update().where(
+            research_review_claims.c.paper_id.in_(paper_ids),
+            research_review_claims.c.moderator_id == moderator_id,
+            research_review_claims.c.lease_expires_at >= now
+        ).values(lease_expires_at=now + timedelta(seconds=lease_seconds))
+    )
+    return result.rowcount
+
+
+def release_claims(moderator_id, paper_ids):
+    """Give papers back to the queue; returns the number released"""
+    result = db.session.execute(
+        research_review_claims.delete().where(
+            research_review_claims.c.paper_id.in_(paper_ids),
+            research_review_claims.c.moderator_id == moderator_id
+        )
+    )
+    return result.rowcount
+
+
+def claim_conflicts(moderator_id, paper_ids):
+    """Return {paper_id: moderator_id} for live leases held by other moderators"""
+    if not paper_ids:
+        return {}
+    rows = db.session.execute(
+        db.select(research_review_claims.c.paper_id, research_review_claims.c.moderator_id).where(
+            research_review_claims.c.paper_id.in_(paper_ids),
+            research_review_claims.c.moderator_id != moderator_id,
+            research_review_claims.c.lease_expires_at >= datetime.utcnow()
+        )
+    )
+    return {row.paper_id: row.moderator_id for row in rows}
+
+
+def clear_claims(paper_ids):
+    """Drop the claims on reviewed papers; the caller commits"""
+    if paper_ids:
+        db.session.execute(
+            research_review_claims.delete().where(research_review_claims.c.paper_id.in_(paper_ids))
+        )
@@ -0,0 +1,191 @@
+"""Scheduled publishing for news articles.
+
+`news_schedule` holds an optional publish and unpublish time per article,
+each indexed so the scheduler only reads rows that are due. A periodic job
+publishes every due article in one transaction, applies the stats moves,
+refreshes the news feeds and invalidates the news caches, and then renders
+the cached endpoints again so the crowd refreshing at embargo time hits a
+warm cache.
+
+Every app process runs the job. A run first claims the due rows with a
+conditional UPDATE that stamps its own token and clears the due time, so
+a concurrent run in another process waits on the row lock and then no
+longer sees the row as due. Each article is therefore published or
+unpublished by exactly one process, and a failed run rolls back its claim.
+"""
+import uuid
+from datetime import datetime
+from src.models.user import db
+from src.models.news import NewsArticle, NewsStatus
+from src.stats import NEWS, apply_moves
+from src.syndication import refresh_feeds
+from src.tags import count_published
+from src.cache import NEWS_LIST_TAG, invalidate_cache, news_article_tag, warm_endpoints
+from src.jobs import start_job
+
+DEFAULT_WARM_ENDPOINTS = ['news.get_news_articles', 'news.get_featured_news']
+
+news_schedule = db.Table(
+    'news_schedule',
+    db.Column('article_id', db.Integer, db.ForeignKey('news_articles.id'), primary_key=True),
+    db.Column('publish_at', db.DateTime, nullable=True, index=True),
+    db.Column('unpublish_at', db.DateTime, nullable=True, index=True),
+    db.Column('claim_token', db.String(32), nullable=True),
+    db.Column('scheduled_by', db.Integer, db.ForeignKey('users.id'), nullable=True),
+    db.Column('updated_at', db.DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+def schedule_to_dict(row):
+    return {
+        'article_id': row.article_id,
+        'publish_at': row.publish_at.isoformat() if row.publish_at else None,
+        'unpublish_at': row.unpublish_at.isoformat() if row.unpublish_at else None,
+        'scheduled_by': row.scheduled_by,
+        'updated_at': row.updated_at.isoformat() if row.updated_at else None
+    }
+
+
+def get_schedules(article_ids):
+    """Return {article_id: row} for the articles that have a schedule"""
+    if not article_ids:
+        return {}
+    rows = db.session.execute(
+        db.select(news_schedule).where(news_schedule.c.article_id.in_(article_ids))
+    )
+    return {row.article_id: row for row in rows}
+
+
+def set_schedule(article_id, publish_at, unpublish_at, user_id):
+    """Create or replace an article's schedule; the caller commits"""
+    values = {
+        'publish_at': publish_at,
+        'unpublish_at': unpublish_at,
+        'claim_token': None,
+        'scheduled_by': user_id,
+        'updated_at': datetime.utcnow()
+    }
+    result = db.session.execute(
+        news_schedule.update().where(news_schedule.c.article_id == article_id).values(**values)
+    )
+    if result.rowcount == 0:
+        db.session.execute(news_schedule.insert().values(article_id=article_id, **values))
+
+
+def clear_schedule(article_id, publish=True, unpublish=True):
+    """Drop pending times of an article; the caller commits"""
+    values = {}
+    if publish:
+        values['publish_at'] = None
+    if unpublish:
+        values['unpublish_at'] = None
+    db.session.execute(
+        news_schedule.update().where(news_schedule.c.article_id == article_id).values(**values)
+    )
+    _delete_empty([article_id])
+
+
+def _delete_empty(article_ids):
+    db.session.execute(news_schedule.delete().where(
+        news_schedule.c.article_id.in_(article_ids),
+        news_schedule.c.publish_at.is_(None),
+        news_schedule.c.unpublish_at.is_(None)
+    ))
+
+
+def _claim_due(column, now, token):
+    """Claim due rows for this run; returns {article_id: due_time}"""
+    due = dict(db.session.execute(
+        db.select(news_schedule.c.article_id, column).where(column <= now)
+    ).all())
+    if not due:
+        return {}
+
+    db.session.execute(
+        news_schedule.update().where(
+            news_schedule.c.article_id.in_(list(due)),
+            column <= now
+        ).values({column: None, 'claim_token': token})
+    )
+    claimed = db.session.execute(
+        db.select(news_schedule.c.article_id).where(
+            news_schedule.c.article_id.in_(list(due)),
+            news_schedule.c.claim_token == token
+        )
+    ).scalars().all()
+    return {article_id: due[article_id] for article_id in claimed}
+
+
+def _apply(due, from_published, new_status, now):
+    """Move the claimed articles to new_status; returns the (id, status, category) rows changed"""
+    if not due:
+        return []
+
+    status_filter = (NewsArticle.status == NewsStatus.PUBLISHED) if from_published \
+        else (NewsArticle.status != NewsStatus.PUBLISHED)
+    articles = db.session.query(NewsArticle.id, NewsArticle.status, NewsArticle.category).filter(
+        NewsArticle.id.in_(list(due)), status_filter
+    ).all()
+    if not articles:
+        return []
+
+    ids = [article.id for article in articles]
+    values = {'status': new_status, 'updated_at': now}
+    if new_status == NewsStatus.PUBLISHED:
+        # Stamp the embargo time rather than the moment the job got to it
+        values['published_at'] = db.case(
+            {article_id: due[article_id] for article_id in ids}, value=NewsArticle.id
+        )
+    db.session.execute(
+        db.update(NewsArticle)
+        .where(NewsArticle.id.in_(ids))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    apply_moves(NEWS, [
+        (article.status, article.category, new_status, article.category) for article in articles
+    ])
+    count_published(ids, 1 if new_status == NewsStatus.PUBLISHED else -1)
+    return articles
+
+
+def run_schedule(now=None):
+    """Publish and unpublish every due article in one transaction.
+
+    Returns (published_ids, unpublished_ids).
+    """
+    now = now or datetime.utcnow()
+    token = uuid.uuid4().hex
+
+    due_publish = _claim_due(news_schedule.c.publish_at, now, token)
+    due_unpublish = _claim_due(news_schedule.c.unpublish_at, now, token)
+    if not due_publish and not due_unpublish:
+        db.session.rollback()
+        return [], []
+
+    published = _apply(due_publish, False, NewsStatus.PUBLISHED, now)
+    unpublished = _apply(due_unpublish, True, NewsStatus.DRAFT, now)
+
+    changed = published + unpublished
+    if changed:
+        invalidate_cache(NEWS_LIST_TAG, *[news_article_tag(article.id) for article in changed])
+        refresh_feeds(NEWS, {article.category for article in changed})
+
+    db.session.execute(
+        news_schedule.update().where(news_schedule.c.claim_token == token).values(claim_token=None)
+    )
+    _delete_empty(list(set(due_publish) | set(due_unpublish)))
+    db.session.commit()
+    return [article.id for article in published], [article.id for article in unpublished]
+
+
+def init_app(app):
+    def run():
+        published, unpublished = run_schedule()
+        if published or unpublished:
+            app.logger.info(
+                f"Scheduled publishing: {len(published)} published, {len(unpublished)} unpublished"
+            )
+            warm_endpoints(app, app.config.get('SCHEDULER_WARM_ENDPOINTS', DEFAULT_WARM_ENDPOINTS))
+
+    start_job(app, 'news-scheduler', app.config.get('SCHEDULER_INTERVAL', 15), run)
@@ -0,0 +1,203 @@
+"""Full-text search index for research papers.
+
+Papers are mirrored into an SQLite FTS5 table by triggers on the papers
+table, so every insert, review or edit is indexed in the same transaction
+that changes the row. Queries are ranked with BM25. On databases without
+FTS5 the search falls back to ILIKE matching.
+
+The `body` column holds the text extracted from the paper's PDF. It is not
+part of the papers table: the processing pipeline writes it with
+`index_paper_body()` once extraction finishes.
+"""
+import re
+import logging
+from src.models.user import db
+from src.models.research import ResearchPaper
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'research_papers_fts'
+
+# Indexed columns and their BM25 weights (higher weight = more relevant)
+FTS_COLUMNS = (
+    ('title', 10.0),
+    ('keywords', 5.0),
+    ('abstract', 2.0),
+    ('body', 1.0),
+)
+
+# Filled from the PDF processing table rather than the papers table
+BODY_COLUMN = 'body'
+BODY_SOURCE_TABLE = 'research_paper_processing'
+
+FTS_TOKENIZER = 'porter unicode61 remove_diacritics 2'
+
+# Set by ensure_search_index() once the FTS table is known to work
+fts_enabled = False
+
+_QUERY_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def index_statements(source_table):
+    """Return the DDL that creates the FTS table and its sync triggers"""
+    all_columns = ', '.join(name for name, _ in FTS_COLUMNS)
+    columns = _paper_columns()
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{name}' for name in columns)
+    assignments = ', '.join(f'{name} = new.{name}' for name in columns)
+
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5({all_columns}, tokenize = '{FTS_TOKENIZER}')",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+        f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {source_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {column_list}) VALUES (new.id, {new_values}); "
+        f"END",
+        f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF {column_list} ON {source_table} BEGIN "
+        f"UPDATE {FTS_TABLE} SET {assignments} WHERE rowid = new.id; "
+        f"END",
+        f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {source_table} BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"END",
+    ]
+
+
+def _paper_columns():
+    return [name for name, _ in FTS_COLUMNS if name != BODY_COLUMN]
+
+
+def rebuild_statements(source_table):
+    """Return the SQL that repopulates the FTS table from the papers table"""
+    columns = _paper_columns()
+    column_list = ', '.join(columns)
+    paper_values = ', '.join(f'p.{name}' for name in columns)
+    return [
+        f"DELETE FROM {FTS_TABLE}",
+        f"INSERT INTO {FTS_TABLE}(rowid, {column_list}, {BODY_COLUMN}) "
+        f"SELECT p.id, {paper_values}, b.text FROM {source_table} p "
+        f"LEFT JOIN {BODY_SOURCE_TABLE} b ON b.paper_id = p.id",
+    ]
+
+
+def rank_expression():
+    """Return the bm25() call using the configured column weights"""
+    weights = ', '.join(str(weight) for _, weight in FTS_COLUMNS)
+    return f"bm25({FTS_TABLE}, {weights})"
+
+
+def _indexed_columns(conn):
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({FTS_TABLE})").fetchall()
+    return [row[1] for row in rows]
+
+
+def ensure_search_index():
+    """Create the FTS table and triggers, rebuilding if the column set changed"""
+    global fts_enabled
+
+    if db.engine.dialect.name != 'sqlite':
+        fts_enabled = False
+        return False
+
+    source_table = ResearchPaper.__table__.name
+    expected = [name for name, _ in FTS_COLUMNS]
+
+    try:
+        with db.engine.begin() as conn:
+            existing = _indexed_columns(conn)
+            needs_rebuild = existing != expected
+            if existing and needs_rebuild:
+                conn.exec_driver_sql(f"DROP TABLE {FTS_TABLE}")
+
+            for statement in index_statements(source_table):
+                conn.exec_driver_sql(statement)
+
+            if needs_rebuild:
+                for statement in rebuild_statements(source_table):
+                    conn.exec_driver_sql(statement)
+    except Exception as e:
+        logger.warning(f"Full-text search unavailable, falling back to ILIKE: {str(e)}")
+        fts_enabled = False
+        return False
+
+    fts_enabled = True
+    return True
+
+
+def rebuild_search_index():
+    """Repopulate the FTS table from all existing papers"""
+    if not ensure_search_index():
+        return 0
+
+    source_table = ResearchPaper.__table__.name
+    with db.engine.begin() as conn:
+        for statement in rebuild_statements(source_table):
+            conn.exec_driver_sql(statement)
+        return conn.exec_driver_sql(f"SELECT COUNT(*) FROM {FTS_TABLE}").scalar()
+
+
+def index_paper_body(paper_id, text):
+    """Store a paper's extracted text in the index; the caller commits"""
+    if not fts_enabled:
+        return
+    db.session.execute(
+        db.text(f"UPDATE {FTS_TABLE} SET {BODY_COLUMN} = :body WHERE rowid = :paper_id"),
+        {'body': text, 'paper_id': paper_id}
+    )
+
+
+def build_match_query(search):
+    """Translate user input into a safe FTS5 MATCH expression.
+
+    Bare words are ANDed together, "quoted text" becomes a phrase query and
+    a trailing * turns a word into a prefix query. Any other FTS5 syntax in
+    the input is treated as plain text. Returns None if nothing searchable
+    remains.
+    """
+    terms = []
+    for phrase, word in _QUERY_TOKEN_RE.findall(search):
+        if phrase:
+            words = _WORD_RE.findall(phrase)
+            if words:
+                terms.append('"%s"' % ' '.join(words))
+            continue
+
+        words = _WORD_RE.findall(word)
+        for i, token in enumerate(words):
+            is_last = i == len(words) - 1
+            suffix = '*' if is_last and word.endswith('*') else ''
+            terms.append(f'"{token}"{suffix}')
+
+    if not terms:
+        return None
+    return ' '.join(terms)
+
+
+def apply_search(query, search):
+    """Filter a ResearchPaper query by search text.
+
+    Returns the filtered query and a rank column (lower is better) that can
+    be used for relevance ordering, or None when the ILIKE fallback is used.
+    """
+    match = build_match_query(search) if fts_enabled else None
+
+    if match is None:
+        search_term = f"%{search}%"
+        query = query.filter(
+            (ResearchPaper.title.ilike(search_term)) |
+            (ResearchPaper.abstract.ilike(search_term)) |
+            (ResearchPaper.keywords.ilike(search_term))
+        )
+        return query, None
+
+    matches = db.text(
+        f"SELECT rowid AS paper_id, {rank_expression()} AS rank "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+    ).bindparams(match=match).columns(
+        paper_id=db.Integer, rank=db.Float
+    ).subquery('search_matches')
+
+    query = query.join(matches, matches.c.paper_id == ResearchPaper.id)
+    return query, matches.c.rank
@@ -0,0 +1,131 @@
+"""URL slugs for news articles.
+
+A slug is taken as is when free, otherwise it gets the suffix after the
+highest one in use (`title`, `title-1`, `title-2`, ...). The highest suffix
+of a title, or of each title of a batch, is computed by the database in one
+query. Per title it reads `base` plus the range from `base-1` to `base-:`
+(':' sorts right after '9'), which the slug index answers without scanning
+the table. Slugs in that range whose suffix is not all digits, such as
+`title-2024-review`, are filtered out there too, so no other article's
+slug reaches Python.
+
+A unique index on the slug settles races: two writers that picked the same
+slug cannot both commit. `assign_slug` writes the slug inside a savepoint
+and allocates again when the insert or update hits the index.
+"""
+import logging
+import re
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db
+from src.models.news import NewsArticle
+
+logger = logging.getLogger(__name__)
+
+# Used when a title has no characters that survive slugification
+FALLBACK_SLUG = 'article'
+
+# Allocation attempts when concurrent writers keep taking the slug first
+SLUG_ATTEMPTS = 5
+
+slug_index = db.Index('uq_news_articles_slug', NewsArticle.slug, unique=True)
+
+
+def generate_slug(title):
+    """Generate URL-friendly slug from title"""
+    # Convert to lowercase and replace spaces with hyphens
+    slug = re.sub(r'[^\w\s-]', '', title.lower())
+    slug = re.sub(r'[-\s]+', '-', slug)
+    return slug.strip('-')
+
+
+# Bases per query; each one is a scalar subquery in the SELECT list
+SUFFIX_QUERY_BASES = 500
+
+
+def _digits_only(expr):
+    """SQL condition that a string expression consists of digits only"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return expr.op('~')('^[0-9]+$')
+    return db.not_(expr.op('GLOB')('*[^0-9]*'))
+
+
+def _highest_suffix(base, exclude_id):
+    """Scalar subquery: highest taken suffix of base (0 for base itself), or NULL"""
+    tail = db.func.substr(NewsArticle.slug, len(base) + 2)
+    query = db.select(
+        db.func.max(db.case((NewsArticle.slug == base, 0), else_=db.cast(tail, db.Integer)))
+    ).where(db.or_(
+        NewsArticle.slug == base,
+        # Suffixes never start with 0, so the range starts at '-1'
+        db.and_(NewsArticle.slug >= base + '-1', NewsArticle.slug < base + '-:', _digits_only(tail))
+    ))
+    if exclude_id is not None:
+        query = query.where(NewsArticle.id != exclude_id)
+    return query.scalar_subquery()
+
+
+def _taken_suffixes(bases, exclude_id=None):
+    """Return {base: highest taken suffix} for the bases that are taken"""
+    highest = {}
+    for start in range(0, len(bases), SUFFIX_QUERY_BASES):
+        chunk = bases[start:start + SUFFIX_QUERY_BASES]
+        row = db.session.execute(db.select(*(_highest_suffix(base, exclude_id) for base in chunk))).one()
+        highest.update((base, suffix) for base, suffix in zip(chunk, row) if suffix is not None)
+    return highest
+
+
+def allocate_slugs(titles, exclude_id=None):
+    """Return a unique slug per title, including between titles of the batch.
+
+    Slugs of the article `exclude_id` do not count as taken, so an article
+    being renamed can keep its own slug.
+    """
+    bases = [generate_slug(title) or FALLBACK_SLUG for title in titles]
+    highest = _taken_suffixes(sorted(set(bases)), exclude_id) if bases else {}
+
+    slugs = []
+    for base in bases:
+        suffix = highest.get(base, -1) + 1
+        highest[base] = suffix
+        slugs.append(base if suffix == 0 else f'{base}-{suffix}')
+    return slugs
+
+
+def allocate_slug(title, exclude_id=None):
+    return allocate_slugs([title], exclude_id)[0]
+
+
+def assign_slug(article, title):
+    """Give a new or renamed article a free slug and flush it; the caller commits"""
+    for attempt in range(SLUG_ATTEMPTS):
+        slug = allocate_slug(title, exclude_id=article.id)
+        try:
+            with db.session.begin_nested():
+                article.slug = slug
+                db.session.add(article)
+                db.session.flush()
+            return slug
+        except IntegrityError:
+            # Another writer committed the same slug since we read the index
+            if attempt == SLUG_ATTEMPTS - 1:
+                raise
+
+
+def ensure_slug_index():
+    """Create the unique slug index, first renaming duplicate slugs if any"""
+    try:
+        duplicates = db.session.query(NewsArticle.slug).group_by(NewsArticle.slug).having(
+            db.func.count() > 1
+        ).filter(NewsArticle.slug.isnot(None)).all()
+        for (slug,) in duplicates:
+            articles = NewsArticle.query.filter_by(slug=slug).order_by(NewsArticle.id).all()
+            for article in articles[1:]:
+                article.slug = allocate_slug(article.title)
+                db.session.flush()
+            logger.warning(f"Renamed {len(articles) - 1} duplicates of news slug {slug}")
+        db.session.commit()
+
+        slug_index.create(db.engine, checkfirst=True)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Could not create the unique news slug index: {str(e)}")
@@ -0,0 +1,151 @@
+"""Materialized statistics for research papers and news articles.
+
+`content_stats` holds one row per (kind, status, category) with the item
+count and the summed view/download counters. Write paths adjust the counts
+in the same transaction that changes an item's status or category, so the
+stats endpoints read a handful of precomputed rows instead of scanning the
+content tables.
+
+View and download sums change through the buffered counters, so they are
+refreshed (and any drift in the counts corrected) by a periodic
+reconciliation that recomputes everything with one GROUP BY per table.
+"""
+import logging
+from collections import defaultdict
+from src.models.user import db
+from src.models.research import ResearchPaper
+from src.models.news import NewsArticle
+from src.jobs import start_job
+from src.dbutil import insert_ignore, lock_table
+
+logger = logging.getLogger(__name__)
+
+RESEARCH = 'research'
+NEWS = 'news'
+
+
+class ContentStat(db.Model):
+    __tablename__ = 'content_stats'
+
+    kind = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(30), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+
+
+def _key(value):
+    return getattr(value, 'value', value)
+
+
+def adjust_stats(kind, status, category, delta):
+    """Add delta to the item count of one bucket; the caller commits"""
+    if not delta:
+        return
+
+    status, category = _key(status), _key(category)
+    # Create a missing bucket first, so concurrent first writes cannot collide
+    db.session.execute(insert_ignore(ContentStat.__table__).values(
+        kind=kind, status=status, category=category, item_count=0, views=0, downloads=0
+    ))
+    db.session.execute(
+        db.update(ContentStat).where(
+            ContentStat.kind == kind,
+            ContentStat.status == status,
+            ContentStat.category == category
+        ).values(item_count=ContentStat.item_count + delta)
+    )
+
+
+def move_stats(kind, old_status, old_category, new_status, new_category):
+    """Move one item between buckets after a status or category change"""
+    if _key(old_status) == _key(new_status) and _key(old_category) == _key(new_category):
+        return
+    adjust_stats(kind, old_status, old_category, -1)
+    adjust_stats(kind, new_status, new_category, 1)
+
+
+def apply_moves(kind, moves):
+    """Apply (old_status, old_category, new_status, new_category) moves in bulk,
+    with two statements per affected bucket"""
+    deltas = defaultdict(int)
+    for old_status, old_category, new_status, new_category in moves:
+        deltas[(_key(old_status), _key(old_category))] -= 1
+        deltas[(_key(new_status), _key(new_category))] += 1
+
+    for (status, category), delta in deltas.items():
+        adjust_stats(kind, status, category, delta)
+
+
+def _aggregate(kind):
+    if kind == RESEARCH:
+        model, downloads = ResearchPaper, db.func.sum(ResearchPaper.downloads)
+    else:
+        model, downloads = NewsArticle, db.literal(0)
+
+    rows = db.session.query(
+        model.status,
+        model.category,
+        db.func.count(model.id),
+        db.func.coalesce(db.func.sum(model.views), 0),
+        db.func.coalesce(downloads, 0)
+    ).group_by(model.status, model.category).all()
+
+    return {
+        (_key(status), _key(category)): (count, views, downloads)
+        for status, category, count, views, downloads in rows
+    }
+
+
+def reconcile_stats():
+    """Recompute all stats rows from the content tables.
+
+    The stats table stays locked from before the content tables are read
+    until the commit. Writers that changed an item in the meantime apply
+    their adjust_stats() delta on top of the recomputed count afterwards.
+    """
+    lock_table(ContentStat.__table__)
+    drifted = 0
+    for kind in (RESEARCH, NEWS):
+        actual = _aggregate(kind)
+        stored = {
+            (row.status, row.category): row
+            for row in ContentStat.query.filter_by(kind=kind).all()
+        }
+
+        for key, (count, views, downloads) in actual.items():
+            row = stored.pop(key, None)
+            if row is None:
+                row = ContentStat(kind=kind, status=key[0], category=key[1])
+                db.session.add(row)
+            elif row.item_count != count:
+                drifted += 1
+            row.item_count, row.views, row.downloads = count, views, downloads
+
+        for row in stored.values():
+            if row.item_count:
+                drifted += 1
+            db.session.delete(row)
+
+    db.session.commit()
+    if drifted:
+        logger.warning(f"Stats reconciliation corrected {drifted} drifted counts")
+    return drifted
+
+
+def get_stats(kind):
+    """Return {(status, category): (count, views, downloads)} for a kind"""
+    # Empty until the startup seed or the reconcile job has run
+    rows = ContentStat.query.filter_by(kind=kind).all()
+    return {
+        (row.status, row.category): (row.item_count, row.views, row.downloads)
+        for row in rows
+    }
+
+
+def init_app(app):
+    start_job(
+        app, 'stats-reconcile', app.config.get('STATS_RECONCILE_INTERVAL', 300),
+        reconcile_stats
+    )
@@ -0,0 +1,169 @@
+"""Content-addressed storage for uploaded research papers.
+
+Uploads are streamed to a temporary file in chunks while their SHA-256 is
+computed, then moved to `<root>/ab/cd/<sha256>.<ext>`. Identical files are
+stored once and reference counted in `stored_files`; `research_paper_files`
+records which blob each paper points to.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from src.models.user import db
+from src.dbutil import insert_ignore
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_files'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(500), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'sha256': self.sha256,
+            'size': self.size,
+            'ref_count': self.ref_count,
+        }
+
+
+research_paper_files = db.Table(
+    'research_paper_files',
+    db.Column('paper_id', db.Integer, db.ForeignKey('research_papers.id'), primary_key=True),
+    db.Column('sha256', db.String(64), db.ForeignKey('stored_files.sha256'), nullable=False, index=True),
+)
+
+
+def shard_path(root, sha256, ext):
+    """Return the sharded location of a blob, e.g. root/ab/cd/abcd....pdf"""
+    return os.path.join(root, sha256[:2], sha256[2:4], f'{sha256}.{ext}')
+
+
+def _hash_to_temp(stream, root):
+    """Copy a stream into a temp file under root, returning (path, sha256, size)"""
+    tmp_dir = os.path.join(root, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return tmp_path, digest.hexdigest(), size
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src_path, dst_path):
+    """Hard-link src_path to dst_path, copying when the filesystem can't link"""
+    try:
+        os.link(src_path, dst_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path), suffix='.part')
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dst_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+def _place(src_path, sha256, size, root, ext, keep_source=False):
+    """Put src_path's content into the store and take one reference to it.
+
+    The source is moved into place, or dropped when the blob already exists.
+    With keep_source it is linked or copied instead and left where it is,
+    so nothing is lost if the caller's transaction fails.
+    """
+    final_path = shard_path(root, sha256, ext)
+
+    # Concurrent first uploads of the same content both get past this
+    db.session.execute(insert_ignore(StoredFile.__table__).values(
+        sha256=sha256, path=final_path, size=size, ref_count=0, created_at=datetime.utcnow()
+    ))
+    db.session.execute(
+        StoredFile.__table__.update()
+        .where(StoredFile.sha256 == sha256)
+        .values(ref_count=StoredFile.ref_count + 1)
+    )
+    stored = db.session.get(StoredFile, sha256, populate_existing=True)
+
+    if os.path.abspath(src_path) == os.path.abspath(final_path):
+        pass  # already stored at its content address
+    elif not os.path.exists(stored.path) and not os.path.exists(final_path):
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if keep_source:
+            _link_or_copy(src_path, final_path)
+        else:
+            os.replace(src_path, final_path)
+    elif not keep_source:
+        # Duplicate content, or a blob left on disk by a failed commit
+        os.remove(src_path)
+
+    if not os.path.exists(stored.path):
+        stored.path = final_path
+        db.session.flush()
+    return stored
+
+
+def store_upload(stream, root, ext='pdf'):
+    """Stream an upload into the store; the caller commits the session"""
+    tmp_path, sha256, size = _hash_to_temp(stream, root)
+    try:
+        return _place(tmp_path, sha256, size, root, ext)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_existing_file(path, root):
+    """Link or copy an existing file into the store, leaving the original.
+
+    The caller commits the session and only then deletes the original.
+    """
+    ext = path.rsplit('.', 1)[1].lower() if '.' in os.path.basename(path) else 'bin'
+    return _place(path, _hash_file(path), os.path.getsize(path), root, ext, keep_source=True)
+
+
+def attach_paper_file(paper_id, sha256):
+    """Record which stored blob a paper's file is"""
+    db.session.execute(research_paper_files.insert().values(
+        paper_id=paper_id, sha256=sha256
+    ))
+
+
+def get_paper_file_hash(paper_id):
+    """Return the SHA-256 of a paper's file, or None for legacy uploads"""
+    return db.session.execute(
+        db.select(research_paper_files.c.sha256).where(
+            research_paper_files.c.paper_id == paper_id
+        )
+    ).scalar()
+
@@ -0,0 +1,275 @@
+"""Precomputed RSS, Atom and JSON Feed documents for news and research.
+
+Feeds are rendered when their content changes (an article is published,
+unpublished or edited, a paper is approved or leaves the approved state)
+and stored as bytes in `feed_documents` with their ETag and modification
+time. Serving a feed is then one primary-key read, and pollers that send
+If-None-Match or If-Modified-Since get 304 Not Modified. Missing feeds are
+rendered once at startup by `ensure_feeds()`, never on a request.
+
+Every kind has an overall feed plus one feed per category, each in three
+formats: `news.xml` (RSS 2.0), `news.atom` and `news.json` (JSON Feed 1.1),
+and `news/race.xml` and so on for the categories.
+
+Feeds are refreshed inside the transaction of the change. The refresh
+first touches the feed rows it is about to replace, so a concurrent
+refresh waits for it and then renders from the newer data instead of
+overwriting it with an older snapshot.
+"""
+import hashlib
+import json
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from flask import current_app
+from src.models.user import db
+from src.models.news import NewsArticle, NewsCategory, NewsStatus
+from src.models.research import ResearchPaper, ResearchCategory, ResearchStatus
+from src.stats import NEWS, RESEARCH
+from src.dbutil import insert_ignore
+
+FORMATS = {
+    'xml': 'application/rss+xml',
+    'atom': 'application/atom+xml',
+    'json': 'application/feed+json',
+}
+
+feed_documents = db.Table(
+    'feed_documents',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('content_type', db.String(50), nullable=False),
+    db.Column('body', db.LargeBinary, nullable=False),
+    db.Column('etag', db.String(40), nullable=False),
+    db.Column('item_count', db.Integer, nullable=False, default=0),
+    db.Column('updated_at', db.DateTime, nullable=False),
+)
+
+
+class FeedSource:
+    """How to list and describe the items of one kind of feed"""
+
+    def __init__(self, kind, title, description, model, categories, published, page):
+        self.kind = kind
+        self.title = title
+        self.description = description
+        self.model = model
+        self.categories = categories
+        self.published = published
+        self.page = page
+
+    def items(self, category, limit):
+        query = self.model.query.filter(self.published())
+        if category is not None:
+            query = query.filter(self.model.category == category)
+        return query.options(db.selectinload(self.model.author)).order_by(
+            self.model.published_at.desc(), self.model.id.desc()
+        ).limit(limit).all()
+
+
+SOURCES = {
+    NEWS: FeedSource(
+        NEWS, 'H2PETRONS News', 'Latest news from the H2PETRONS community',
+        NewsArticle, NewsCategory, lambda: NewsArticle.status == NewsStatus.PUBLISHED,
+        lambda item: f'news.html?slug={item.slug}'
+    ),
+    RESEARCH: FeedSource(
+        RESEARCH, 'H2PETRONS Research', 'Newly approved research papers',
+        ResearchPaper, ResearchCategory, lambda: ResearchPaper.status == ResearchStatus.APPROVED,
+        lambda item: f'research.html?paper={item.id}'
+    ),
+}
+
+
+def feed_name(kind, category=None, fmt='xml'):
+    base = kind if category is None else f'{kind}/{category.value}'
+    return f'{base}.{fmt}'
+
+
+def _entry(source, item, site_url):
+    if source.kind == NEWS:
+        summary = item.excerpt or ''
+    else:
+        summary = item.abstract or ''
+    if len(summary) > 500:
+        summary = summary[:497].rstrip() + '...'
+
+    return {
+        'id': f'{site_url}/{source.kind}/{item.id}',
+        'url': f'{site_url}/{source.page(item)}',
+        'title': item.title,
+        'summary': summary,
+        'category': item.category.value,
+        'author': item.author.username if item.author else None,
+        'published': (item.published_at or item.created_at).replace(tzinfo=timezone.utc),
+        'updated': (item.updated_at or item.published_at or item.created_at).replace(tzinfo=timezone.utc),
+    }
+
+
+def _title(source, category):
+    if category is None:
+        return source.title
+    return f"{source.title}: {category.value.replace('_', ' ').title()}"
+
+
+def _last_updated(entries, now):
+    # Derived from the items so that an unchanged feed renders to the same bytes
+    return max([entry['updated'] for entry in entries], default=now)
+
+
+def render_rss(source, category, entries, site_url, self_url, now):
+    rss = ET.Element('rss', {'version': '2.0', 'xmlns:atom': 'http://www.w3.org/2005/Atom'})
+    channel = ET.SubElement(rss, 'channel')
+    ET.SubElement(channel, 'title').text = _title(source, category)
+    ET.SubElement(channel, 'link').text = site_url + '/'
+    ET.SubElement(channel, 'description').text = source.description
+    ET.SubElement(channel, 'lastBuildDate').text = format_datetime(_last_updated(entries, now))
+    ET.SubElement(channel, 'atom:link', {'href': self_url, 'rel': 'self', 'type': FORMATS['xml']})
+
+    for entry in entries:
+        item = ET.SubElement(channel, 'item')
+        ET.SubElement(item, 'title').text = entry['title']
+        ET.SubElement(item, 'link').text = entry['url']
+        ET.SubElement(item, 'guid', {'isPermaLink': 'false'}).text = entry['id']
+        ET.SubElement(item, 'description').text = entry['summary']
+        ET.SubElement(item, 'category').text = entry['category']
+        ET.SubElement(item, 'pubDate').text = format_datetime(entry['published'])
+
+    return ET.tostring(rss, encoding='utf-8', xml_declaration=True)
+
+
+def render_atom(source, category, entries, site_url, self_url, now):
+    feed = ET.Element('feed', {'xmlns': 'http://www.w3.org/2005/Atom'})
+    ET.SubElement(feed, 'id').text = self_url
+    ET.SubElement(feed, 'title').text = _title(source, category)
+    ET.SubElement(feed, 'subtitle').text = source.description
+    ET.SubElement(feed, 'updated').text = _last_updated(entries, now).isoformat()
+    ET.SubElement(feed, 'link', {'href': site_url + '/'})
+    ET.SubElement(feed, 'link', {'href': self_url, 'rel': 'self'})
+
+    for entry in entries:
+        node = ET.SubElement(feed, 'entry')
+        ET.SubElement(node, 'id').text = entry['id']
+        ET.SubElement(node, 'title').text = entry['title']
+        ET.SubElement(node, 'link', {'href': entry['url']})
+        ET.SubElement(node, 'published').text = entry['published'].isoformat()
+        ET.SubElement(node, 'updated').text = entry['updated'].isoformat()
+        ET.SubElement(node, 'summary').text = entry['summary']
+        ET.SubElement(node, 'category', {'term': entry['category']})
+        author = ET.SubElement(node, 'author')
+        ET.SubElement(author, 'name').text = entry['author'] or 'H2PETRONS'
+
+    return ET.tostring(feed, encoding='utf-8', xml_declaration=True)
+
+
+def render_json(source, category, entries, site_url, self_url, now):
+    feed = {
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': _title(source, category),
+        'home_page_url': site_url + '/',
+        'feed_url': self_url,
+        'description': source.description,
+        'items': [
+            {
+                'id': entry['id'],
+                'url': entry['url'],
+                'title': entry['title'],
+                'summary': entry['summary'],
+                'date_published': entry['published'].isoformat(),
+                'date_modified': entry['updated'].isoformat(),
+                'tags': [entry['category']],
+                'authors': [{'name': entry['author']}] if entry['author'] else [],
+            }
+            for entry in entries
+        ],
+    }
+    return json.dumps(feed, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+RENDERERS = {
+    'xml': render_rss,
+    'atom': render_atom,
+    'json': render_json,
+}
+
+
+def _feeds_for(kind, categories):
+    """(category, name) of the overall feed plus the given category feeds"""
+    feeds = [None] + sorted(set(categories), key=lambda category: category.value)
+    return [(category, feed_name(kind, category, fmt)) for category in feeds for fmt in FORMATS]
+
+
+def refresh_feeds(kind, categories=(), now=None):
+    """Re-render the overall feed and the given category feeds; the caller commits"""
+    source = SOURCES[kind]
+    now = now or datetime.utcnow()
+    site_url = current_app.config.get('SITE_URL', '').rstrip('/')
+    feeds_url = site_url + current_app.config.get('FEEDS_URL_PREFIX', '/feeds')
+    limit = current_app.config.get('FEED_ITEM_LIMIT', 50)
+    feeds = _feeds_for(kind, categories)
+
+    # Take the row locks first so concurrent refreshes render in commit order
+    db.session.execute(
+        feed_documents.update()
+        .where(feed_documents.c.name.in_([name for _, name in feeds]))
+        .values(updated_at=feed_documents.c.updated_at)
+    )
+
+    rendered = {}
+    for category, name in feeds:
+        if category not in rendered:
+            entries = [_entry(source, item, site_url) for item in source.items(category, limit)]
+            rendered[category] = entries
+        entries = rendered[category]
+
+        fmt = name.rsplit('.', 1)[1]
+        body = RENDERERS[fmt](
+            source, category, entries, site_url, f'{feeds_url}/{name}',
+            now.replace(tzinfo=timezone.utc)
+        )
+        _store(name, FORMATS[fmt], body, len(entries), now)
+
+
+def _store(name, content_type, body, item_count, now):
+    etag = hashlib.sha1(body).hexdigest()
+    current = db.session.execute(
+        db.select(feed_documents.c.etag).where(feed_documents.c.name == name)
+    ).scalar()
+    if current == etag:
+        return  # unchanged, keep the old Last-Modified
+
+    values = {
+        'content_type': content_type,
+        'body': body,
+        'etag': etag,
+        'item_count': item_count,
+        'updated_at': now.replace(microsecond=0),
+    }
+    if current is None:
+        # A concurrent first render of the same feed may insert it first
+        inserted = db.session.execute(insert_ignore(feed_documents).values(name=name, **values)).rowcount
+        if inserted:
+            return
+    db.session.execute(feed_documents.update().where(feed_documents.c.name == name).values(**values))
+
+
+def get_feed(name):
+    """Return a stored feed row, or None"""
+    return db.session.execute(db.select(feed_documents).where(feed_documents.c.name == name)).first()
+
+
+def ensure_feeds():
+    """Render the feeds of every kind that has feeds missing; the caller commits.
+
+    Run at startup, so serving a feed never has to render or write.
+    """
+    stored = set(db.session.execute(db.select(feed_documents.c.name)).scalars())
+    for kind, source in SOURCES.items():
+        categories = list(source.categories)
+        if any(name not in stored for _, name in _feeds_for(kind, categories)):
+            refresh_feeds(kind, categories)
+
+
+def rebuild_feeds():
+    """Re-render every feed of every kind; the caller commits"""
+    for kind, source in SOURCES.items():
+        refresh_feeds(kind, list(source.categories))
@@ -0,0 +1,165 @@
+"""Normalized tags for news articles.
+
+`NewsArticle.tags` stays the comma-separated string editors type, but each
+tag is also a row in `news_tags` linked to its articles through
+`news_article_tags`, so `/news?tag=` is an indexed join instead of a LIKE
+scan. `news_tags.article_count` counts the *published* articles per tag and
+is adjusted in the same transaction as every change that affects it: tag
+edits of published articles, publish and unpublish. `/news/tags` reads the
+facet counts straight from it.
+"""
+import re
+from collections import Counter
+from src.models.user import db
+from src.models.news import NewsArticle, NewsStatus
+from src.dbutil import insert_ignore
+
+MAX_TAG_LENGTH = 50
+
+news_tags = db.Table(
+    'news_tags',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(MAX_TAG_LENGTH), nullable=False, unique=True),
+    db.Column('article_count', db.Integer, nullable=False, default=0, index=True),
+)
+
+news_article_tags = db.Table(
+    'news_article_tags',
+    db.Column('article_id', db.Integer, db.ForeignKey('news_articles.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('news_tags.id'), primary_key=True, index=True),
+)
+
+
+def normalize_tag(name):
+    return re.sub(r'\s+', ' ', str(name)).strip().lower()[:MAX_TAG_LENGTH]
+
+
+def parse_tags(text):
+    """Split a comma-separated tag string into unique normalized names"""
+    names = (normalize_tag(part) for part in (text or '').split(','))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def _tag_ids(names):
+    """Return {name: id}, creating the tags that do not exist yet"""
+    if not names:
+        return {}
+    db.session.execute(insert_ignore(news_tags), [{'name': name, 'article_count': 0} for name in names])
+    rows = db.session.execute(
+        db.select(news_tags.c.name, news_tags.c.id).where(news_tags.c.name.in_(names))
+    )
+    return dict(rows.all())
+
+
+def _adjust_counts(deltas):
+    """Apply {tag_id: delta} to the published-article counts"""
+    by_delta = {}
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        db.session.execute(
+            news_tags.update().where(news_tags.c.id.in_(tag_ids)).values(
+                article_count=news_tags.c.article_count + delta
+            )
+        )
+
+
+def set_article_tags(article_id, text, published):
+    """Replace an article's tag links from its tag string; the caller commits"""
+    set_tags_bulk({article_id: text}, {article_id} if published else ())
+
+
+def set_tags_bulk(texts, published_ids=()):
+    """Replace the tag links of many articles at once; the caller commits.
+
+    `texts` maps article ids to tag strings, and `published_ids` names the
+    articles that count towards the facet counts.
+    """
+    if not texts:
+        return
+    wanted = {article_id: parse_tags(text) for article_id, text in texts.items()}
+    tag_ids = _tag_ids(sorted({name for names in wanted.values() for name in names}))
+
+    current = {}
+    rows = db.session.execute(
+        db.select(news_article_tags.c.article_id, news_article_tags.c.tag_id)
+        .where(news_article_tags.c.article_id.in_(list(texts)))
+    )
+    for article_id, tag_id in rows:
+        current.setdefault(article_id, set()).add(tag_id)
+
+    added, removed = [], []
+    deltas = Counter()
+    for article_id, names in wanted.items():
+        new = {tag_ids[name] for name in names}
+        old = current.get(article_id, set())
+        added.extend({'article_id': article_id, 'tag_id': tag_id} for tag_id in new - old)
+        removed.extend((article_id, tag_id) for tag_id in old - new)
+        if article_id in published_ids:
+            deltas.update({tag_id: 1 for tag_id in new - old})
+            deltas.update({tag_id: -1 for tag_id in old - new})
+
+    if removed:
+        db.session.execute(news_article_tags.delete().where(
+            news_article_tags.c.article_id == db.bindparam('old_article_id'),
+            news_article_tags.c.tag_id == db.bindparam('old_tag_id')
+        ), [{'old_article_id': article_id, 'old_tag_id': tag_id} for article_id, tag_id in removed])
+    if added:
+        db.session.execute(news_article_tags.insert(), added)
+    _adjust_counts(deltas)
+
+
+def count_published(article_ids, delta):
+    """Add delta to the counts of every tag on these articles, e.g. on publish"""
+    if not article_ids:
+        return
+    rows = db.session.execute(
+        db.select(news_article_tags.c.tag_id, db.func.count())
+        .where(news_article_tags.c.article_id.in_(list(article_ids)))
+        .group_by(news_article_tags.c.tag_id)
+    )
+    _adjust_counts({tag_id: delta * count for tag_id, count in rows})
+
+
+def tag_filter(name):
+    """Condition for articles carrying the tag"""
+    return NewsArticle.id.in_(
+        db.select(news_article_tags.c.article_id)
+        .join(news_tags, news_tags.c.id == news_article_tags.c.tag_id)
+        .where(news_tags.c.name == normalize_tag(name))
+    )
+
+
+def get_tag_facets(limit=50, prefix=None):
+    """Return [(name, published article count)], most used first"""
+    query = db.select(news_tags.c.name, news_tags.c.article_count).where(news_tags.c.article_count > 0)
+    if prefix:
+        query = query.where(news_tags.c.name.startswith(normalize_tag(prefix), autoescape=True))
+    query = query.order_by(news_tags.c.article_count.desc(), news_tags.c.name).limit(limit)
+    return db.session.execute(query).all()
+
+
+def rebuild_tags():
+    """Rebuild links and counts from every article's tag string; the caller commits"""
+    db.session.execute(news_article_tags.delete())
+    db.session.execute(news_tags.update().values(article_count=0))
+
+    total, last_id = 0, 0
+    while True:
+        articles = db.session.query(NewsArticle.id, NewsArticle.tags, NewsArticle.status).filter(
+            NewsArticle.id > last_id
+        ).order_by(NewsArticle.id).limit(1000).all()
+        if not articles:
+            break
+        set_tags_bulk(
+            {article.id: article.tags for article in articles},
+            {article.id for article in articles if article.status == NewsStatus.PUBLISHED}
+        )
+        total += len(articles)
+        last_id = articles[-1].id
+
+    db.session.execute(news_tags.delete().where(
+        ~db.exists().where(news_article_tags.c.tag_id == news_tags.c.id)
+    ))
+    return total
@@ -0,0 +1,130 @@
+"""Time-decayed trending scores for research papers.
+
+`research_trending` keeps one indexed score per approved paper. A periodic
+job decays every score by 0.5 ** (elapsed / TRENDING_HALF_LIFE_HOURS) and
+adds the weighted views, downloads and likes gained since the previous run,
+which it derives from the counters remembered in `last_*`. Recent activity
+therefore outweighs old activity, and `sort_by=trending` reads the score
+index instead of computing an ORDER BY expression.
+
+A paper has a row exactly while it is approved: reviews add and remove
+rows in the same transaction, so the listing can drive the query from the
+score index without filtering on the papers table.
+
+Every run stamps the rows it updated with its `computed_at`, and the next
+run only updates rows stamped no later than the newest stamp it read. When
+several app processes run the job at the same moment, only one of them
+applies the decay. Rows added by reviews carry the NEW_ROW stamp, which
+every run includes, however its transaction interleaves with theirs.
+"""
+from datetime import datetime
+from src.models.user import db
+from src.models.research import ResearchPaper, ResearchStatus
+from src.jobs import start_job
+from src.dbutil import insert_ignore
+
+DEFAULT_WEIGHTS = {'views': 1.0, 'downloads': 3.0, 'likes': 5.0}
+
+# computed_at of rows not yet seen by a recompute; older than any real run
+NEW_ROW = datetime(1970, 1, 1)
+
+research_trending = db.Table(
+    'research_trending',
+    db.Column('paper_id', db.Integer, db.ForeignKey('research_papers.id'), primary_key=True),
+    db.Column('score', db.Float, nullable=False, default=0, index=True),
+    db.Column('last_views', db.Integer, nullable=False, default=0),
+    db.Column('last_downloads', db.Integer, nullable=False, default=0),
+    db.Column('last_likes', db.Integer, nullable=False, default=0),
+    db.Column('computed_at', db.DateTime, nullable=False),
+)
+
+
+def recompute_trending(half_life_hours=24, weights=None, now=None):
+    """Decay all scores and add the activity since the last run"""
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    now = now or datetime.utcnow()
+    t = research_trending
+
+    last_run = db.session.execute(db.select(db.func.max(t.c.computed_at))).scalar()
+    if last_run is not None:
+        elapsed_hours = max((now - last_run).total_seconds(), 0) / 3600
+        decay = 0.5 ** (elapsed_hours / half_life_hours)
+
+        def current(column):
+            return db.select(column).where(ResearchPaper.id == t.c.paper_id).scalar_subquery()
+
+        views = current(db.func.coalesce(ResearchPaper.views, 0))
+        downloads = current(db.func.coalesce(ResearchPaper.downloads, 0))
+        likes = current(db.func.coalesce(ResearchPaper.likes, 0))
+
+        result = db.session.execute(
+            t.update().where(t.c.computed_at <= last_run).values(
+                score=t.c.score * decay
+                + weights['views'] * (views - t.c.last_views)
+                + weights['downloads'] * (downloads - t.c.last_downloads)
+                + weights['likes'] * (likes - t.c.last_likes),
+                last_views=views,
+                last_downloads=downloads,
+                last_likes=likes,
+                computed_at=now
+            )
+        )
+        if result.rowcount == 0:
+            db.session.rollback()
+            return 0  # another process ran the job first
+        updated = result.rowcount
+    else:
+        updated = 0
+
+    # Safety net for papers whose status changed outside the review endpoints
+    _insert_rows(
+        ResearchPaper.status == ResearchStatus.APPROVED,
+        ~db.exists().where(t.c.paper_id == ResearchPaper.id),
+        computed_at=now
+    )
+    db.session.execute(t.delete().where(
+        ~db.exists().where(
+            ResearchPaper.id == t.c.paper_id,
+            ResearchPaper.status == ResearchStatus.APPROVED
+        )
+    ))
+
+    db.session.commit()
+    return updated
+
+
+def _insert_rows(*conditions, computed_at):
+    """Add zero-score rows that start counting from the current counters"""
+    rows = db.select(
+        ResearchPaper.id, db.literal(0.0),
+        db.func.coalesce(ResearchPaper.views, 0),
+        db.func.coalesce(ResearchPaper.downloads, 0),
+        db.func.coalesce(ResearchPaper.likes, 0),
+        db.literal(computed_at, db.DateTime)
+    ).where(*conditions)
+    db.session.execute(insert_ignore(research_trending).from_select(
+        ['paper_id', 'score', 'last_views', 'last_downloads', 'last_likes', 'computed_at'], rows
+    ))
+
+
+def add_trending_papers(paper_ids):
+    """Start tracking newly approved papers; the caller commits"""
+    if not paper_ids:
+        return
+    _insert_rows(ResearchPaper.id.in_(paper_ids), computed_at=NEW_ROW)
+
+
+def remove_trending_papers(paper_ids):
+    """Stop tracking papers that are no longer approved; the caller commits"""
+    if paper_ids:
+        db.session.execute(research_trending.delete().where(research_trending.c.paper_id.in_(paper_ids)))
+
+
+def init_app(app):
+    def run():
+        recompute_trending(
+            app.config.get('TRENDING_HALF_LIFE_HOURS', 24),
+            app.config.get('TRENDING_WEIGHTS')
+        )
+
+    start_job(app, 'trending', app.config.get('TRENDING_INTERVAL', 300), run)
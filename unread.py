@@ -0,0 +1,121 @@
+"""Per-user unread state of forum topics.
+
+Storage is one watermark per topic a user has read: `forum_read_marks`
+holds the id of the newest post they have seen there. On top of that,
+"mark all read" for a category stores one timestamp in
+`forum_category_reads` and deletes the user's watermarks in that category,
+which the timestamp makes redundant.
+
+For a user, a post is unread when its id is above the topic's watermark
+and it was created after the category's read timestamp. A topic never
+opened and created after that timestamp is unread even without replies.
+Creating a topic or replying moves the author's own watermark, so users
+never see their own writing as unread.
+`unread_counts()` evaluates this for a whole page of topics in one grouped
+query.
+"""
+import logging
+from datetime import datetime
+from src.models.user import db
+from src.models.community import ForumPost, ForumTopic
+from src.dbutil import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+forum_read_marks = db.Table(
+    'forum_read_marks',
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('topic_id', db.Integer, db.ForeignKey('forum_topics.id'), primary_key=True),
+    db.Column('last_read_post_id', db.Integer, nullable=False, default=0),
+    db.Column('updated_at', db.DateTime, nullable=False, default=datetime.utcnow),
+)
+
+forum_category_reads = db.Table(
+    'forum_category_reads',
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('category_id', db.Integer, db.ForeignKey('forum_categories.id'), primary_key=True),
+    db.Column('read_at', db.DateTime, nullable=False),
+)
+
+# Unread counts scan a topic's posts from the watermark on
+topic_post_index = db.Index('ix_forum_posts_topic_post', ForumPost.topic_id, ForumPost.id)
+
+
+def unread_counts(user_id, topic_ids):
+    """Return {topic_id: (unread post count, has_unread)} for the user"""
+    if not topic_ids:
+        return {}
+    topics, posts = ForumTopic.__table__, ForumPost.__table__
+    marks, reads = forum_read_marks, forum_category_reads
+
+    watermark = db.func.coalesce(marks.c.last_read_post_id, 0)
+    query = db.select(
+        topics.c.id,
+        db.func.count(posts.c.id),
+        db.and_(
+            marks.c.user_id.is_(None),
+            db.or_(reads.c.read_at.is_(None), topics.c.created_at > reads.c.read_at)
+        )
+    ).select_from(
+        topics
+        .outerjoin(marks, db.and_(marks.c.topic_id == topics.c.id, marks.c.user_id == user_id))
+        .outerjoin(reads, db.and_(reads.c.category_id == topics.c.category_id, reads.c.user_id == user_id))
+        .outerjoin(posts, db.and_(
+            posts.c.topic_id == topics.c.id,
+            posts.c.id > watermark,
+            db.or_(reads.c.read_at.is_(None), posts.c.created_at > reads.c.read_at)
+        ))
+    ).where(topics.c.id.in_(list(topic_ids))).group_by(
+        topics.c.id, marks.c.user_id, reads.c.read_at, topics.c.created_at
+    )
+
+    return {
+        topic_id: (count, bool(count) or bool(never_opened))
+        for topic_id, count, never_opened in db.session.execute(query)
+    }
+
+
+def mark_topic_read(user_id, topic_id, post_id):
+    """Move the user's watermark up to post_id; it never moves back. The caller commits"""
+    marks = forum_read_marks
+
+    def advance():
+        return db.session.execute(
+            marks.update()
+            .where(marks.c.user_id == user_id, marks.c.topic_id == topic_id, marks.c.last_read_post_id < post_id)
+            .values(last_read_post_id=post_id, updated_at=datetime.utcnow())
+        ).rowcount
+
+    if advance():
+        return
+    inserted = db.session.execute(insert_ignore(marks).values(
+        user_id=user_id, topic_id=topic_id, last_read_post_id=post_id, updated_at=datetime.utcnow()
+    )).rowcount
+    if not inserted:
+        # Either already at or past post_id, or a concurrent request inserted a lower mark
+        advance()
+
+
+def mark_category_read(user_id, category_id):
+    """Mark every topic of a category read as of now; the caller commits"""
+    read_at = datetime.utcnow()
+    reads = forum_category_reads
+    updated = db.session.execute(
+        reads.update().where(reads.c.user_id == user_id, reads.c.category_id == category_id).values(read_at=read_at)
+    ).rowcount
+    if not updated:
+        db.session.execute(insert_ignore(reads).values(user_id=user_id, category_id=category_id, read_at=read_at))
+
+    # The timestamp covers every post these watermarks did
+    db.session.execute(forum_read_marks.delete().where(
+        forum_read_marks.c.user_id == user_id,
+        forum_read_marks.c.topic_id.in_(db.select(ForumTopic.id).where(ForumTopic.category_id == category_id))
+    ))
+
+
+def ensure_read_index():
+    """Create the (topic_id, id) index on forum_posts on existing databases"""
+    try:
+        topic_post_index.create(db.engine, checkfirst=True)
+    except Exception as e:
+        logger.error(f"Could not create the forum post index: {str(e)}")
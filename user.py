@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import User, UserRole, db
+from src.pagination import paginate, InvalidCursor
 from datetime import datetime
 
 user_bp = Blueprint('user', __name__)
@@ -9,28 +10,16 @@ user_bp = Blueprint('user', __name__)
 def get_users():
     """Get all users (public information only)"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        # Limit per_page to prevent abuse
-        per_page = min(per_page, 100)
-        
-        users = User.query.filter_by(is_active=True).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        query = User.query.filter_by(is_active=True)
+        users, pagination = paginate(query, [(User.id, False)], 'users')
         
         return jsonify({
-            'users': [user.to_public_dict() for user in users.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': users.total,
-                'pages': users.pages,
-                'has_next': users.has_next,
-                'has_prev': users.has_prev
-            }
+            'users': [user.to_public_dict() for user in users],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         current_app.logger.error(f"Get users error: {str(e)}")
         return jsonify({'error': 'Failed to retrieve users'}), 500
@@ -0,0 +1,84 @@
+"""Field validation shared by the create endpoints and the bulk importers"""
+from datetime import datetime, timezone
+from src.models.news import NewsCategory
+from src.models.research import ResearchCategory
+
+
+class ValidationError(ValueError):
+    """Raised with the message the client should see"""
+
+
+def parse_utc(value):
+    """Parse an ISO 8601 timestamp into naive UTC; naive input is taken as UTC"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _text(data, field):
+    value = data.get(field)
+    return '' if value is None else str(value).strip()
+
+
+def validate_news_article(data):
+    """Check a new article's fields; returns them cleaned, category as enum"""
+    # Validate required fields
+    for field in ('title', 'content', 'category'):
+        if not _text(data, field):
+            raise ValidationError(f'{field} is required')
+
+    title = _text(data, 'title')
+    content = _text(data, 'content')
+
+    if len(title) < 5:
+        raise ValidationError('Title must be at least 5 characters long')
+
+    if len(content) < 50:
+        raise ValidationError('Content must be at least 50 characters long')
+
+    # Validate category
+    try:
+        category_enum = NewsCategory(_text(data, 'category'))
+    except ValueError:
+        raise ValidationError('Invalid category')
+
+    return {
+        'title': title,
+        'content': content,
+        'excerpt': _text(data, 'excerpt'),
+        'category': category_enum,
+        'meta_description': _text(data, 'meta_description'),
+        'featured_image': _text(data, 'featured_image'),
+        'featured_image_alt': _text(data, 'featured_image_alt'),
+        'tags': _text(data, 'tags'),
+    }
+
+
+def validate_research_paper(data):
+    """Check a paper's metadata fields; returns them cleaned, category as enum"""
+    title = _text(data, 'title')
+    abstract = _text(data, 'abstract')
+    category = _text(data, 'category')
+
+    if not all([title, abstract, category]):
+        raise ValidationError('Title, abstract, and category are required')
+
+    if len(title) < 10:
+        raise ValidationError('Title must be at least 10 characters long')
+
+    if len(abstract) < 50:
+        raise ValidationError('Abstract must be at least 50 characters long')
+
+    # Validate category
+    try:
+        category_enum = ResearchCategory(category)
+    except ValueError:
+        raise ValidationError('Invalid category')
+
+    return {
+        'title': title,
+        'abstract': abstract,
+        'keywords': _text(data, 'keywords'),
+        'category': category_enum,
+    }